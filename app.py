@@ -11,7 +11,15 @@ import streamlit as st
 import sys
 from io import BytesIO
 import base64
-from utils import generate_grayscale, draw_km, median_duration, logrank_p_table, heighlight_value, hazard_table, download_button, custom_color_and_style
+from subgroup_forest import draw_forest
+from event_summary import pool_summaries
+from endpoints import stack_endpoints
+from curve_artifact import load_artifact
+from background import start_task_group
+from parametric_engine import DISTRIBUTIONS
+from turnbull import turnbull_median_table
+from validation import summarize_report
+from utils import report_download_button, cached_turnbull_fitters, show_hazard, show_power_simulation, show_landmark_analysis, parametric_tables, cached_parametric_fits, show_parametric_models, choose_models, lifetimes_png, MAX_LIFETIME_ROWS, cached_group_event_tables, cached_read_endpoints, cached_endpoint_summary, artifact_download_button, show_interactive_km, km_panels_png, pairwise_options, page_slice, show_p_table, km_figure_png, cached_median_duration, cached_logrank_p_table, cached_stream_event_tables, cached_subgroup_hazard_ratios, group_event_tables, grid_error, summary_download_button, generate_grayscale, draw_km, median_duration, logrank_p_table, heighlight_value, hazard_table, download_button, custom_color_and_style, RESERVED_COLUMNS, hazard_ph_tables, draw_loglogs
 
 
 
@@ -40,6 +48,48 @@ st.write('  ')
 st.text('duration: イベントまでの期間 day, month, yearsいずれも可。')
 st.text('event: 観察期間中のイベントの有無(1 or 0)')
 st.text('subgroup: 群間比較をしたいときはここにラベルを入れてください。')
+st.text('entry: (任意)遅延登録(左切断)がある場合の観察開始時点。durationと同じ起点で入力してください。')
+st.text('weight: (任意)IPTWなどの重み。指定するとKM, 検定, ハザード比が重み付きになります。')
+st.text('lower, upper: (区間打ち切り)イベントが起きた区間。duration, eventの代わりに入力するとTurnbull推定量で描きます。')
+st.text('※複数のエンドポイントはシートを分けるか、OS_duration, OS_eventのように列名の前に名前を付けてください。')
+# ブックは1回だけ読み、全シート・全エンドポイントの列の組をまとめて取り出す
+endpoints = None
+if uploaded_file is not None:
+    try:
+        endpoints, validation_report = cached_read_endpoints(uploaded_file, report=True)
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+    # 行が1つも残らないエンドポイント (テンプレートのままのシートなど) は解析から外す
+    for name in [name for name, df_ in endpoints.items() if len(df_) == 0]:
+        st.warning(f'{name}: 解析できる行がないため表示しません。')
+    endpoints = {name: df_ for name, df_ in endpoints.items() if len(df_) > 0}
+    if not endpoints:
+        st.error('解析できる行がありません。データを確認してください。')
+        st.stop()
+    if len(validation_report):
+        dropped = validation_report[validation_report['処理'] == '除外'].drop_duplicates(['エンドポイント', '行'])
+        st.text(f'●データの確認: {len(dropped)}行を除外し、'
+                f'{(validation_report["処理"] == "修正").sum()}件の値を修正しました。')
+        with st.expander('除外・修正した行'):
+            st.table(summarize_report(validation_report))
+            st.markdown(report_download_button(validation_report, "validation_report"), unsafe_allow_html=True)
+
+with st.expander('大規模データ(CSV, Parquet, npy)'):
+    st.text('行数の多いデータはチャンクごとに集計してKM, 生存期間, Logrank検定を行います。')
+    st.text('(行データを保持しないため、ハザード比は表示されません)')
+    st.text('アップロードしたファイルはメモリに載るので、大きさはアップロードの上限(既定200MB)までです。')
+    large_file = st.file_uploader('CSV, Parquet, npyファイル', type=['csv', 'parquet', 'npy'])
+large_source = large_file
+
+with st.expander('多施設の集計データ'):
+    st.text('各施設で書き出した集計ファイル(JSON)を複数アップロードすると、統合したKM, 生存期間, Logrank検定を行います。')
+    st.text('集計ファイルには時点ごとの人数だけが含まれ、患者ごとのデータは含まれません。')
+    summary_files = st.file_uploader('集計ファイル', type=['json'], accept_multiple_files=True)
+
+with st.expander('保存した解析ファイル'):
+    st.text('このAppで書き出した解析ファイル(kmc)から、計算し直さずにKM曲線と検定結果を表示します。')
+    artifact_file = st.file_uploader('解析ファイル', type=['kmc'])
 
 
 st.write('---')
@@ -49,6 +99,11 @@ with col1:
     xlabel = st.text_input('横軸のラベル', value='期間')
 with col2:
     ylabel = st.text_input('縦軸のラベル', value='生存率')
+endpoint = None
+if endpoints is not None and len(endpoints) > 1:
+    endpoint = st.selectbox('エンドポイント', ['すべて(並べて表示)'] + list(endpoints))
+elif endpoints is not None:
+    endpoint = list(endpoints)[0]
 
 ##################################
 ##################################
@@ -57,8 +112,7 @@ with col2:
 color_style = st.sidebar.selectbox('スタイル', ('グレースケール', 'グレー', 'NEJM', 'Lancet', 'カスタム'))
 if color_style == 'グレースケール':
     if uploaded_file is not None:
-        df = pd.read_excel(uploaded_file, header=0)
-        df = df.fillna({'subgroup':'None'})
+        df = stack_endpoints(endpoints)
         color = generate_grayscale(len(set(df.subgroup)))
     else:
         df = pd.read_excel('sample_table/sampleExcel.xlsx', header=0)
@@ -70,12 +124,10 @@ if color_style == 'グレースケール':
         
 elif color_style == 'グレー':
     if uploaded_file is not None:
-        df = pd.read_excel(uploaded_file, header=0)
-        df = df.fillna({'subgroup':'None'})
+        df = stack_endpoints(endpoints)
         if len(set(df.subgroup)) > 4:
-            st.sidebar.write('このスタイルは4群まで対応しています。')
-        else:
-            color = 'gray'
+            st.sidebar.write('このスタイルは4群まで対応しています。5群以上はグループの「パネル表示」を使ってください。')
+        color = 'gray'
     linestyle_choice = False
             
 elif color_style == 'NEJM':
@@ -102,11 +154,30 @@ event_flag = st.sidebar.selectbox('イベント発生', (1, 0))
 
 #-----------------------------------
 st.sidebar.write('---')
-by_sub = st.sidebar.selectbox('グループ', ('グループごと', '全体集団'))
+calc_mode = st.sidebar.selectbox('計算モード', ('厳密', '近似(時間グリッド)'))
+if calc_mode == '近似(時間グリッド)':
+    grid_width = st.sidebar.number_input('グリッドの幅(durationの単位)', min_value=0.001, value=7.0)
+    st.sidebar.text('ダウンロードする図表は厳密な計算で作ります。')
+else:
+    grid_width = None
+
+#-----------------------------------
+st.sidebar.write('---')
+by_sub = st.sidebar.selectbox('グループ', ('グループごと', '全体集団', 'パネル表示'))
 if by_sub == 'グループごと':
     by_subgroup = True 
 elif by_sub == '全体集団':
     by_subgroup = False
+elif by_sub == 'パネル表示':
+    # 群が多いときは1群1パネルに分けて並べる
+    by_subgroup = True
+panels = by_sub == 'パネル表示'
+
+#-----------------------------------
+st.sidebar.write('---')
+view_mode = st.sidebar.selectbox('KM曲線の表示', ('静止画', 'インタラクティブ'))
+# インタラクティブ表示はブラウザ側で描くので、ズームや群の切り替えで再計算しない
+interactive = view_mode == 'インタラクティブ' and not panels
     
 #-----------------------------------
 st.sidebar.write('---')
@@ -118,8 +189,20 @@ elif censor_flag=='無':
     
 #-----------------------------------
 st.sidebar.write('---')
-ci_flag = st.sidebar.selectbox('信頼区間表示', ('無', '有'))
+ci_flag = st.sidebar.selectbox('信頼区間表示', ('無', '有', '同時信頼帯(Hall-Wellner)', '同時信頼帯(EP)'))
 ci = False if ci_flag=='無' else True
+# 同時信頼帯: 表示している期間全体で95%の確率で曲線を含む帯 (各時点の信頼区間より広い)
+ci_band = {'同時信頼帯(Hall-Wellner)': 'hall-wellner', '同時信頼帯(EP)': 'equal-precision'}.get(ci_flag)
+
+#-----------------------------------
+st.sidebar.write('---')
+parametric_model = st.sidebar.selectbox('パラメトリックモデル', ['なし', 'AIC最小'] + list(DISTRIBUTIONS.values()))
+# 表示名 -> parametric_engineのモデル名 ('AIC最小'は群ごとに選ぶのでNone)
+model_names = {label: name for name, label in DISTRIBUTIONS.items()}
+extrapolate = 1.0
+if parametric_model != 'なし':
+    extrapolate = st.sidebar.slider('外挿する範囲(最長の追跡期間の倍数)', min_value=1.0, max_value=3.0, value=1.5, step=0.1)
+    st.sidebar.text('インタラクティブ表示とパネル表示では曲線に重ねません。')
 
     
 #-----------------------------------   
@@ -137,35 +220,376 @@ fontname = st.sidebar.selectbox('N at risk　フォント', ('Arial', 'Times New
 
 ##################################
 # ファイルアップロード後の処理
-if uploaded_file is not None:
-    df = pd.read_excel(uploaded_file, header=0)
-    df['subgroup'] = df['subgroup'].astype(str)
-    df = df.dropna(subset=['duration', 'event'])
-    df = df.fillna({'subgroup':'None'})
+# 複数のエンドポイント: エンドポイントごとの計算をワーカーで並列に行い、1枚の図と表のタブにまとめる
+if endpoint == 'すべて(並べて表示)':
+    subgroup = sorted(set(stack_endpoints(endpoints).subgroup))
+    if color_style=='カスタム':
+        color, linestyle = custom_color_and_style(subgroup)
+        style_choice_list = linestyle
+    tasks = start_task_group(st.session_state)
+    for name, df_ in endpoints.items():
+        tasks.submit(name, cached_endpoint_summary, df_, event_flag=event_flag, width=grid_width)
+    km_area = st.empty()
+    km_area.text('KM曲線を作成中...')
+    km_download_area = st.empty()
+    tabs = dict(zip(endpoints, st.tabs(list(endpoints))))
+    summaries = {}
+    for name, result, error in tasks.results():
+        if error is not None:
+            tabs[name].error(f'計算できませんでした: {error}')
+            continue
+        summaries[name] = result
+        with tabs[name]:
+            st.text('●生存期間')
+            st.table(result['median'])
+            if 'logrank' in result:
+                st.text('●Logrank/Wilcoxon検定')
+                show_p_table(st.empty(), result['logrank'])
+    # 各エンドポイントを1パネルにして並べる (群の色はパネル間で共通)
+    panel_tables = {(name, group): table for name in endpoints if name in summaries
+                    for group, table in summaries[name]['tables'].items()}
+    if panel_tables:
+        km_png = km_panels_png(panel_tables, color=color, linestyles=style_choice_list if linestyle_choice else None,
+                               facet='エンドポイント', ncols=min(3, len(summaries)),
+                               panel_size=(size[0] / 2, size[1] / 2), title=title, xlabel=xlabel, ylabel=ylabel,
+                               censor=censor, ci=ci, ci_band=ci_band, at_risk=at_risk, fontname=fontname)
+        km_area.image(km_png)
+        km_download_area.markdown(download_button(km_png, "km_curve"), unsafe_allow_html=True)
+
+
+# 区間打ち切りデータ: Turnbull推定量(NPMLE)を通常のKMと同じ体裁で描く
+elif uploaded_file is not None and 'lower' in endpoints[endpoint].columns:
+    df = endpoints[endpoint]
+    subgroup = df.subgroup.unique()
+    if color_style=='カスタム':
+        color, linestyle = custom_color_and_style(subgroup)
+        style_choice_list = linestyle
+    st.text('区間打ち切りデータ(lower, upper)のため、Turnbull推定量(NPMLE)で生存率を推定します。')
+    st.text('生存率は各最小区間の右端で下がる階段で描き、N at riskはlowerの時点までイベントがない人数です。')
+    st.text('(信頼区間, 群間の検定, ハザード比は表示されません)')
+    fitters = cached_turnbull_fitters(df, by_subgroup=by_subgroup)
+    km_options = dict(color=color, size=size, by_subgroup=by_subgroup,
+                      linestyle_choice=linestyle_choice, style_choice_list=style_choice_list,
+                      title=title, xlabel=xlabel, ylabel=ylabel, censor=censor,
+                      ci=False, ci_band=None, at_risk=at_risk, event_flag=event_flag,
+                      fontsize=fontsize, fontname=fontname)
+    km_area = st.empty()
+    km_download_area = st.empty()
+    if interactive:
+        show_interactive_km(km_area, km_download_area, fitters, km_options)
+    else:
+        if panels:
+            km_png = km_panels_png(fitters, color=color, linestyles=style_choice_list if linestyle_choice else None,
+                                   panel_size=(size[0] / 2, size[1] / 2), title=title,
+                                   xlabel=xlabel, ylabel=ylabel, censor=censor, at_risk=at_risk,
+                                   fontname=fontname)
+        else:
+            km_png = km_figure_png(fitters, **km_options)
+        km_area.image(km_png)
+        km_download_area.markdown(download_button(km_png, "km_curve"), unsafe_allow_html=True)
+    st.text('●生存期間')
+    st.table(turnbull_median_table(fitters))
+
+
+elif uploaded_file is not None:
+    df = endpoints[endpoint]
     subgroup = df.subgroup.unique()
     if color_style=='カスタム':
         color, linestyle = custom_color_and_style(subgroup)
         style_choice_list = linestyle
-    fig = draw_km(df, color=color, size=size, by_subgroup=by_subgroup,
-                    linestyle_choice=linestyle_choice, style_choice_list=style_choice_list,
-                title=title, xlabel=xlabel, ylabel=ylabel, censor=censor, 
-                ci=ci, at_risk=at_risk, event_flag=event_flag,
-                fontsize=fontsize, fontname=fontname)
-    st.pyplot(fig)
-    # if st.button('ダウンロード'):
-    st.markdown(download_button(fig, "km_curve"), unsafe_allow_html=True)
+    tables = cached_group_event_tables(df, event_flag=event_flag, width=grid_width)
+    # ダウンロードするファイル(PNG, 集計ファイル, 解析ファイル)は近似モードでも厳密なevent_tableから作る
+    export_tables = tables if grid_width is None else cached_group_event_tables(df, event_flag=event_flag)
+    if grid_width is not None:
+        st.text(f'近似モード: 厳密なKMとの差は最大 {grid_error(tables, grid_width):.4f} 以下です。')
+    # 先に表示する枠だけ作って統計の計算をワーカーに投げ、KMを描いてから終わった順に埋める
+    tasks = start_task_group(st.session_state)
+    areas = {}
+    facet = None
+    if panels:
+        facet_ = st.selectbox('パネルの分け方', ['群ごと'] + [c for c in df.columns if c not in RESERVED_COLUMNS])
+        facet = None if facet_ == '群ごと' else facet_
+    km_area = st.empty()
+    km_area.text('KM曲線を作成中...')
+    km_download_area = st.empty()
+    st.markdown(summary_download_button(export_tables, "event_summary", event_flag=event_flag), unsafe_allow_html=True)
+    artifact_area = st.empty()
     
     st.text('●生存期間')
-    st.table(median_duration(df, event_flag=event_flag))
+    areas['median'] = st.empty()
+    tasks.submit('median', cached_median_duration, tables)
     subgroup = df.subgroup.unique()
     if len(subgroup) >= 2:
         st.text('●Logrank/Wilcoxon検定')
-        p_df = logrank_p_table(df, event_flag=event_flag)
-        st.table(p_df.style.applymap(heighlight_value, subset=['logrank-p', 'wilcoxon-p']))
+        pairs, adjust, sort_by_p = pairwise_options(subgroup)
+        if sort_by_p:
+            # 並べ替えには全ての組み合わせのp値が要るので先に計算する (event_tableから計算するので速い)
+            p_df = cached_logrank_p_table(tables, pairs=pairs, adjust=adjust)
+            order = np.argsort(p_df['logrank-p'].values, kind='mergesort')
+            p_df = p_df.iloc[order].reset_index(drop=True)
+            pairs = [pairs[i] for i in order]
+        rows = page_slice(len(pairs))
+        logrank_area = st.empty()
+        if sort_by_p:
+            show_p_table(logrank_area, p_df, rows)
+        else:
+            areas['logrank'] = logrank_area
+            tasks.submit('logrank', cached_logrank_p_table, tables, pairs=pairs, adjust=adjust)
         st.text('●ハザード比(対象群/参照群)')
         inverse = st.checkbox('対象, 参照反転')
-        cox_df = hazard_table(df, inverse=inverse, event_flag=event_flag)
-        st.table(cox_df)
+        covariate_candidates = [c for c in df.columns if c not in RESERVED_COLUMNS]
+        col1, col2 = st.columns(2)
+        with col1:
+            covariates = st.multiselect('調整する共変量', covariate_candidates)
+        with col2:
+            strata_ = st.selectbox('層別化', ['なし'] + covariate_candidates)
+        strata = None if strata_ == 'なし' else strata_
+        areas['cox'] = st.empty()
+        # ハザード比は表示しているページの組み合わせだけfitする
+        tasks.submit('cox', hazard_ph_tables, df, inverse=inverse, event_flag=event_flag,
+                     covariates=[c for c in covariates if c != strata], strata=strata, pairs=pairs[rows])
+        with st.expander('比例ハザード性の確認'):
+            st.text('●log(-log(生存率)) vs log(期間)')
+            areas['loglog'] = st.empty()
+            tasks.submit('loglog', draw_loglogs, df, color=color, size=size, event_flag=event_flag)
+            st.text('●Schoenfeld残差による検定(時間変換: rank)')
+            ph_area = st.empty()
+
+        st.text('●サブグループ解析(forest plot)')
+        with st.expander('層別変数ごとのハザード比'):
+            col1, col2 = st.columns(2)
+            with col1:
+                reference = st.selectbox('参照群', subgroup)
+            with col2:
+                target = st.selectbox('対象群', [g for g in subgroup if g != reference])
+            forest_columns = st.multiselect('層別する列', covariate_candidates)
+            if forest_columns:
+                forest_area = st.empty()
+                forest_download_area = st.empty()
+                areas['forest'] = st.empty()
+                tasks.submit('forest', cached_subgroup_hazard_ratios, df, reference, target, forest_columns,
+                             event_flag=event_flag)
+    for area in areas.values():
+        area.text('計算中...')
+
+    km_options = dict(color=color, size=size, by_subgroup=by_subgroup,
+                      linestyle_choice=linestyle_choice, style_choice_list=style_choice_list,
+                      title=title, xlabel=xlabel, ylabel=ylabel, censor=censor,
+                      ci=ci, ci_band=ci_band, at_risk=at_risk, event_flag=event_flag,
+                      fontsize=fontsize, fontname=fontname)
+    parametric_options = {}
+    if parametric_model != 'なし':
+        # 全モデルをまとめてfitしてキャッシュし、表示するモデルは選ぶだけ
+        fit_tables = parametric_tables(tables, by_subgroup)
+        parametric_fits = cached_parametric_fits(fit_tables)
+        parametric_models = choose_models(parametric_fits, model_names.get(parametric_model))
+        parametric_options = dict(parametric=parametric_models, extrapolate=extrapolate)
+    if interactive:
+        show_interactive_km(km_area, km_download_area, tables, km_options, export_tables=export_tables)
+    else:
+        # 近似モードでは表示する図と別に、ダウンロードする図を厳密な表で描く
+        km_pngs = []
+        for km_tables in ([tables] if export_tables is tables else [tables, export_tables]):
+            if panels:
+                km_pngs.append(km_panels_png(df if facet else km_tables, color=color,
+                                             linestyles=style_choice_list if linestyle_choice else None, facet=facet,
+                                             panel_size=(size[0] / 2, size[1] / 2), title=title,
+                                             xlabel=xlabel, ylabel=ylabel, censor=censor, ci=ci, ci_band=ci_band,
+                                             at_risk=at_risk, event_flag=event_flag, fontname=fontname))
+            else:
+                km_pngs.append(km_figure_png(km_tables, **km_options, **parametric_options))
+        km_area.image(km_pngs[0])
+        # if st.button('ダウンロード'):
+        km_download_area.markdown(download_button(km_pngs[-1], "km_curve"), unsafe_allow_html=True)
+
+    test_results = {}
+    for name, result, error in tasks.results():
+        if error is not None:
+            areas[name].error(f'計算できませんでした: {error}')
+        elif name == 'median':
+            areas[name].table(result)
+            test_results[name] = result
+        elif name == 'logrank':
+            show_p_table(areas[name], result, rows)
+            test_results[name] = result
+        elif name == 'cox':
+            cox_df, ph_df = result
+            areas[name].table(cox_df)
+            test_results[name] = cox_df
+            ph_area.table(ph_df.style.applymap(heighlight_value, subset=['p']))
+        elif name == 'loglog':
+            areas[name].pyplot(result)
+        elif name == 'forest':
+            forest_fig = draw_forest(result, reference, target, size=size, title=title)
+            forest_area.pyplot(forest_fig)
+            forest_download_area.markdown(download_button(forest_fig, "forest_plot"), unsafe_allow_html=True)
+            areas[name].table(result)
+    if len(subgroup) >= 2 and sort_by_p:
+        test_results['logrank'] = p_df
+    if export_tables is not tables:
+        # 解析ファイルに保存する生存期間とLogrank検定も厳密な表で計算し直す
+        test_results['median'] = cached_median_duration(export_tables)
+        if 'logrank' in test_results:
+            p_df = cached_logrank_p_table(export_tables, pairs=pairs, adjust=adjust)
+            if sort_by_p:
+                p_df = p_df.sort_values('logrank-p', kind='mergesort').reset_index(drop=True)
+            test_results['logrank'] = p_df
+    if parametric_options:
+        show_parametric_models(fit_tables, parametric_fits, parametric_models, color=color, size=size)
+    show_landmark_analysis(tables, pairs=pairs if len(subgroup) >= 2 else None, color=color, size=size,
+                           title=title, xlabel=xlabel, ylabel=ylabel, censor=censor, ci=ci, ci_band=ci_band,
+                           at_risk=at_risk, fontname=fontname)
+    show_hazard(tables, color=color, size=size, ci=ci, title=title, xlabel=xlabel)
+    show_power_simulation(tables, xlabel=xlabel)
+    artifact_area.markdown(artifact_download_button(export_tables, "km_analysis", style=km_options,
+                                                    tests=test_results, event_flag=event_flag),
+                           unsafe_allow_html=True)
+
+    st.text('●スイマープロット(各症例の観察期間)')
+    with st.expander('症例ごとの観察期間とイベント'):
+        st.text(f'症例が多いときは各群で間引いて最大{MAX_LIFETIME_ROWS}例を表示します。')
+        if st.checkbox('スイマープロットを作成'):
+            lifetime_png = lifetimes_png(df, color=color, size=size, event_flag=event_flag, title=title, xlabel=xlabel)
+            st.image(lifetime_png)
+            st.markdown(download_button(lifetime_png, "swimmer_plot"), unsafe_allow_html=True)
+
+
+# 大規模データ, 多施設の集計データ: 群ごとのevent_tableだけで解析する
+elif large_source is not None or summary_files:
+    # ダウンロードするファイル(PNG, 集計ファイル, 解析ファイル)は近似モードでも厳密なevent_tableから作るので、
+    # 厳密な表を1回だけ作り, 表示用の近似の表はそれをグリッドにまとめ直す
+    if large_source is not None:
+        export_tables = cached_stream_event_tables(large_source, event_flag=event_flag)
+    else:
+        headers, export_tables = pool_summaries(summary_files)
+        event_flag = headers[0]['event_flag']
+        st.text('統合した施設: ' + ', '.join(h['site'] or '(施設名なし)' for h in headers))
+    tables = group_event_tables(export_tables, width=grid_width)
+    if grid_width is not None:
+        st.text(f'近似モード: 厳密なKMとの差は最大 {grid_error(tables, grid_width):.4f} 以下です。')
+    subgroup = list(tables)
+    if color_style=='グレースケール':
+        color = generate_grayscale(len(subgroup))
+    elif color_style=='グレー':
+        color = 'gray'
+    elif color_style=='カスタム':
+        color, linestyle = custom_color_and_style(subgroup)
+        style_choice_list = linestyle
+    tasks = start_task_group(st.session_state)
+    tasks.submit('median', cached_median_duration, tables)
+    km_area = st.empty()
+    km_area.text('KM曲線を作成中...')
+    km_download_area = st.empty()
+    st.text('●生存期間')
+    areas = {'median': st.empty()}
+    if len(subgroup) >= 2:
+        st.text('●Logrank/Wilcoxon検定')
+        pairs, adjust, sort_by_p = pairwise_options(subgroup)
+        rows = page_slice(len(pairs))
+        areas['logrank'] = st.empty()
+        tasks.submit('logrank', cached_logrank_p_table, tables, pairs=pairs, adjust=adjust)
+    for area in areas.values():
+        area.text('計算中...')
+    st.markdown(summary_download_button(export_tables, "event_summary", event_flag=event_flag), unsafe_allow_html=True)
+    artifact_area = st.empty()
+
+    km_options = dict(color=color, size=size, by_subgroup=by_subgroup,
+                      linestyle_choice=linestyle_choice, style_choice_list=style_choice_list,
+                      title=title, xlabel=xlabel, ylabel=ylabel, censor=censor,
+                      ci=ci, ci_band=ci_band, at_risk=at_risk, event_flag=event_flag,
+                      fontsize=fontsize, fontname=fontname)
+    parametric_options = {}
+    if parametric_model != 'なし':
+        # 全モデルをまとめてfitしてキャッシュし、表示するモデルは選ぶだけ
+        fit_tables = parametric_tables(tables, by_subgroup)
+        parametric_fits = cached_parametric_fits(fit_tables)
+        parametric_models = choose_models(parametric_fits, model_names.get(parametric_model))
+        parametric_options = dict(parametric=parametric_models, extrapolate=extrapolate)
+    if interactive:
+        show_interactive_km(km_area, km_download_area, tables, km_options, export_tables=export_tables)
+    else:
+        km_pngs = []
+        for km_tables in ([tables] if export_tables is tables else [tables, export_tables]):
+            if panels:
+                km_pngs.append(km_panels_png(km_tables, color=color,
+                                             linestyles=style_choice_list if linestyle_choice else None,
+                                             panel_size=(size[0] / 2, size[1] / 2), title=title,
+                                             xlabel=xlabel, ylabel=ylabel, censor=censor, ci=ci, ci_band=ci_band,
+                                             at_risk=at_risk, fontname=fontname))
+            else:
+                km_pngs.append(km_figure_png(km_tables, **km_options, **parametric_options))
+        km_area.image(km_pngs[0])
+        km_download_area.markdown(download_button(km_pngs[-1], "km_curve"), unsafe_allow_html=True)
+
+    test_results = {}
+    for name, result, error in tasks.results():
+        if error is not None:
+            areas[name].error(f'計算できませんでした: {error}')
+        elif name == 'median':
+            areas[name].table(result)
+            test_results[name] = result
+        else:
+            if sort_by_p:
+                result = result.sort_values('logrank-p', kind='mergesort').reset_index(drop=True)
+            show_p_table(areas[name], result, rows)
+            test_results[name] = result
+    if export_tables is not tables:
+        test_results['median'] = cached_median_duration(export_tables)
+        if 'logrank' in test_results:
+            p_df = cached_logrank_p_table(export_tables, pairs=pairs, adjust=adjust)
+            if sort_by_p:
+                p_df = p_df.sort_values('logrank-p', kind='mergesort').reset_index(drop=True)
+            test_results['logrank'] = p_df
+    if parametric_options:
+        show_parametric_models(fit_tables, parametric_fits, parametric_models, color=color, size=size)
+    show_landmark_analysis(tables, pairs=pairs if len(subgroup) >= 2 else None, color=color, size=size,
+                           title=title, xlabel=xlabel, ylabel=ylabel, censor=censor, ci=ci, ci_band=ci_band,
+                           at_risk=at_risk, fontname=fontname)
+    show_hazard(tables, color=color, size=size, ci=ci, title=title, xlabel=xlabel)
+    show_power_simulation(tables, xlabel=xlabel)
+    artifact_area.markdown(artifact_download_button(export_tables, "km_analysis", style=km_options,
+                                                    tests=test_results, event_flag=event_flag),
+                           unsafe_allow_html=True)
+
+
+# 保存した解析ファイル: fit済みの曲線と検定結果をそのまま使う (行データもfitも不要)
+elif artifact_file is not None:
+    artifact = load_artifact(artifact_file)
+    if artifact.header['grid_width'] is not None:
+        st.text(f"近似モード(グリッドの幅 {artifact.header['grid_width']:g})で保存した解析です。")
+    keep_style = st.checkbox('保存したときの体裁で表示', value=True)
+    subgroup = list(artifact.curves)
+    if color_style=='グレースケール':
+        color = generate_grayscale(len(subgroup))
+    elif color_style=='グレー':
+        color = 'gray'
+    elif color_style=='カスタム':
+        color, linestyle = custom_color_and_style(subgroup)
+        style_choice_list = linestyle
+    km_options = dict(color=color, size=size, by_subgroup=by_subgroup,
+                      linestyle_choice=linestyle_choice, style_choice_list=style_choice_list,
+                      title=title, xlabel=xlabel, ylabel=ylabel, censor=censor,
+                      ci=ci, ci_band=ci_band, at_risk=at_risk, event_flag=artifact.event_flag,
+                      fontsize=fontsize, fontname=fontname)
+    if keep_style:
+        km_options.update(artifact.style)
+        km_options['size'] = tuple(km_options['size'])
+    curves = artifact.curves_for(km_options['by_subgroup'])
+    km_area = st.empty()
+    km_download_area = st.empty()
+    if interactive:
+        show_interactive_km(km_area, km_download_area, curves, km_options, cache=False)
+    else:
+        fig = draw_km(curves, **km_options)
+        km_area.pyplot(fig)
+        km_download_area.markdown(download_button(fig, "km_curve"), unsafe_allow_html=True)
+    names = {'median': '●生存期間', 'logrank': '●Logrank/Wilcoxon検定', 'cox': '●ハザード比(対象群/参照群)'}
+    for name, result in artifact.tests.items():
+        st.text(names.get(name, name))
+        if name == 'logrank':
+            show_p_table(st.empty(), result)
+        else:
+            st.table(result)
 
 
 # ファイルが無いときはサンプルを表示できるように
@@ -182,7 +606,7 @@ elif (uploaded_file is None):
         fig = draw_km(df, color=color, size=size, by_subgroup=by_subgroup,
                       linestyle_choice=linestyle_choice, style_choice_list=style_choice_list,
                     title=title, xlabel=xlabel, ylabel=ylabel, censor=censor, 
-                    ci=ci, at_risk=at_risk, event_flag=event_flag,
+                    ci=ci, ci_band=ci_band, at_risk=at_risk, event_flag=event_flag,
                     fontsize=fontsize, fontname=fontname)
         st.pyplot(fig)
         
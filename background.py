@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+
+
+# 全セッションで共有するワーカー (numpy/scipyの計算はGILを離すのでスレッドで並列になる)
+_EXECUTOR = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='km_app')
+
+
+class TaskGroup:
+    '''
+    1回の実行(rerun)で投げた計算をまとめて管理する
+    新しいrerunが始まったらcancelし、まだ始まっていない計算は実行しない
+    すでに始まっている計算は途中で止められないので、終わるまでワーカーを使い続け、結果は捨てられる
+    '''
+
+    def __init__(self):
+        self.futures = {}
+        self.cancelled = False
+
+    def _run(self, func, args, kwargs):
+        if self.cancelled:
+            raise CancelledError()
+        return func(*args, **kwargs)
+
+    def submit(self, name, func, *args, **kwargs):
+        self.futures[name] = _EXECUTOR.submit(self._run, func, args, kwargs)
+
+    def cancel(self):
+        self.cancelled = True
+        for future in self.futures.values():
+            future.cancel()
+
+    def results(self):
+        '''
+        終わった順に (名前, 結果, 例外) を返す
+        '''
+        names = {future: name for name, future in self.futures.items()}
+        for future in as_completed(names):
+            if future.cancelled():
+                continue
+            error = future.exception()
+            yield names[future], None if error is not None else future.result(), error
+
+
+def start_task_group(state, key='_task_group'):
+    '''
+    前回のrerunの計算を取り消して、新しいTaskGroupを作る
+    Args:
+        state: st.session_state
+    '''
+    previous = state.get(key)
+    if previous is not None:
+        previous.cancel()
+    group = TaskGroup()
+    state[key] = group
+    return group
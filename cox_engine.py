@@ -0,0 +1,299 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from survival_engine import _cumsum0
+
+
+def _revcumsum0(x):
+    # 末尾に0を付けた逆向き累積和: out[j] = x[j:].sum()
+    out = np.zeros((x.shape[0] + 1,) + x.shape[1:])
+    out[:-1] = np.cumsum(x[::-1], axis=0)[::-1]
+    return out
+
+
+class _Stratum:
+    '''
+    1つの層について、βに依存しない並べ替えと索引を前計算しておく
+    Newton法の各反復では累積和と行列積だけを行う
+    '''
+
+    def __init__(self, X, durations, events, entry, weights, presorted=False):
+        # durationsが並べ替え済みなら (subgroup_forestの共有配列) コピーせずにそのまま使う
+        self.order = np.arange(len(durations)) if presorted else np.argsort(durations, kind='mergesort')
+        if not presorted:
+            X, durations, events, weights, entry = (a[self.order] for a in (X, durations, events, weights, entry))
+        self.X, self.T, self.E, self.w, self.entry = X, durations, events, weights, entry
+
+        # 遅延登録: entry >= t の個体をリスク集合から除くため、entry順の並びも持つ
+        self.entry_order = np.argsort(self.entry, kind='mergesort')
+        entry_sorted = self.entry[self.entry_order]
+
+        self.ev = np.flatnonzero(self.E)
+        ev_T = self.T[self.ev]
+        self.times, self.ev_first, self.m = np.unique(ev_T, return_index=True, return_counts=True)
+        self.k = np.repeat(np.arange(len(self.times)), self.m)
+        # Efron: 同時点のイベント内での順番 l / m
+        self.f = (np.arange(len(self.ev)) - self.ev_first[self.k]) / self.m[self.k]
+        self.w_bar = np.add.reduceat(self.w[self.ev], self.ev_first) / self.m if len(self.ev) else np.zeros(0)
+        self.d_w = self.w_bar * self.m
+
+        # リスク集合 entry < t_k <= exit の索引
+        self.exit_pos = np.searchsorted(self.T, self.times, side='left')
+        self.entry_pos = np.searchsorted(entry_sorted, self.times, side='left')
+        # 個体ごとに、リスク集合に入っているイベント時点の範囲 (ib, ia]
+        self.ia = np.searchsorted(self.times, self.T, side='right')
+        self.ib = np.searchsorted(self.times, self.entry, side='right')
+
+    def risk_sums(self, values):
+        # Σ_{entry < t_k <= exit} values をイベント時点ごとに求める
+        return (_revcumsum0(values)[self.exit_pos]
+                - _revcumsum0(values[self.entry_order])[self.entry_pos])
+
+    def at_risk_sum(self, g):
+        # 個体ごとに Σ_{k: 個体がリスク集合にいる} g_k
+        G = _cumsum0(g) if g.ndim == 1 else np.vstack([np.zeros((1, g.shape[1])), np.cumsum(g, axis=0)])
+        return G[self.ia] - G[self.ib]
+
+    def derivatives(self, beta):
+        X, w = self.X, self.w
+        eta = X @ beta
+        r = w * np.exp(eta)
+        rx = r[:, None] * X
+
+        S0 = self.risk_sums(r)
+        S1 = self.risk_sums(rx)
+        ev = self.ev
+        D0 = np.add.reduceat(r[ev], self.ev_first) if len(ev) else np.zeros(0)
+        D1 = np.add.reduceat(rx[ev], self.ev_first, axis=0) if len(ev) else np.zeros((0, X.shape[1]))
+
+        # Efronの分母 (イベント行ごと)
+        S0_l = S0[self.k] - self.f * D0[self.k]
+        K = len(self.times)
+        a = np.bincount(self.k, 1 / S0_l, minlength=K)
+        b = np.bincount(self.k, self.f / S0_l, minlength=K)
+        c0 = np.bincount(self.k, 1 / S0_l ** 2, minlength=K)
+        c1 = np.bincount(self.k, self.f / S0_l ** 2, minlength=K)
+        c2 = np.bincount(self.k, self.f ** 2 / S0_l ** 2, minlength=K)
+        wb = self.w_bar
+
+        loglik = np.sum(w[ev] * eta[ev]) - np.sum(wb[self.k] * np.log(S0_l))
+        grad = (w[ev] @ X[ev]) - ((wb * a) @ S1 - (wb * b) @ D1)
+
+        # Σ_k wb a_k S2_k = X^T diag(r A) X  (S2_kはp×pを時点ごとに作らない)
+        A = self.at_risk_sum(wb * a)
+        info = (X * (r * A)[:, None]).T @ X
+        info -= (X[ev] * (r[ev] * (wb * b)[self.k])[:, None]).T @ X[ev]
+        info -= (S1 * (wb * c0)[:, None]).T @ S1
+        cross = (S1 * (wb * c1)[:, None]).T @ D1
+        info += cross + cross.T
+        info -= (D1 * (wb * c2)[:, None]).T @ D1
+        return loglik, grad, info, (r, S0, S1, D0, D1)
+
+    def score_residuals(self, beta, cache):
+        # Breslow近似のscore残差 (robust分散用)。元の並び順に戻して返す
+        r, S0, S1 = cache[:3]
+        x_bar = S1 / S0[:, None]
+        d_lambda = self.d_w / S0
+        exp_eta = r / self.w
+        resid = -exp_eta[:, None] * (self.X * self.at_risk_sum(d_lambda)[:, None]
+                                     - self.at_risk_sum(x_bar * d_lambda[:, None]))
+        resid[self.ev] += self.X[self.ev] - x_bar[self.k]
+        return resid
+
+    def schoenfeld_residuals(self, cache):
+        # Efron法に合わせ、同時点のイベントでは x̄ を l = 0..m-1 の平均にする
+        r, S0, S1, D0, D1 = cache
+        S0_l = S0[self.k] - self.f * D0[self.k]
+        K = len(self.times)
+        a = np.bincount(self.k, 1 / S0_l, minlength=K)
+        b = np.bincount(self.k, self.f / S0_l, minlength=K)
+        x_bar = (S1 * a[:, None] - D1 * b[:, None]) / self.m[:, None]
+        return self.X[self.ev] - x_bar[self.k]
+
+
+class EfronCoxFitter:
+    '''
+    Efron法で同時点のイベントを扱うCox比例ハザードモデル
+    引数と結果の属性名はlifelinesのCoxPHFitterに揃えている
+    (entry_col, weights_col, strata, robust に対応)
+    '''
+
+    def __init__(self, alpha=0.05, tol=1e-9, max_iter=50):
+        self.alpha = alpha
+        self.tol = tol
+        self.max_iter = max_iter
+
+    def fit(self, df, duration_col, event_col, entry_col=None, weights_col=None,
+            strata=None, robust=False):
+        if isinstance(strata, str):
+            strata = [strata]
+        reserved = [duration_col, event_col, entry_col, weights_col] + list(strata or [])
+        self.duration_col, self.event_col = duration_col, event_col
+        self.entry_col, self.weights_col, self.strata = entry_col, weights_col, strata
+        strata_labels = None
+        if strata:
+            _, strata_labels = np.unique(df[strata].astype(str).agg('|'.join, axis=1).values, return_inverse=True)
+        return self.fit_arrays(
+            df[[c for c in df.columns if c not in reserved]], df[duration_col].values, df[event_col].values,
+            entry=df[entry_col].values if entry_col else None,
+            weights=df[weights_col].values if weights_col else None,
+            strata_labels=strata_labels, robust=robust)
+
+    def fit_arrays(self, X, durations, events, entry=None, weights=None, strata_labels=None,
+                   robust=False, presorted=False):
+        '''
+        配列から直接fitする (同じデータの部分集合を何度もfitするとき用)
+        Args:
+            X: 共変量のDataFrame (列名が係数の名前になる)
+            strata_labels: 層の番号 (0, 1, ...) の配列
+            presorted: durationsが昇順に並んでいれば、層ごとの並べ替えを省く
+        '''
+        all_covariates = list(X.columns)
+        # 値が一定の共変量 (性別で分けた群の中での性別など) は推定できないので除いてfitし、係数はNaNにする
+        X = X.values.astype(float)
+        keep = X.std(0) > 0
+        covariates = [c for c, k in zip(all_covariates, keep) if k]
+        if not covariates:
+            raise ValueError('推定できる共変量がありません(すべての共変量の値が一定です)。')
+        X = X[:, keep]
+        self.covariates = covariates
+        self.dropped_covariates_ = [c for c, k in zip(all_covariates, keep) if not k]
+
+        durations = np.asarray(durations, dtype=float)
+        events = np.asarray(events).astype(bool)
+        entry = np.full(len(durations), -np.inf) if entry is None else np.asarray(entry, dtype=float)
+        weights = np.ones(len(durations)) if weights is None else np.asarray(weights, dtype=float)
+
+        # 数値安定のため標準化してfitし、最後に元のスケールへ戻す
+        self._norm_mean = X.mean(0)
+        self._norm_std = X.std(0)
+        Z = (X - self._norm_mean) / self._norm_std
+
+        if strata_labels is not None:
+            groups = [np.flatnonzero(strata_labels == i) for i in range(strata_labels.max() + 1)]
+        else:
+            # 層がなければ全行 (sliceなのでコピーしない)
+            groups = [slice(None)]
+        self._strata_index = groups
+        self._strata = [_Stratum(Z[ix], durations[ix], events[ix], entry[ix], weights[ix], presorted=presorted)
+                        for ix in groups]
+
+        beta, loglik, info, caches = self._newton(np.zeros(Z.shape[1]))
+        naive_variance = np.linalg.inv(info)
+        variance = naive_variance
+        if robust:
+            scores = np.zeros_like(Z)
+            for ix, stratum, cache in zip(groups, self._strata, caches):
+                resid = np.empty_like(stratum.X)
+                resid[stratum.order] = stratum.score_residuals(beta, cache)
+                scores[ix] = resid * weights[ix][:, None]
+            variance = naive_variance @ (scores.T @ scores) @ naive_variance
+
+        self._beta_norm = beta
+        self._information_norm = info
+        self._variance_norm = naive_variance
+        self._caches = caches
+        self.log_likelihood_ = loglik
+        self.params_ = pd.Series(beta / self._norm_std, index=covariates, name='coef')
+        self.variance_matrix_ = pd.DataFrame(variance / np.outer(self._norm_std, self._norm_std),
+                                             index=covariates, columns=covariates)
+        self.standard_errors_ = pd.Series(np.sqrt(np.diag(self.variance_matrix_.values)),
+                                          index=covariates, name='se(coef)')
+        z = stats.norm.ppf(1 - self.alpha / 2)
+        self.confidence_intervals_ = pd.DataFrame({
+            '%g%% lower-bound' % (100 * (1 - self.alpha)): self.params_ - z * self.standard_errors_,
+            '%g%% upper-bound' % (100 * (1 - self.alpha)): self.params_ + z * self.standard_errors_,
+        })
+        self.hazard_ratios_ = np.exp(self.params_).rename('exp(coef)')
+        self.summary = pd.DataFrame({
+            'coef': self.params_,
+            'exp(coef)': self.hazard_ratios_,
+            'se(coef)': self.standard_errors_,
+            'exp(coef) lower 95%': np.exp(self.confidence_intervals_.iloc[:, 0]),
+            'exp(coef) upper 95%': np.exp(self.confidence_intervals_.iloc[:, 1]),
+            'p': 2 * stats.norm.sf(np.abs(self.params_ / self.standard_errors_)),
+        })
+        if self.dropped_covariates_:
+            # 除いた共変量もNaNの行として残す (呼び出し側は列名で参照するので)
+            self.params_ = self.params_.reindex(all_covariates)
+            self.variance_matrix_ = self.variance_matrix_.reindex(index=all_covariates, columns=all_covariates)
+            self.standard_errors_ = self.standard_errors_.reindex(all_covariates)
+            self.confidence_intervals_ = self.confidence_intervals_.reindex(all_covariates)
+            self.hazard_ratios_ = self.hazard_ratios_.reindex(all_covariates)
+            self.summary = self.summary.reindex(all_covariates)
+        return self
+
+    def _derivatives(self, beta):
+        loglik, grad, info, caches = 0., np.zeros_like(beta), np.zeros((len(beta), len(beta))), []
+        for stratum in self._strata:
+            l_, g_, i_, cache = stratum.derivatives(beta)
+            loglik += l_
+            grad += g_
+            info += i_
+            caches.append(cache)
+        return loglik, grad, info, caches
+
+    def _newton(self, beta):
+        loglik, grad, info, caches = self._derivatives(beta)
+        new = (loglik, grad, info, caches)
+        for _ in range(self.max_iter):
+            step = np.linalg.solve(info, grad)
+            # 対数尤度が下がるときはステップを半分にする
+            for _ in range(20):
+                new = self._derivatives(beta + step)
+                if new[0] >= loglik - 1e-12:
+                    break
+                step = step / 2
+            beta = beta + step
+            converged = abs(new[0] - loglik) < self.tol or np.max(np.abs(step)) < self.tol
+            loglik, grad, info, caches = new
+            if converged:
+                break
+        return beta, loglik, info, caches
+
+
+#-----------------------------------
+# 比例ハザード性の検定
+def proportional_hazard_test(cph, time_transform='rank'):
+    '''
+    scaled Schoenfeld残差による比例ハザード性の検定 (Grambsch-Therneau)
+    fit済みのEfronCoxFitterの中間結果を使うので再fitはしない
+    Args:
+        cph: fit済みのEfronCoxFitter
+        time_transform: 'rank' (イベント時点の順位) か 'log' か 'identity'
+    Returns:
+        共変量ごとと全体(global)の検定統計量, 自由度, p値
+    '''
+    resids, times, weights = [], [], []
+    for stratum, cache in zip(cph._strata, cph._caches):
+        resids.append(stratum.schoenfeld_residuals(cache))
+        times.append(stratum.T[stratum.ev])
+        weights.append(stratum.w[stratum.ev])
+    resids = np.vstack(resids)
+    times = np.concatenate(times)
+    weights = np.concatenate(weights)
+
+    if time_transform == 'rank':
+        g = stats.rankdata(times)
+    elif time_transform == 'log':
+        g = np.log(times)
+    else:
+        g = times
+    g = g - np.average(g, weights=weights)
+    n_events = weights.sum()
+
+    V = cph._variance_norm
+    U = (weights * g) @ resids
+    VU = V @ U
+    denominator = np.sum(weights * g ** 2)
+    per_term = n_events * VU ** 2 / (np.diag(V) * denominator)
+    global_ = n_events * (U @ VU) / denominator
+
+    statistics = np.append(per_term, global_)
+    dfs = np.append(np.ones(len(per_term), dtype=int), len(per_term))
+    return pd.DataFrame({
+        'test_statistic': statistics,
+        'df': dfs,
+        'p': stats.chi2.sf(statistics, dfs),
+    }, index=list(cph.covariates) + ['global'])
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from survival_engine import TableKaplanMeierFitter, merge_event_tables
+
+
+# 解析ファイル: fit済みのKM, event_table, 検定結果, 図の体裁を1つのバイナリにまとめる
+# [MAGIC 8byte][ヘッダ長 uint64][ヘッダ(JSON)][配列 (ALIGNごとに揃えて連続で並べる)]
+# 配列はヘッダに書いたoffset, dtype, shapeでそのままmemmapできる
+ARTIFACT_MAGIC = b'KMCURVE\x00'
+ARTIFACT_FORMAT = 'km-curve-artifact'
+ARTIFACT_VERSION = 1
+ALIGN = 64
+
+# 全体集団の曲線 (群名と重ならない名前)
+POOLED_KEY = '__pooled__'
+# 保存する推定値 (event_tableの列のほか)
+ESTIMATE_ARRAYS = ['survival', 'cumulative_sq', 'ci_lower', 'ci_upper']
+
+
+#-----------------------------------
+# 書き出し
+def _curve_arrays(kmf):
+    table = kmf.event_table
+    arrays = {'event_at': table.index.values.astype(float)}
+    arrays.update({c: table[c].values for c in table.columns})
+    arrays.update({
+        'survival': kmf.survival_function_.values[:, 0],
+        'cumulative_sq': kmf._cumulative_sq_,
+        'ci_lower': kmf.confidence_interval_.values[:, 0],
+        'ci_upper': kmf.confidence_interval_.values[:, 1],
+    })
+    return arrays
+
+
+def dump_artifact(tables, style=None, tests=None, event_flag=1, grid_width=None, alpha=0.05):
+    '''
+    解析ファイルのbytesを作る (行データは含まない)
+    Args:
+        tables: {群名: event_table} または {群名: fit済みのTableKaplanMeierFitter}
+        style: draw_kmの引数 (タイトル, 色, 線種など。JSONにできる値だけ)
+        tests: {名前: DataFrame} 生存期間, Logrank検定, ハザード比などの表
+    '''
+    curves = {}
+    for label, table in tables.items():
+        curves[str(label)] = table if isinstance(table, TableKaplanMeierFitter) else \
+            TableKaplanMeierFitter(alpha=alpha).fit_event_table(table, label=label)
+    # 「全体集団」で描くときのために併合したKMも保存する
+    curves[POOLED_KEY] = next(iter(curves.values())) if len(curves) == 1 else \
+        TableKaplanMeierFitter(alpha=alpha).fit_event_table(
+            merge_event_tables([kmf.event_table for kmf in curves.values()]))
+
+    blocks, entries = [], {}
+    offset = 0
+
+    def add(name, values):
+        nonlocal offset
+        values = np.ascontiguousarray(values)
+        if values.dtype == object:
+            raise TypeError(f'{name}: 数値以外の配列は保存できません。')
+        entries[name] = {'offset': offset, 'dtype': values.dtype.str, 'shape': list(values.shape)}
+        data = values.tobytes()
+        pad = -len(data) % ALIGN
+        blocks.append(data + b'\0' * pad)
+        offset += len(data) + pad
+
+    groups = []
+    for label, kmf in curves.items():
+        arrays = _curve_arrays(kmf)
+        for name, values in arrays.items():
+            add(f'curves/{label}/{name}', values)
+        groups.append({'label': label, 'columns': list(kmf.event_table.columns)})
+
+    test_headers = {}
+    for name, result in (tests or {}).items():
+        numeric = [c for c in result.columns if pd.api.types.is_numeric_dtype(result[c])]
+        for c in numeric:
+            add(f'tests/{name}/{c}', result[c].values)
+        # 群名などの文字列の列はヘッダに入れる
+        test_headers[name] = {'columns': [str(c) for c in result.columns], 'numeric': [str(c) for c in numeric],
+                              'text': {str(c): result[c].astype(str).tolist()
+                                       for c in result.columns if c not in numeric}}
+
+    header = json.dumps({
+        'format': ARTIFACT_FORMAT,
+        'version': ARTIFACT_VERSION,
+        'event_flag': event_flag,
+        'grid_width': grid_width,
+        'alpha': alpha,
+        'groups': groups,
+        'style': style or {},
+        'tests': test_headers,
+        'arrays': entries,
+    }, ensure_ascii=False).encode('utf-8')
+    prefix = ARTIFACT_MAGIC + struct.pack('<Q', len(header)) + header
+    prefix += b'\0' * (-len(prefix) % ALIGN)
+    return prefix + b''.join(blocks)
+
+
+def save_artifact(path, tables, **kwargs):
+    with open(path, 'wb') as f:
+        f.write(dump_artifact(tables, **kwargs))
+
+
+#-----------------------------------
+# 読み込み
+class CurveArtifact:
+    '''
+    読み込んだ解析ファイル
+    curvesはfit済みのTableKaplanMeierFitterなので、draw_kmにそのまま渡せば再計算なしで描ける
+    '''
+
+    def __init__(self, header, curves, tests):
+        self.header = header
+        self.style = header['style']
+        self.event_flag = header['event_flag']
+        self.curves = {label: kmf for label, kmf in curves.items() if label != POOLED_KEY}
+        self.pooled = curves[POOLED_KEY]
+        self.tests = tests
+
+    def curves_for(self, by_subgroup=True):
+        # 「全体集団」のときは保存しておいた併合したKMを使う
+        return self.curves if by_subgroup else {'全体': self.pooled}
+
+    def render(self, **style):
+        '''
+        保存した体裁で図を描く。引数で指定したものだけ体裁を変える
+        Returns:
+            matplotlibのFigure
+        '''
+        from utils import draw_km
+        options = dict(self.style, **style)
+        options.setdefault('event_flag', self.event_flag)
+        if 'size' in options:
+            options['size'] = tuple(options['size'])
+        return draw_km(self.curves_for(options.get('by_subgroup', True)), **options)
+
+
+def _read_header(buffer):
+    if bytes(buffer[:8]) != ARTIFACT_MAGIC:
+        raise ValueError('解析ファイルの形式ではありません。')
+    length, = struct.unpack('<Q', bytes(buffer[8:16]))
+    header = json.loads(bytes(buffer[16:16 + length]).decode('utf-8'))
+    if header.get('version', 0) > ARTIFACT_VERSION:
+        raise ValueError(f"新しい形式(version {header['version']})の解析ファイルです。Appを更新してください。")
+    start = 16 + length
+    return header, start + (-start % ALIGN)
+
+
+def load_artifact(source):
+    '''
+    解析ファイルを読み込む
+    ファイルパスのときは配列をmemmapするので、大きなファイルでもすぐに開ける
+    Args:
+        source: ファイルパス, ファイルオブジェクト(st.file_uploaderなど), またはbytes
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        buffer = np.memmap(source, dtype=np.uint8, mode='r')
+    elif isinstance(source, bytes):
+        buffer = np.frombuffer(source, dtype=np.uint8)
+    else:
+        buffer = np.frombuffer(source.getvalue() if hasattr(source, 'getvalue') else source.read(), dtype=np.uint8)
+    header, data_start = _read_header(buffer)
+
+    def array(name):
+        entry = header['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        start = data_start + entry['offset']
+        return buffer[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+
+    curves = {}
+    for group in header['groups']:
+        label = group['label']
+        name = f'curves/{label}/'
+        table = pd.DataFrame({c: array(name + c) for c in group['columns']},
+                             index=pd.Index(array(name + 'event_at'), name='event_at'))
+        estimates = [array(name + a) for a in ESTIMATE_ARRAYS]
+        curves[label] = TableKaplanMeierFitter(alpha=header['alpha']).restore(
+            table, *estimates, label=None if label == POOLED_KEY else label)
+
+    tests = {}
+    for name, test in header['tests'].items():
+        tests[name] = pd.DataFrame({c: array(f'tests/{name}/{c}') if c in test['numeric'] else test['text'][c]
+                                    for c in test['columns']})
+    return CurveArtifact(header, curves, tests)
+
+
+#-----------------------------------
+# コマンドライン: 保存した解析ファイルから図を作り直す
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='解析ファイル(.kmc)からKM曲線を描き直す')
+    parser.add_argument('artifact', help='解析ファイル')
+    parser.add_argument('output', nargs='?', help='出力する画像ファイル (png, pdf, svgなど)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='体裁の変更 (例: --set ci=true --set title="OS")')
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--tests', action='store_true', help='保存した検定結果を表示する')
+    args = parser.parse_args(argv)
+
+    artifact = load_artifact(args.artifact)
+    if args.tests:
+        for name, result in artifact.tests.items():
+            print(f'[{name}]')
+            print(result.to_string(index=False))
+    if args.output:
+        style = {}
+        for item in args.set:
+            key, _, value = item.partition('=')
+            style[key] = _parse_value(value)
+        fig = artifact.render(**style)
+        fig.savefig(args.output, dpi=args.dpi)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,7 @@ __all__ = [
     "cdf_plot",
     "rmst_plot",
     "loglogs_plot",
+    "plot_estimates",
 ]
 
 
@@ -717,6 +718,10 @@ def plot_interval_censored_lifetimes(
     return ax
 
 
+# lifetime plots with more subjects than this are rasterized, even in vector output
+RASTERIZE_LIFETIMES = 500
+
+
 def plot_lifetimes(
     durations,
     event_observed=None,
@@ -725,12 +730,19 @@ def plot_lifetimes(
     sort_by_duration=True,
     event_observed_color="#A60628",
     event_censored_color="#348ABD",
+    colors=None,
+    rasterized=None,
+    linewidth=1.5,
+    marker_size=13,
     ax=None,
     **kwargs
 ):
     """
     Returns a lifetime plot, see examples: https://lifelines.readthedocs.io/en/latest/Survival%20Analysis%20intro.html#Censoring
 
+    All subjects are drawn as one ``LineCollection`` (plus one scatter for the events), so
+    the plot stays fast for many thousands of subjects.
+
     Parameters
     -----------
     durations: (n,) numpy array or pd.Series
@@ -747,6 +759,10 @@ def plot_lifetimes(
       default: "#A60628"
     event_censored_color: str
       default: "#348ABD"
+    colors: (n,) list of colors, optional
+      one color per subject (e.g. by subgroup). Overrides the event/censored colors.
+    rasterized: boolean, optional
+      rasterize the collections in vector output. Default: True above RASTERIZE_LIFETIMES subjects.
 
     Returns
     -------
@@ -763,6 +779,8 @@ def plot_lifetimes(
 
     """
     from matplotlib import pyplot as plt
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import to_rgba_array
 
     if ax is None:
         ax = plt.gca()
@@ -772,7 +790,7 @@ def plot_lifetimes(
     )
 
     N = durations.shape[0]
-    if N > 25:
+    if N > 25 and colors is None:
         warnings.warn(
             "For less visual clutter, you may want to subsample to less than 25 individuals."
         )
@@ -789,21 +807,38 @@ def plot_lifetimes(
         durations = _iloc(durations, ix)
         event_observed = _iloc(event_observed, ix)
         entry = _iloc(entry, ix)
-    for i in range(N):
-        c = event_observed_color if _iloc(event_observed, i) else event_censored_color
-        ax.hlines(i, _iloc(entry, i), _iloc(durations, i), color=c, lw=1.5)
-        if left_truncated:
-            ax.hlines(i, 0, _iloc(entry, i), color=c, lw=1.0, linestyle="--")
-        m = "" if not _iloc(event_observed, i) else "o"
-        ax.scatter(_iloc(durations, i), i, color=c, marker=m, s=13)
+        if colors is not None:
+            colors = [colors[i] for i in np.asarray(ix)]
+    bar_labels = durations.index if label_plot_bars else None
+
+    durations = np.asarray(durations, dtype=float)
+    event_observed = np.asarray(event_observed).astype(bool)
+    entry = np.asarray(entry, dtype=float)
+    y = np.arange(N)
+    if colors is None:
+        rgba = np.where(event_observed[:, None], to_rgba_array(event_observed_color),
+                        to_rgba_array(event_censored_color))
+    else:
+        rgba = to_rgba_array(colors)
+    rasterized = coalesce(rasterized, N > RASTERIZE_LIFETIMES)
+
+    # one segment per subject, all in a single collection
+    segments = np.stack([np.column_stack([entry, y]), np.column_stack([durations, y])], axis=1)
+    ax.add_collection(LineCollection(segments, colors=rgba, linewidths=linewidth, rasterized=rasterized))
+    if left_truncated:
+        truncated = np.stack([np.column_stack([np.zeros(N), y]), np.column_stack([entry, y])], axis=1)
+        ax.add_collection(LineCollection(truncated, colors=rgba, linewidths=linewidth * 2 / 3,
+                                         linestyles="--", rasterized=rasterized))
+    ax.scatter(durations[event_observed], y[event_observed], c=rgba[event_observed], marker="o",
+               s=marker_size, rasterized=rasterized)
     if label_plot_bars:
         ax.set_yticks(range(0, N))
-        ax.set_yticklabels(durations.index)
+        ax.set_yticklabels(bar_labels)
     else:
         from matplotlib.ticker import MaxNLocator
 
         ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-    ax.set_xlim(0)
+    ax.set_xlim(0, max(durations.max(), 0.0) * 1.05 if N else 1)
     ax.set_ylim(-0.5, N)
     return ax
 
@@ -1031,6 +1066,101 @@ def _plot_estimate(
     return plot_estimate_config.ax
 
 
+def _step_vertices(x, y):
+    # same vertices as drawstyle="steps-post": (x0, y0), (x1, y0), (x1, y1), ...
+    return np.column_stack([np.repeat(x, 2)[1:], np.repeat(y, 2)[:-1]])
+
+
+def plot_estimates(
+    fitters,
+    estimate="survival_function_",
+    colors=None,
+    linestyles=None,
+    labels=None,
+    linewidth=None,
+    show_censors=False,
+    censor_styles=None,
+    ci_show=True,
+    ci_alpha=0.3,
+    ci_no_lines=False,
+    ax=None,
+):
+    """
+    Plots the estimates of several fitters at once, straight from their NumPy arrays.
+
+    All curves go into one ``LineCollection``, all censor marks into one ``PathCollection``
+    and all confidence bands into one ``PolyCollection``, so the number of artists does not
+    grow with the number of groups (unlike calling ``_plot_estimate`` once per fitter).
+
+    Parameters
+    -----------
+    fitters: list
+        fitted models with ``timeline``, ``event_table`` and the estimate / confidence interval
+    colors, linestyles, labels: list
+        one entry per fitter. Labels starting with "_" are left out of the legend handles.
+    censor_styles: dict
+        ``marker``, ``ms`` and ``mew`` as in ``_plot_estimate``
+    ci_alpha: float
+        the transparency level of the confidence bands. Default: 0.3
+
+    Returns
+    -------
+    handles:
+        legend proxies (``Line2D`` objects that are not added to the axis)
+    """
+    from matplotlib import pyplot as plt
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.colors import to_rgba
+    from matplotlib.lines import Line2D
+
+    if ax is None:
+        ax = plt.gca()
+    n = len(fitters)
+    colors = [ax._get_lines.get_next_color() for _ in range(n)] if colors is None else list(colors)
+    linestyles = ["solid"] * n if linestyles is None else list(linestyles)
+    labels = [cls._label for cls in fitters] if labels is None else list(labels)
+    linewidth = coalesce(linewidth, plt.rcParams["lines.linewidth"])
+    rgba = [to_rgba(color) for color in colors]
+
+    curves, bands, censor_x, censor_y, censor_c = [], [], [], [], []
+    for cls, colour in zip(fitters, rgba):
+        x = np.asarray(cls.timeline, dtype=float)
+        y = getattr(cls, estimate).values[:, 0]
+        curves.append(_step_vertices(x, y))
+        if ci_show:
+            ci = getattr(cls, "confidence_interval_" + estimate).values
+            bands.append(np.concatenate([_step_vertices(x, ci[:, 1]), _step_vertices(x, ci[:, 0])[::-1]]))
+        if show_censors:
+            censored = cls.event_table["censored"].values > 0
+            times = cls.event_table.index.values[censored].astype(float)
+            censor_x.append(times)
+            censor_y.append(getattr(cls, estimate + "at_times")(times).values)
+            censor_c.append(np.tile(colour, (len(times), 1)))
+
+    if ci_show and bands:
+        band_colors = [(r, g, b, ci_alpha) for r, g, b, _ in rgba]
+        ax.add_collection(
+            PolyCollection(bands, facecolors=band_colors, edgecolors=band_colors,
+                           linewidths=0.0 if ci_no_lines else 1.0),
+            autolim=True,
+        )
+    ax.add_collection(
+        LineCollection(curves, colors=rgba, linestyles=linestyles, linewidths=linewidth), autolim=True
+    )
+    if show_censors and sum(len(t) for t in censor_x) > 0:
+        cs = {"marker": "+", "ms": 12, "mew": 1}
+        cs.update(coalesce(censor_styles, {}))
+        ax.scatter(np.concatenate(censor_x), np.concatenate(censor_y), c=np.concatenate(censor_c),
+                   marker=cs["marker"], s=cs["ms"] ** 2, linewidths=cs["mew"], zorder=2)
+    ax.autoscale_view()
+
+    return [
+        Line2D([], [], color=colour, linestyle=linestyle, linewidth=linewidth, label=label)
+        for colour, linestyle, label in zip(rgba, linestyles, labels)
+        if not str(label).startswith("_")
+    ]
+
+
 class PlotEstimateConfig:
     def __init__(
         self,
@@ -0,0 +1,215 @@
+import functools
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    # 複数のワーカープロセスで削除(eviction)が重ならないようにするファイルロック (POSIXのみ)
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# 保存先と上限サイズは環境変数で変更できる
+CACHE_DIR = os.environ.get('KM_APP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+MAX_BYTES = int(float(os.environ.get('KM_APP_CACHE_MAX_MB', 512)) * 1024 ** 2)
+# 保存形式を変えたときはここを上げて古いキャッシュを無効にする
+CACHE_VERSION = 1
+# 書き込みのたびにディレクトリ全体を数えないよう、合計サイズはこのプロセスで見積もっておく
+# 他のプロセスの書き込みは見積もりに入らないので、EVICT_EVERY回書いたら実際に数え直す
+EVICT_EVERY = 100
+# 上限を超えたら上限のこの割合まで減らす (次の書き込みですぐにまた数え直さないように)
+EVICT_TARGET = 0.9
+_usage = {'bytes': None, 'writes': 0}
+_usage_lock = threading.Lock()
+
+
+def _library_versions():
+    import lifelines, matplotlib, scipy
+    return [CACHE_VERSION, np.__version__, pd.__version__, scipy.__version__,
+            matplotlib.__version__, lifelines.__version__]
+
+
+#-----------------------------------
+# キーの作成
+def _hash_update(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(b'df')
+        _hash_update(h, [list(map(str, obj.columns)), list(map(str, obj.dtypes))])
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(b'series')
+        _hash_update(h, str(obj.name))
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f'nd{obj.dtype}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        # 凡例やパネルの並びは挿入順で決まるので、キーの順番もハッシュに含める
+        h.update(f'dict{len(obj)}'.encode())
+        for key in obj:
+            _hash_update(h, key)
+            _hash_update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'seq{len(obj)}'.encode())
+        for item in obj:
+            _hash_update(h, item)
+    elif hasattr(obj, 'survival_function_'):
+        # fit済みの曲線 (解析ファイル, Turnbull推定量, ランドマークの条件付き曲線) は推定値の中身でハッシュする
+        h.update(b'fitter')
+        # ラベルは凡例に出るので、推定値が同じでもラベルが違えば別のキーにする
+        _hash_update(h, [getattr(obj, '_label', None), list(map(str, obj.survival_function_.columns)),
+                         obj.event_table, obj.survival_function_, obj.confidence_interval_])
+    elif hasattr(obj, 'getvalue'):
+        # st.file_uploaderのファイルなど (メモリ上にあるので中身でハッシュする)
+        h.update(b'file')
+        h.update(obj.getvalue())
+    else:
+        h.update(f'{type(obj).__name__}:{obj!r}'.encode())
+
+
+def cache_key(*parts):
+    '''
+    データのハッシュ, 解析条件, ライブラリのバージョンからキャッシュのキーを作る
+    '''
+    h = hashlib.sha256()
+    _hash_update(h, [_library_versions(), parts])
+    return h.hexdigest()
+
+
+#-----------------------------------
+# 読み書き
+def _path(key):
+    return os.path.join(CACHE_DIR, key[:2], key + '.pkl')
+
+
+def load(key):
+    '''
+    Returns:
+        (見つかったか, 値)
+    '''
+    path = _path(key)
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return False, None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        # 壊れたファイルは消して計算し直す
+        _remove(path)
+        return False, None
+    try:
+        # 最終利用時刻として更新時刻を使う (LRU)
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return True, value
+
+
+def store(key, value):
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 一時ファイルに書いてから置き換えるので、他のプロセスが書きかけのファイルを読むことはない
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(tmp, path)
+    except BaseException:
+        _remove(tmp)
+        raise
+    with _usage_lock:
+        if _usage['bytes'] is not None:
+            _usage['bytes'] += size
+            _usage['writes'] += 1
+        scan = (_usage['bytes'] is None or _usage['bytes'] > MAX_BYTES
+                or _usage['writes'] >= EVICT_EVERY)
+    if scan:
+        evict()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _entries():
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict(max_bytes=None):
+    '''
+    合計サイズがmax_bytesを超えたら、max_bytes × EVICT_TARGET 以下になるまで最後に使われたのが古い順に削除する
+    Returns:
+        削除した後の合計サイズ
+    '''
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, '.lock'), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = sorted(_entries())
+            total = sum(size for _, size, _ in entries)
+            target = max_bytes * EVICT_TARGET if total > max_bytes else max_bytes
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                _remove(path)
+                total -= size
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    if max_bytes == MAX_BYTES:
+        with _usage_lock:
+            _usage['bytes'], _usage['writes'] = total, 0
+    return total
+
+
+def clear():
+    for _, _, path in _entries():
+        _remove(path)
+    with _usage_lock:
+        _usage['bytes'], _usage['writes'] = 0, 0
+
+
+#-----------------------------------
+def memoize(func):
+    '''
+    関数の結果をディスクにキャッシュするデコレータ
+    Streamlitのプロセスが再起動しても、同じデータ・同じ条件なら計算し直さない
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = cache_key(func.__module__, func.__qualname__, args, kwargs)
+        hit, value = load(key)
+        if hit:
+            return value
+        value = func(*args, **kwargs)
+        try:
+            store(key, value)
+        except OSError:
+            # 書き込めないときはキャッシュせずに結果だけ返す
+            pass
+        return value
+    return wrapper
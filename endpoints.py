@@ -0,0 +1,109 @@
+import re
+
+import pandas as pd
+
+from validation import clean_survival, clean_interval, REPORT_COLUMNS
+
+
+# エンドポイントごとの列名 (大文字, 小文字は区別しない)
+#   duration, event              : 1つだけのとき
+#   OS_duration, OS_event        : エンドポイント名が前
+#   duration_OS, event_OS        : エンドポイント名が後
+# 区切り文字は必須 ('prevent', 'eventful'のような列をエンドポイントと見なさない)
+_PREFIXED = re.compile(r'^(?P<endpoint>.+?)[ _.\-](?P<kind>duration|event)$', re.IGNORECASE)
+_SUFFIXED = re.compile(r'^(?P<kind>duration|event)[ _.\-](?P<endpoint>.+)$', re.IGNORECASE)
+
+
+#-----------------------------------
+# 列の検出
+def detect_endpoints(columns):
+    '''
+    duration, eventの列の組をエンドポイントごとに見つける
+    Returns:
+        {エンドポイント名: (durationの列名, eventの列名)} (名前なしの組は '' )
+    '''
+    found = {}
+    for column in columns:
+        name = str(column)
+        if name.lower() in ('duration', 'event'):
+            found.setdefault('', {})[name.lower()] = column
+            continue
+        match = _PREFIXED.match(name) or _SUFFIXED.match(name)
+        if match:
+            found.setdefault(match.group('endpoint'), {})[match.group('kind').lower()] = column
+    # durationとeventが揃っているものだけ
+    return {endpoint: (pair['duration'], pair['event']) for endpoint, pair in found.items()
+            if 'duration' in pair and 'event' in pair}
+
+
+def detect_interval(columns):
+    '''
+    区間打ち切りデータの列 lower, upper (大文字・小文字は問わない) を見つける
+    Returns:
+        (lowerの列名, upperの列名) 見つからなければNone
+    '''
+    found = {str(column).lower(): column for column in columns}
+    if 'lower' in found and 'upper' in found:
+        return found['lower'], found['upper']
+    return None
+
+
+def _normalize(df, duration, event, other_columns):
+    # 解析用の列名(duration, event)にそろえ、他のエンドポイントの列は落としてから検査する
+    df = df.drop(columns=[c for c in other_columns if c not in (duration, event)])
+    df = df.rename(columns={duration: 'duration', event: 'event'})
+    return clean_survival(df, names={'duration': duration, 'event': event})
+
+
+def _normalize_interval(df, lower, upper):
+    # イベントが (lower, upper] の間に起きたことだけがわかっているデータ
+    # upperが空欄なら右側打ち切り(inf), lowerが空欄なら0から、lower == upper ならその時点のイベント
+    df = df.rename(columns={lower: 'lower', upper: 'upper'})
+    return clean_interval(df, names={'lower': lower, 'upper': upper})
+
+
+#-----------------------------------
+# 読み込み
+def read_endpoints(source, report=False):
+    '''
+    Excelファイルを1回だけ読んで、全シート・全エンドポイントの解析用DataFrameを返す
+    各エンドポイントの行は validation で1回だけ検査し、使えない行は除いて型をそろえる
+    Args:
+        source: ファイルパスまたはst.file_uploaderのファイル
+        report: Trueなら除外・修正した行の報告も返す
+    Returns:
+        {エンドポイント名: DataFrame(duration, event, subgroup, ...)}
+        (report=Trueのときは (上のdict, DataFrame(エンドポイント, シート, 行, 列, 値, 処理, 理由)))
+        エンドポイント名は列名から、名前がなければシート名から付ける
+        duration, eventの組がなくlower, upperの列があるシートは区間打ち切りデータ DataFrame(lower, upper, subgroup, ...)
+    '''
+    sheets = pd.read_excel(source, sheet_name=None, header=0)
+    endpoints = {}
+    reports = []
+    for sheet, df in sheets.items():
+        pairs = detect_endpoints(df.columns)
+        used = [c for pair in pairs.values() for c in pair]
+        for endpoint, (duration, event) in pairs.items():
+            name = endpoint or sheet
+            if name in endpoints:
+                # 別のシートに同じ名前のエンドポイントがあるときはシート名を付ける
+                name = f'{sheet}: {name}'
+            endpoints[name], issues = _normalize(df, duration, event, used)
+            reports.append(issues.assign(エンドポイント=name, シート=sheet))
+        interval = detect_interval(df.columns) if not pairs else None
+        if interval is not None:
+            name = sheet if sheet not in endpoints else f'{sheet}: interval'
+            endpoints[name], issues = _normalize_interval(df, *interval)
+            reports.append(issues.assign(エンドポイント=name, シート=sheet))
+    if not endpoints:
+        raise ValueError('duration, event(または区間打ち切りのlower, upper)の列が見つかりません。列名を確認してください。')
+    if report:
+        return endpoints, pd.concat(reports, ignore_index=True)[REPORT_COLUMNS]
+    return endpoints
+
+
+def stack_endpoints(endpoints):
+    '''
+    エンドポイントを縦に並べたDataFrame (endpoint列でパネルを分けて並べて描く用)
+    '''
+    return pd.concat([df.assign(endpoint=name) for name, df in endpoints.items()], ignore_index=True)
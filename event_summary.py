@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from survival_engine import ADDITIVE_COLUMNS, merge_event_tables, _with_at_risk
+
+
+# 多施設共同解析用の集計ファイル (患者ごとの行を含まない)
+SUMMARY_FORMAT = 'km-event-tables'
+SUMMARY_VERSION = 1
+
+
+#-----------------------------------
+# 書き出し
+def dump_summary(tables, site='', event_flag=1):
+    '''
+    群ごとのevent_tableを集計ファイル(JSON)の文字列にする
+    at_riskは足し合わせられないので保存せず、読み込み時に entrance, removed から作り直す
+    Args:
+        tables: {群名: event_table}
+        site: 施設名 (任意)
+        event_flag: 集計したときのイベント発生の値
+    '''
+    groups = {}
+    for label, table in tables.items():
+        columns = [c for c in ADDITIVE_COLUMNS if c in table.columns]
+        group = {'event_at': table.index.values.astype(float).tolist()}
+        group.update({c: table[c].values.astype(float).tolist() for c in columns})
+        groups[str(label)] = group
+    return json.dumps({
+        'format': SUMMARY_FORMAT,
+        'version': SUMMARY_VERSION,
+        'site': site,
+        'event_flag': event_flag,
+        'groups': groups,
+    }, ensure_ascii=False)
+
+
+#-----------------------------------
+# 読み込みと統合
+def load_summary(source):
+    '''
+    集計ファイルを読み込む
+    Args:
+        source: ファイルパス, ファイルオブジェクト, またはJSON文字列
+    Returns:
+        ヘッダ(format, version, site, event_flag)の辞書と {群名: event_table}
+    '''
+    if hasattr(source, 'read'):
+        text = source.read()
+    elif isinstance(source, str) and source.lstrip().startswith('{'):
+        text = source
+    else:
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+    summary = json.loads(text)
+
+    if summary.get('format') != SUMMARY_FORMAT:
+        raise ValueError('集計ファイルの形式ではありません。')
+    if summary.get('version', 0) > SUMMARY_VERSION:
+        raise ValueError(f"新しい形式(version {summary['version']})の集計ファイルです。Appを更新してください。")
+
+    tables = {}
+    for label, group in summary['groups'].items():
+        columns = [c for c in ADDITIVE_COLUMNS if c in group]
+        table = pd.DataFrame({c: np.asarray(group[c], dtype=float) for c in columns},
+                             index=pd.Index(np.asarray(group['event_at'], dtype=float), name='event_at'))
+        if np.any(np.diff(table.index.values) <= 0):
+            raise ValueError(f'{label}: event_atが昇順に並んでいません。')
+        tables[label] = _with_at_risk(table)
+    header = {k: summary.get(k) for k in ['format', 'version', 'site', 'event_flag']}
+    return header, tables
+
+
+def pool_summaries(sources):
+    '''
+    複数施設の集計ファイルを群ごとに統合する
+    各施設の表は時点順なので、群ごとに全施設分をまとめてソート済みの連のマージをするだけでよい
+    Returns:
+        施設ごとのヘッダのリストと {群名: 統合したevent_table}
+    '''
+    headers, by_group = [], {}
+    for source in sources:
+        header, tables = load_summary(source)
+        headers.append(header)
+        for label, table in tables.items():
+            by_group.setdefault(label, []).append(table)
+    if len({h['event_flag'] for h in headers}) > 1:
+        raise ValueError('イベント発生の値(event_flag)が異なる集計ファイルは統合できません。')
+    # アップロードの順番によらないよう群名順にする
+    pooled = {label: by_group[label][0] if len(by_group[label]) == 1 else merge_event_tables(by_group[label])
+              for label in sorted(by_group)}
+    return headers, pooled
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+from matplotlib.colors import to_hex
+
+from survival_engine import TableKaplanMeierFitter
+
+
+# ブラウザ側の描画コード (外部のCDNは使わず、このファイルをHTMLに埋め込む)
+RENDERER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'km_chart.js')
+# 1群あたりに送る頂点の上限 (これを超えると時間軸上で間引く)
+MAX_POINTS = 1500
+
+STYLE_LIST = ['solid', 'dashed', 'dashdot', 'dotted']
+
+
+#-----------------------------------
+# 送るデータ
+def _decimate(timeline, max_points):
+    # 時間軸上で等間隔に近い頂点だけを残す (最初と最後の時点は必ず残す)
+    if len(timeline) <= max_points:
+        return np.arange(len(timeline))
+    grid = np.linspace(timeline[0], timeline[-1], max_points)
+    index = np.searchsorted(timeline, grid, side='right') - 1
+    return np.unique(np.concatenate([[0], index, [len(timeline) - 1]]))
+
+
+def curve_payload(tables, color='gray', linestyles=None, max_points=MAX_POINTS, ci_band=None):
+    '''
+    群ごとのKMを階段の頂点の配列にする (時点, 生存率, 95%CI, N at risk, 打ち切りの位置)
+    Args:
+        tables: {群名: event_table} または {群名: fit済みのTableKaplanMeierFitter}
+        color: 'gray' か群ごとの色のリスト
+        linestyles: 群ごとの線種 (Noneなら'gray'のときだけ線種で区別する)
+        ci_band: 'hall-wellner' か 'equal-precision' なら95%CIの代わりに同時信頼帯を送る
+    '''
+    groups = []
+    for i, (label, table) in enumerate(tables.items()):
+        if isinstance(table, TableKaplanMeierFitter):
+            # 解析ファイルから読んだfit済みの曲線
+            kmf, table = table, table.event_table
+        else:
+            kmf = TableKaplanMeierFitter().fit_event_table(table, label=label)
+        if ci_band:
+            kmf = kmf.with_band(ci_band)
+        timeline = kmf.timeline
+        keep = _decimate(timeline, max_points)
+        t = timeline[keep]
+        ci = kmf.confidence_interval_.values[keep]
+
+        # N at risk: 各頂点の時点でのリスク集合 (KMと同じ数え方)
+        entrance = table['entrance'].values.astype(float)
+        at_risk = table['at_risk'].values - np.concatenate([[0.], entrance[1:]])
+        row = np.searchsorted(table.index.values, t, side='left')
+        n = np.where(row < len(at_risk), at_risk[np.minimum(row, len(at_risk) - 1)], 0.)
+
+        censored = table.index.values[table['censored'].values > 0].astype(float)
+        if len(censored) > max_points:
+            censored = censored[np.linspace(0, len(censored) - 1, max_points).astype(int)]
+
+        if isinstance(color, str):
+            group_color = 'black' if color == 'gray' else color
+            style = STYLE_LIST[i % len(STYLE_LIST)] if color == 'gray' else 'solid'
+        else:
+            group_color = color[i % len(color)]
+            style = 'solid'
+        if linestyles is not None:
+            style = linestyles[i % len(linestyles)]
+        groups.append({
+            'label': str(label),
+            'color': to_hex(group_color, keep_alpha=True),
+            'linestyle': style,
+            't': np.round(t, 6).tolist(),
+            's': np.round(kmf.survival_function_.values[keep, 0], 5).tolist(),
+            'lo': np.round(ci[:, 0], 5).tolist(),
+            'hi': np.round(ci[:, 1], 5).tolist(),
+            'n': np.round(n, 2).tolist(),
+            'ct': np.round(censored, 6).tolist(),
+            'cs': np.round(kmf.survival_function_at_times(censored).values, 5).tolist(),
+        })
+    xmax = max(g['t'][-1] for g in groups) if groups else 1.
+    return {'groups': groups, 'xmax': xmax}
+
+
+#-----------------------------------
+# HTML
+def chart_html(payload, title='', xlabel='期間', ylabel='生存率', ci=False, censor=True, height=480):
+    '''
+    st.components.v1.htmlにそのまま渡せるHTML
+    ズーム, ツールチップ, 群の表示切り替えはブラウザ側だけで行い、Streamlitのrerunは起きない
+    '''
+    data = dict(payload, title=title, xlabel=xlabel, ylabel=ylabel, ci=ci, censor=censor, height=height)
+    with open(RENDERER_PATH, encoding='utf-8') as f:
+        renderer = f.read()
+    # </script> がデータに含まれてもタグが閉じないようにする
+    data_json = json.dumps(data, ensure_ascii=False).replace('</', '<\\/')
+    return f'''<div style="position:relative">
+<div id="km-root" style="width:100%"></div>
+<div id="km-tooltip" style="display:none;position:absolute;pointer-events:none;background:rgba(255,255,255,0.95);
+border:1px solid #bbb;border-radius:3px;padding:4px 6px;font-family:sans-serif;font-size:12px;white-space:nowrap"></div>
+</div>
+<script id="km-data" type="application/json">{data_json}</script>
+<script>{renderer}</script>'''
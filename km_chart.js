@@ -0,0 +1,185 @@
+// カプランマイヤー曲線のインタラクティブ表示 (外部ライブラリなし, SVG)
+// サーバーからは群ごとの階段の頂点 (t, s, lo, hi, n) と打ち切りの位置だけを受け取る
+// ・ドラッグで横軸の範囲を拡大, ダブルクリックで元に戻す
+// ・マウスを重ねると各群の生存率, 95%CI, N at risk を表示
+// ・凡例のクリックで群の表示/非表示
+(function () {
+  'use strict';
+  const data = JSON.parse(document.getElementById('km-data').textContent);
+  const root = document.getElementById('km-root');
+  const tooltip = document.getElementById('km-tooltip');
+  const W = root.clientWidth || 800;
+  const H = data.height;
+  const M = {left: 60, right: 20, top: data.title ? 36 : 16, bottom: 48};
+  const hidden = new Set();
+  const full = [0, data.xmax];
+  let view = full.slice();
+  let dragStart = null;
+
+  const DASH = {solid: '', dashed: '6,4', dashdot: '6,3,1.5,3', dotted: '1.5,3'};
+
+  function sx(t) { return M.left + (t - view[0]) / (view[1] - view[0]) * (W - M.left - M.right); }
+  function sy(s) { return H - M.bottom - s / 1.05 * (H - M.top - M.bottom); }
+  function invx(x) { return view[0] + (x - M.left) / (W - M.left - M.right) * (view[1] - view[0]); }
+
+  function niceTicks(lo, hi, n) {
+    const raw = (hi - lo) / n;
+    const mag = Math.pow(10, Math.floor(Math.log10(raw)));
+    const step = [1, 2, 2.5, 5, 10].map(m => m * mag).find(s => s >= raw) || raw;
+    const ticks = [];
+    for (let t = Math.ceil(lo / step) * step; t <= hi + 1e-9 * step; t += step) ticks.push(+t.toPrecision(12));
+    return ticks;
+  }
+
+  // 右連続の階段: t[i] <= x となる最後のi
+  function lastIndex(t, x) {
+    let lo = 0, hi = t.length - 1;
+    if (x < t[0]) return -1;
+    while (lo < hi) {
+      const mid = (lo + hi + 1) >> 1;
+      if (t[mid] <= x) lo = mid; else hi = mid - 1;
+    }
+    return lo;
+  }
+
+  // 表示範囲内の階段の頂点 (画面座標)
+  function stepPoints(t, v) {
+    const i0 = Math.max(lastIndex(t, view[0]), 0);
+    const i1 = Math.min(lastIndex(t, view[1]) + 1, t.length - 1);
+    const pts = [[sx(Math.max(t[i0], view[0])), sy(v[i0])]];
+    for (let i = i0 + 1; i <= i1; i++) {
+      const x = sx(Math.min(t[i], view[1]));
+      pts.push([x, sy(v[i - 1])], [x, sy(v[i])]);
+    }
+    return pts;
+  }
+
+  function toPath(pts) {
+    return 'M' + pts.map(p => p[0].toFixed(1) + ',' + p[1].toFixed(1)).join('L');
+  }
+
+  function stepPath(t, v) { return toPath(stepPoints(t, v)); }
+
+  function bandPath(t, lo, hi) {
+    // 上側をたどり、下側を逆向きにたどって閉じる
+    return toPath(stepPoints(t, hi).concat(stepPoints(t, lo).reverse())) + 'Z';
+  }
+
+  function render() {
+    const parts = [];
+    parts.push(`<svg width="${W}" height="${H}" xmlns="http://www.w3.org/2000/svg" style="font-family:sans-serif;font-size:12px">`);
+    parts.push(`<defs><clipPath id="km-clip"><rect x="${M.left}" y="${M.top}" width="${W - M.left - M.right}" height="${H - M.top - M.bottom}"/></clipPath></defs>`);
+    if (data.title) parts.push(`<text x="${W / 2}" y="20" text-anchor="middle" font-size="14">${escape(data.title)}</text>`);
+    // 軸と目盛り
+    for (const t of niceTicks(view[0], view[1], 6)) {
+      parts.push(`<line x1="${sx(t)}" x2="${sx(t)}" y1="${H - M.bottom}" y2="${H - M.bottom + 4}" stroke="#000"/>`);
+      parts.push(`<text x="${sx(t)}" y="${H - M.bottom + 16}" text-anchor="middle">${t}</text>`);
+    }
+    for (const s of [0, 0.2, 0.4, 0.6, 0.8, 1.0]) {
+      parts.push(`<line x1="${M.left - 4}" x2="${M.left}" y1="${sy(s)}" y2="${sy(s)}" stroke="#000"/>`);
+      parts.push(`<text x="${M.left - 7}" y="${sy(s) + 4}" text-anchor="end">${s.toFixed(1)}</text>`);
+    }
+    parts.push(`<rect x="${M.left}" y="${M.top}" width="${W - M.left - M.right}" height="${H - M.top - M.bottom}" fill="none" stroke="#000"/>`);
+    parts.push(`<text x="${(M.left + W - M.right) / 2}" y="${H - 10}" text-anchor="middle">${escape(data.xlabel)}</text>`);
+    parts.push(`<text transform="translate(16,${(M.top + H - M.bottom) / 2}) rotate(-90)" text-anchor="middle">${escape(data.ylabel)}</text>`);
+
+    // 曲線
+    parts.push('<g clip-path="url(#km-clip)">');
+    data.groups.forEach((g, k) => {
+      if (hidden.has(k)) return;
+      if (data.ci && g.lo) parts.push(`<path d="${bandPath(g.t, g.lo, g.hi)}" fill="${g.color}" fill-opacity="0.15" stroke="none"/>`);
+      parts.push(`<path d="${stepPath(g.t, g.s)}" fill="none" stroke="${g.color}" stroke-width="1.5" stroke-dasharray="${DASH[g.linestyle] || ''}"/>`);
+      if (data.censor) {
+        let marks = '';
+        for (let i = 0; i < g.ct.length; i++) {
+          if (g.ct[i] < view[0] || g.ct[i] > view[1]) continue;
+          const x = sx(g.ct[i]), y = sy(g.cs[i]);
+          marks += `M${x.toFixed(1)},${(y - 4).toFixed(1)}V${(y + 4).toFixed(1)}`;
+        }
+        parts.push(`<path d="${marks}" stroke="${g.color}" stroke-width="1"/>`);
+      }
+    });
+    parts.push('</g>');
+    parts.push(`<line id="km-cursor" x1="0" x2="0" y1="${M.top}" y2="${H - M.bottom}" stroke="#888" stroke-dasharray="3,3" visibility="hidden"/>`);
+    parts.push(`<rect id="km-band" x="0" y="${M.top}" width="0" height="${H - M.top - M.bottom}" fill="#4a90d9" fill-opacity="0.15" visibility="hidden"/>`);
+    parts.push(`<rect id="km-overlay" x="${M.left}" y="${M.top}" width="${W - M.left - M.right}" height="${H - M.top - M.bottom}" fill="transparent" style="cursor:crosshair"/>`);
+    parts.push('</svg>');
+
+    // 凡例 (クリックで表示/非表示)
+    const legend = data.groups.map((g, k) =>
+      `<span data-k="${k}" style="cursor:pointer;margin-right:14px;opacity:${hidden.has(k) ? 0.35 : 1}">` +
+      `<span style="display:inline-block;width:18px;border-top:2px ${g.linestyle === 'solid' ? 'solid' : 'dashed'} ${g.color};vertical-align:middle;margin-right:4px"></span>${escape(g.label)}</span>`
+    ).join('');
+    root.innerHTML = parts.join('') + `<div id="km-legend" style="font-family:sans-serif;font-size:12px;margin-left:${M.left}px">${legend}</div>`;
+    bind();
+  }
+
+  function escape(s) {
+    return String(s).replace(/[&<>"]/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]));
+  }
+
+  function showTooltip(evt, x) {
+    const t = invx(x);
+    const rows = [];
+    data.groups.forEach((g, k) => {
+      if (hidden.has(k)) return;
+      const i = lastIndex(g.t, t);
+      if (i < 0) return;
+      // N at risk は t 以降で最初の頂点のリスク集合
+      const j = Math.min(i + (g.t[i] < t ? 1 : 0), g.t.length);
+      const n = j < g.n.length ? g.n[j] : 0;
+      const ci = data.ci && g.lo ? ` (${g.lo[i].toFixed(3)}-${g.hi[i].toFixed(3)})` : '';
+      rows.push(`<span style="color:${g.color}">■</span> ${escape(g.label)}: ${g.s[i].toFixed(3)}${ci}, at risk ${+n.toFixed(1)}`);
+    });
+    tooltip.innerHTML = `<b>${escape(data.xlabel)} = ${+t.toPrecision(4)}</b><br>` + rows.join('<br>');
+    tooltip.style.display = 'block';
+    const left = evt.offsetX + 16 + tooltip.offsetWidth > W ? evt.offsetX - tooltip.offsetWidth - 12 : evt.offsetX + 16;
+    tooltip.style.left = left + 'px';
+    tooltip.style.top = Math.max(evt.offsetY - 10, 0) + 'px';
+  }
+
+  function bind() {
+    const overlay = document.getElementById('km-overlay');
+    const cursor = document.getElementById('km-cursor');
+    const band = document.getElementById('km-band');
+    overlay.addEventListener('mousemove', evt => {
+      const x = evt.offsetX;
+      cursor.setAttribute('x1', x); cursor.setAttribute('x2', x);
+      cursor.setAttribute('visibility', 'visible');
+      if (dragStart !== null) {
+        band.setAttribute('x', Math.min(dragStart, x));
+        band.setAttribute('width', Math.abs(x - dragStart));
+        band.setAttribute('visibility', 'visible');
+      }
+      showTooltip(evt, x);
+    });
+    overlay.addEventListener('mouseleave', () => {
+      cursor.setAttribute('visibility', 'hidden');
+      tooltip.style.display = 'none';
+      dragStart = null;
+      band.setAttribute('visibility', 'hidden');
+    });
+    overlay.addEventListener('mousedown', evt => { dragStart = evt.offsetX; });
+    overlay.addEventListener('mouseup', evt => {
+      if (dragStart !== null && Math.abs(evt.offsetX - dragStart) > 5) {
+        const a = invx(Math.min(dragStart, evt.offsetX)), b = invx(Math.max(dragStart, evt.offsetX));
+        view = [Math.max(a, full[0]), Math.min(b, full[1])];
+        dragStart = null;
+        render();
+        return;
+      }
+      dragStart = null;
+      band.setAttribute('visibility', 'hidden');
+    });
+    overlay.addEventListener('dblclick', () => { view = full.slice(); render(); });
+    document.querySelectorAll('#km-legend [data-k]').forEach(el => {
+      el.addEventListener('click', () => {
+        const k = +el.dataset.k;
+        if (hidden.has(k)) hidden.delete(k); else hidden.add(k);
+        render();
+      });
+    });
+  }
+
+  render();
+})();
@@ -0,0 +1,189 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import matplotlib.image as mpimg
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import MaxNLocator
+from lifelines.plotting import add_at_risk_counts
+
+from survival_engine import TableKaplanMeierFitter, event_table
+from custom_lifelines_plotting import plot_estimates
+
+
+# パネルの背景に描く他の群の色
+BACKGROUND_COLOR = '0.85'
+CENSOR_STYLES = {"marker": "|", "ms": 5, "mew": 0.6}
+# 'gray'のときに群を区別する線種 (draw_kmと同じ順)
+STYLE_LIST = ['solid', 'dashed', 'dashdot', 'dotted']
+
+
+#-----------------------------------
+# パネルごとのevent_table
+def facet_event_tables(df, facet=None, event_flag=1):
+    '''
+    {(パネル名, 群名): event_table} を返す
+    facetを指定するとその列の水準ごとのパネルに分けてパネルの中で群ごとに描き、
+    Noneなら群ごとに1パネルにする
+    Args:
+        df: 行データのDataFrame、または {群名: event_table} のdict
+            (facetを指定したときは {(パネル名, 群名): event_table} のdict)
+    '''
+    if isinstance(df, dict):
+        # facetを指定したときは {(パネル名, 群名): event_table} のdictを受け取る
+        return df if facet is not None else {(group, group): table for group, table in df.items()}
+    event = df['event'].values if event_flag == 1 else 1 - df['event'].values
+    entry = df['entry'].values if 'entry' in df.columns else None
+    weight = df['weight'].values if 'weight' in df.columns else None
+    subgroup = df['subgroup'].astype(str).values
+    panel = subgroup if facet is None else df[facet].astype(str).values
+
+    tables = {}
+    groups = pd.DataFrame({'panel': panel, 'subgroup': subgroup}).groupby(['panel', 'subgroup'], sort=True).indices
+    for key, rows in groups.items():
+        tables[key] = event_table(df['duration'].values[rows], event[rows],
+                                  entry=None if entry is None else entry[rows],
+                                  weights=None if weight is None else weight[rows])
+    return tables
+
+
+#-----------------------------------
+# パネルの描画
+def _color(color, i):
+    # 8色のパレットより群が多いときは色を繰り返す
+    if isinstance(color, str):
+        return 'black' if color == 'gray' else color
+    return color[i % len(color)]
+
+
+def _linestyle(color, i, linestyles=None):
+    # draw_kmと同じく、カスタムは指定した線種, 'gray'は線種の繰り返しで群を区別する
+    if linestyles is not None:
+        return linestyles[i % len(linestyles)]
+    if isinstance(color, str) and color == 'gray':
+        return STYLE_LIST[i % len(STYLE_LIST)]
+    return 'solid'
+
+
+def _at_risk_rows(kmfs):
+    # 重み付きのときは実人数と有効サンプルサイズの2行
+    if not kmfs[0].weighted:
+        return kmfs
+    return [view for kmf in kmfs for view in (kmf.at_risk_view('raw'), kmf.at_risk_view('effective'))]
+
+
+def _render_panel(spec, fitted, layout, options):
+    '''
+    1パネルを独立したFigureに描いてRGBA配列にする (pyplotを使わないのでスレッドから呼べる)
+    '''
+    fig = Figure(figsize=layout['panel_size'], dpi=options['dpi'])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    # 背景の曲線と、このパネルの曲線をそれぞれ1つのCollectionで描く
+    if spec['background']:
+        background = [fitted[key] for key in spec['background']]
+        plot_estimates(background, colors=[BACKGROUND_COLOR] * len(background), linewidth=0.8,
+                       labels=['_nolegend_'] * len(background), ci_show=False, ax=ax)
+    kmfs = [fitted[key] for key, _, _ in spec['curves']]
+    handles = plot_estimates(kmfs, colors=[color for _, color, _ in spec['curves']],
+                             linestyles=[style for _, _, style in spec['curves']], linewidth=1.2,
+                             labels=[key[1] if spec['legend'] else '_nolegend_' for key, _, _ in spec['curves']],
+                             show_censors=options['censor'], censor_styles=CENSOR_STYLES,
+                             ci_show=options['ci'], ax=ax)
+    if handles:
+        ax.legend(handles=handles, fontsize=options['fontsize'] - 1, frameon=False, loc='lower left')
+
+    # 全パネルで軸の範囲と目盛りを揃える (N at riskの列も揃う)
+    ax.set_xlim(0, layout['xmax'])
+    ax.set_ylim(0, 1.05)
+    ax.set_xticks(layout['xticks'])
+    ax.set_title(spec['title'], fontsize=options['fontsize'] + 1)
+    ax.tick_params(labelsize=options['fontsize'])
+    ax.set_xlabel(options['xlabel'] if spec['bottom'] else '', fontsize=options['fontsize'])
+    ax.set_ylabel(options['ylabel'] if spec['left'] else '', fontsize=options['fontsize'])
+    if options['at_risk'] and kmfs:
+        add_at_risk_counts(*_at_risk_rows(kmfs), rows_to_show=['At risk'], ax=ax, fig=fig,
+                           fontsize=options['fontsize'] - 1, fontname=options['fontname'])
+    # at riskの行数が違っても軸の位置が同じになるよう、余白はパネル共通で決める
+    fig.subplots_adjust(**layout['margins'])
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+
+def draw_km_panels(df, color='gray', linestyles=None, facet=None, ncols=None, panel_size=(4, 3.5),
+                   title='', xlabel='期間', ylabel='生存率', censor=True, ci=False, ci_band=None, at_risk=True,
+                   event_flag=1, fontsize=8, fontname='Arial', show_others=True, dpi=150, max_workers=None):
+    '''
+    群ごと(またはfacet列の水準ごと)に1パネルのカプランマイヤー曲線を並べた図 (small multiples)
+    各群のKMは1回だけfitし、複数のパネルで使い回す。パネルはスレッドで並列に描いて1枚の画像にする
+    Args:
+        df: 行データのDataFrame、または {群名: event_table} のdict
+            (facetを指定したときは {(パネル名, 群名): event_table} のdict。値はfit済みのTableKaplanMeierFitterでもよい)
+        linestyles: 群ごとの線種 (カスタムの体裁。Noneなら'gray'のときだけ線種で区別する)
+        facet: パネルを分ける列名 (Noneなら群ごと)
+        show_others: 群ごとのパネルで、他の群の曲線を薄く背景に描く
+        ci_band: 'hall-wellner' か 'equal-precision' なら信頼区間を同時信頼帯にする
+    Returns:
+        PNGのbytes
+    '''
+    tables = facet_event_tables(df, facet=facet, event_flag=event_flag)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # fit済みの曲線 (解析ファイルやランドマーク解析の条件付き曲線) はそのまま使う
+        fitted = dict(zip(tables, pool.map(
+            lambda item: item[1] if isinstance(item[1], TableKaplanMeierFitter) else
+            TableKaplanMeierFitter().fit_event_table(item[1], label=item[0][1]), tables.items())))
+    if ci and ci_band:
+        fitted = {key: kmf.with_band(ci_band) for key, kmf in fitted.items()}
+
+    groups = sorted({group for _, group in tables})
+    panels = list(dict.fromkeys(panel for panel, _ in tables))
+    ncols = ncols or min(4, len(panels))
+    nrows = -(-len(panels) // ncols)
+
+    specs = []
+    for i, panel in enumerate(panels):
+        # 同じ群はどのパネルでも同じ色と線種
+        curves = [(key, _color(color, groups.index(key[1])), _linestyle(color, groups.index(key[1]), linestyles))
+                  for key in tables if key[0] == panel]
+        background = [key for key in tables if key[0] != panel] if facet is None and show_others else []
+        specs.append({'title': panel if facet is None else f'{facet} = {panel}',
+                      'background': background, 'curves': curves, 'legend': facet is not None,
+                      'bottom': i >= len(panels) - ncols, 'left': i % ncols == 0})
+
+    xmax = max(kmf.timeline[-1] for kmf in fitted.values()) * 1.02
+    xticks = [t for t in MaxNLocator(5).tick_values(0, xmax) if 0 <= t <= xmax]
+    # N at riskの行数はパネルで最も多いものに合わせる
+    weighted = any(kmf.weighted for kmf in fitted.values())
+    n_rows_at_risk = max(len(spec['curves']) for spec in specs) * (2 if weighted else 1) if at_risk else 0
+    row_height = (fontsize + 2) / 72 / panel_size[1]
+    bottom = min(0.1 + (n_rows_at_risk + 2) * row_height, 0.7) if at_risk else 0.14
+    # 左の余白はN at riskの群名の長さに合わせる
+    label_length = max(len(group) for group in groups) + (7 if weighted else 0) if at_risk else 0
+    left = min(max(0.15, 0.04 + label_length * fontsize * 0.7 / 72 / panel_size[0]), 0.45)
+    layout = {'panel_size': panel_size, 'xmax': xmax, 'xticks': xticks,
+              'margins': {'left': left, 'right': 0.96, 'top': 0.9, 'bottom': bottom}}
+    options = {'dpi': dpi, 'censor': censor, 'ci': ci, 'at_risk': at_risk, 'xlabel': xlabel,
+               'ylabel': ylabel, 'fontsize': fontsize, 'fontname': fontname}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        images = list(pool.map(lambda spec: _render_panel(spec, fitted, layout, options), specs))
+
+    # 1枚の画像に並べる (空いたマスは白)
+    h, w = images[0].shape[:2]
+    canvas = np.full((nrows * h, ncols * w, 4), 255, dtype=np.uint8)
+    for i, image in enumerate(images):
+        r, c = divmod(i, ncols)
+        canvas[r * h:(r + 1) * h, c * w:(c + 1) * w] = image
+    if title:
+        header = Figure(figsize=(ncols * panel_size[0], 0.5), dpi=dpi)
+        FigureCanvasAgg(header)
+        header.text(0.5, 0.5, title, ha='center', va='center', fontsize=fontsize + 4)
+        header.canvas.draw()
+        strip = np.asarray(header.canvas.buffer_rgba())[:, :canvas.shape[1]]
+        canvas = np.vstack([strip, canvas])
+
+    buf = BytesIO()
+    mpimg.imsave(buf, canvas, format='png', dpi=dpi)
+    return buf.getvalue()
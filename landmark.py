@@ -0,0 +1,84 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from survival_engine import TableKaplanMeierFitter, logrank_test_tables
+
+
+#-----------------------------------
+# ランドマーク解析・条件付き生存
+def parse_landmarks(text):
+    '''
+    「6, 12, 24」のようなカンマ(または空白)区切りの文字列をランドマーク時点のリストにする
+    '''
+    values = [v for v in text.replace('、', ',').replace(' ', ',').split(',') if v]
+    try:
+        landmarks = sorted({float(v) for v in values})
+    except ValueError:
+        raise ValueError(f'ランドマーク時点は数値で入力してください: {text}')
+    if any(v < 0 for v in landmarks):
+        raise ValueError('ランドマーク時点は0以上にしてください。')
+    return landmarks
+
+
+def landmark_curves(tables, landmarks):
+    '''
+    群ごとのKMを1回だけfitし、各ランドマーク時点の条件付き曲線はそのfitを切り詰めて割り直す
+    Args:
+        tables: {群名: event_table} または {群名: fit済みのTableKaplanMeierFitter}
+        landmarks: ランドマーク時点のリスト
+    Returns:
+        群ごとのfit済みKM {群名: TableKaplanMeierFitter} と
+        条件付き曲線 {ランドマーク時点: {群名: TableKaplanMeierFitter}} (その時点で誰も残っていない群は含めない)
+    '''
+    fitted = {group: table if isinstance(table, TableKaplanMeierFitter) else
+              TableKaplanMeierFitter().fit_event_table(table, label=group) for group, table in tables.items()}
+    curves = {}
+    for landmark in landmarks:
+        conditional = {group: kmf.condition_on(landmark) for group, kmf in fitted.items()}
+        curves[landmark] = {group: kmf for group, kmf in conditional.items() if kmf is not None}
+    return fitted, curves
+
+
+def landmark_analysis(tables, landmarks, pairs=None):
+    '''
+    ランドマーク時点ごとの条件付き生存曲線, 生存期間中央値, Logrank検定
+    Returns:
+        {'curves': {時点: {群名: fitter}}, 'median': DataFrame, 'logrank': DataFrame (2群以上のとき)}
+    '''
+    fitted, curves = landmark_curves(tables, landmarks)
+    rows = []
+    for landmark, conditional in curves.items():
+        for group, kmf in fitted.items():
+            row = {'landmark': landmark, 'subgroup': group,
+                   'at risk': np.nan, 'S(landmark)': kmf.survival_function_at_times(landmark).values[0],
+                   'conditional median': np.nan, '95% CI(lower)': np.nan, '95% CI(upper)': np.nan}
+            if group in conditional:
+                c = conditional[group]
+                # 重み付きのときも人数は実人数で表示する
+                at_risk = c.event_table['at_risk_raw' if c.weighted else 'at_risk'].values[0]
+                low, high = c.median_confidence_interval_
+                row.update({'at risk': at_risk, 'conditional median': c.median_survival_time_,
+                            '95% CI(lower)': low, '95% CI(upper)': high})
+            rows.append(row)
+    result = {'curves': curves, 'median': pd.DataFrame(rows)}
+
+    if len(fitted) >= 2:
+        p_tables = []
+        for landmark, conditional in curves.items():
+            # その時点で残っている群どうしだけ比較する
+            landmark_pairs = [p for p in (pairs or []) if p[0] in conditional and p[1] in conditional] \
+                if pairs is not None else None
+            if len(conditional) < 2 or landmark_pairs == []:
+                continue
+            for a, b in combinations(conditional, 2) if landmark_pairs is None else landmark_pairs:
+                # utils.logrank_p_tableと同じ列 (条件付き曲線のevent_tableどうしで検定する)
+                _, logrank_p = logrank_test_tables(conditional[a].event_table, conditional[b].event_table)
+                _, wilcoxon_p = logrank_test_tables(conditional[a].event_table, conditional[b].event_table,
+                                                    weightings='wilcoxon')
+                p_tables.append({'landmark': landmark, 'subgroup': a + '/' + b,
+                                 'logrank-p': logrank_p, 'wilcoxon-p': wilcoxon_p})
+        if p_tables:
+            result['logrank'] = pd.DataFrame(p_tables)
+    return result
@@ -0,0 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import optimize, stats
+
+
+# 比較するパラメトリックモデル (custom_lifelines_plotting.qq_plotと同じ4つ)
+DISTRIBUTIONS = {
+    'weibull': 'Weibull',
+    'lognormal': '対数正規',
+    'loglogistic': '対数ロジスティック',
+    'exponential': '指数',
+}
+
+
+#-----------------------------------
+# 分布 (パラメータはすべて実数全体で動くように対数などに変換して最適化する)
+def _frozen(name, params):
+    # lifelinesのモデルをscipy.statsに直すとき(create_scipy_stats_model_from_lifelines_model)と同じ対応
+    if name == 'weibull':
+        log_lambda, log_rho = params
+        return stats.weibull_min(np.exp(log_rho), 0, np.exp(log_lambda))
+    if name == 'lognormal':
+        mu, log_sigma = params
+        return stats.lognorm(np.exp(log_sigma), 0, np.exp(mu))
+    if name == 'loglogistic':
+        log_alpha, log_beta = params
+        return stats.fisk(np.exp(log_beta), 0, np.exp(log_alpha))
+    if name == 'exponential':
+        log_lambda, = params
+        return stats.expon(0, np.exp(log_lambda))
+    raise ValueError(f'unknown model: {name}')
+
+
+def _log_pdf_sf(name, params, log_t):
+    # log f(t) と log S(t) (scipyのlogpdfより速く、裾でも安定な式)
+    if name == 'weibull':
+        log_lambda, log_rho = params
+        x = np.exp(log_rho) * (log_t - log_lambda)
+        log_sf = -np.exp(x)
+        return log_rho - log_lambda + x - (log_t - log_lambda) + log_sf, log_sf
+    if name == 'exponential':
+        log_lambda, = params
+        log_sf = -np.exp(log_t - log_lambda)
+        return -log_lambda + log_sf, log_sf
+    if name == 'lognormal':
+        mu, log_sigma = params
+        z = (log_t - mu) / np.exp(log_sigma)
+        return stats.norm.logpdf(z) - log_sigma - log_t, stats.norm.logsf(z)
+    if name == 'loglogistic':
+        log_alpha, log_beta = params
+        x = np.exp(log_beta) * (log_t - log_alpha)
+        log_sf = -np.logaddexp(0, x)
+        return log_beta - log_alpha + x - (log_t - log_alpha) + 2 * log_sf, log_sf
+    raise ValueError(f'unknown model: {name}')
+
+
+class ParametricFit:
+    '''
+    event_tableから最尤推定したパラメトリックモデル
+    行データは使わないので、ストリーミング集計や多施設の集計データでもfitできる
+    '''
+
+    def __init__(self, name, params, log_likelihood, n, n_events, converged):
+        self.name = name
+        self.params = np.asarray(params, dtype=float)
+        self.log_likelihood = log_likelihood
+        self.n = n
+        self.n_events = n_events
+        self.converged = converged
+        self.dist = _frozen(name, self.params)
+
+    @property
+    def label(self):
+        return DISTRIBUTIONS[self.name]
+
+    @property
+    def aic(self):
+        return 2 * len(self.params) - 2 * self.log_likelihood
+
+    @property
+    def bic(self):
+        return len(self.params) * np.log(max(self.n, 1)) - 2 * self.log_likelihood
+
+    def survival(self, times):
+        return self.dist.sf(np.asarray(times, dtype=float))
+
+    def cdf(self, times):
+        return self.dist.cdf(np.asarray(times, dtype=float))
+
+    def ppf(self, q):
+        return self.dist.ppf(q)
+
+    def __repr__(self):
+        # ディスクキャッシュのキーにも使うので、パラメータで決まる文字列にする
+        return 'ParametricFit(%s, %s)' % (self.name, np.array2string(self.params, precision=12))
+
+
+#-----------------------------------
+# 最尤推定
+def _table_arrays(table):
+    times = table.index.values.astype(float)
+    positive = times[times > 0]
+    # 時点0のイベントは対数をとれないので、最小の正の時点より十分小さい値にする
+    eps = positive.min() * 1e-3 if len(positive) else 1e-6
+    log_t = np.log(np.maximum(times, eps))
+    entrance = table['entrance'].values.astype(float).copy()
+    # 時点0での登録は S(0)=1 なので尤度に寄与しない
+    entrance[times <= 0] = 0
+    n = table['removed_raw'].values.sum() if 'removed_raw' in table.columns else table['removed'].values.sum()
+    return log_t, table['observed'].values.astype(float), table['censored'].values.astype(float), entrance, float(n)
+
+
+def _initial_params(name, log_t, observed, removed, entrance):
+    # 指数分布の最尤推定値 (総観察時間/イベント数) を尺度の初期値にする
+    t = np.exp(log_t)
+    exposure = (removed * t).sum() - (entrance * t).sum()
+    log_scale = np.log(max(exposure, 1e-12) / max(observed.sum(), 1e-12))
+    return {'weibull': [log_scale, 0.], 'lognormal': [log_scale, 0.], 'loglogistic': [log_scale, 0.],
+            'exponential': [log_scale]}[name]
+
+
+def fit_parametric(table, name):
+    '''
+    1つのevent_tableにパラメトリックモデルをfitする
+    遅延登録(entry)があるときは、尤度から登録時点の log S(entry) を引く (左切断)
+    '''
+    log_t, observed, censored, entrance, n = _table_arrays(table)
+
+    def negative_log_likelihood(params):
+        log_pdf, log_sf = _log_pdf_sf(name, params, log_t)
+        ll = (observed * log_pdf).sum() + (censored * log_sf).sum() - (entrance * log_sf).sum()
+        return -ll if np.isfinite(ll) else np.inf
+
+    x0 = _initial_params(name, log_t, observed, observed + censored, entrance)
+    result = optimize.minimize(negative_log_likelihood, x0, method='Nelder-Mead' if len(x0) == 1 else 'BFGS')
+    if not result.success and len(x0) > 1:
+        # BFGSが収束しないときはNelder-Meadで詰め直す
+        result = optimize.minimize(negative_log_likelihood, result.x, method='Nelder-Mead',
+                                   options={'xatol': 1e-8, 'fatol': 1e-10, 'maxiter': 4000})
+    return ParametricFit(name, result.x, -result.fun, n, observed.sum(), bool(result.success))
+
+
+def fit_parametric_models(tables, distributions=None, max_workers=None):
+    '''
+    全群 × 全モデルを並列にfitする
+    Args:
+        tables: {群名: event_table}
+        distributions: fitするモデル名のリスト (Noneなら DISTRIBUTIONS のすべて)
+    Returns:
+        {群名: {モデル名: ParametricFit}}
+    '''
+    distributions = list(DISTRIBUTIONS) if distributions is None else distributions
+    jobs = [(group, name) for group in tables for name in distributions]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda job: fit_parametric(tables[job[0]], job[1]), jobs))
+    fits = {group: {} for group in tables}
+    for (group, name), fit in zip(jobs, results):
+        fits[group][name] = fit
+    return fits
+
+
+def parametric_ranking(fits):
+    '''
+    群ごとのAIC, BICの表 (AICの小さい順)
+    '''
+    rows = []
+    for group, models in fits.items():
+        ranked = sorted(models.values(), key=lambda fit: fit.aic)
+        for rank, fit in enumerate(ranked, 1):
+            rows.append({'subgroup': group, 'モデル': fit.label, 'AIC': fit.aic, 'BIC': fit.bic,
+                         'AIC順位': rank, '中央値(モデル)': fit.ppf(0.5)})
+    return pd.DataFrame(rows)
+
+
+def choose_models(fits, name=None):
+    '''
+    群ごとに使うモデルを選ぶ (nameがNoneなら群ごとにAIC最小のモデル)
+    Returns:
+        {群名: ParametricFit}
+    '''
+    if name is None:
+        return {group: min(models.values(), key=lambda fit: fit.aic) for group, models in fits.items()}
+    return {group: models[name] for group, models in fits.items()}
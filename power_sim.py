@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from survival_engine import TableKaplanMeierFitter
+
+
+# 1回に作る試験の数 (R × N の配列をこの単位で作り、メモリを抑える)
+CHUNK_REPLICATES = 250
+
+
+#-----------------------------------
+# データ生成モデル
+# スレッドに渡すので、生成モデルは関数ではなく配列やパラメータのdictで表す
+def km_model(kmf):
+    '''
+    fit済みのKMを生成モデルにする (生存率の逆関数で発生させる)
+    最後の時点で生存率が0にならないときは、その先のイベントは起きない(観察期間外)とする
+    '''
+    if not isinstance(kmf, TableKaplanMeierFitter):
+        kmf = TableKaplanMeierFitter().fit_event_table(kmf)
+    return {'kind': 'km', 'timeline': kmf.timeline.copy(), 'survival': kmf.survival_function_.values[:, 0].copy()}
+
+
+def parametric_model(fit):
+    '''
+    parametric_engine.ParametricFitを生成モデルにする (追跡期間の外へも外挿して発生させる)
+    '''
+    return {'kind': 'parametric', 'name': fit.name, 'params': fit.params.copy()}
+
+
+def sample_times(model, u):
+    '''
+    一様乱数uから生存時間を発生させる (逆関数法, 配列の形はuと同じ)
+    '''
+    if model['kind'] == 'km':
+        # S(t) <= u となる最初の時点 (Sは単調減少なので、-Sで昇順にして二分探索)
+        survival = model['survival']
+        pos = np.searchsorted(-survival, -u, side='left')
+        return np.where(pos < len(survival), model['timeline'][np.minimum(pos, len(survival) - 1)], np.inf)
+    from parametric_engine import _frozen
+    return _frozen(model['name'], model['params']).isf(u)
+
+
+#-----------------------------------
+# 試験の発生とlogrank検定 (R個の試験を (R, N) の配列でまとめて扱う)
+def simulate_trials(models, n, replicates, accrual, follow_up, allocation=0.5, dropout=0.0, rng=None):
+    '''
+    2群の試験をreplicates個まとめて発生させる
+    Args:
+        models: (対照群の生成モデル, 試験群の生成モデル)
+        n: 1試験の症例数 (2群の合計)
+        accrual: 登録期間 (この間に一様に登録)
+        follow_up: 登録終了後の追跡期間 (解析時点 = accrual + follow_up)
+        allocation: 試験群に割り付ける割合
+        dropout: 脱落のハザード (durationの単位あたり, 指数分布)
+    Returns:
+        (観察期間, イベントの有無, 試験群か) それぞれ (replicates, n) の配列
+    '''
+    rng = np.random.default_rng(rng)
+    n_treat = int(round(n * allocation))
+    group = np.zeros((replicates, n), dtype=bool)
+    group[:, :n_treat] = True
+    times = np.empty((replicates, n))
+    u = rng.random((replicates, n))
+    times[:, n_treat:] = sample_times(models[0], u[:, n_treat:])
+    times[:, :n_treat] = sample_times(models[1], u[:, :n_treat])
+    # 打ち切り: 解析時点での管理打ち切りと脱落の早い方
+    censor = accrual + follow_up - rng.uniform(0, accrual, (replicates, n))
+    if dropout > 0:
+        censor = np.minimum(censor, rng.exponential(1 / dropout, (replicates, n)))
+    return np.minimum(times, censor), times <= censor, group
+
+
+def logrank_statistics(durations, events, group):
+    '''
+    (R, N) の配列の各行でlogrank検定の統計量を求める (行ごとのループなし)
+    同時点のイベント(タイ)は時点ごとにまとめる (survival_engine.logrank_test_tablesと同じ値)
+    Returns:
+        (z統計量(試験群のO-Eを標準化), イベント数) それぞれ長さRの配列
+    '''
+    r, n = durations.shape
+    order = np.argsort(durations, axis=1, kind='stable')
+    t = np.take_along_axis(durations, order, axis=1)
+    d = np.take_along_axis(events, order, axis=1).astype(float)
+    g = np.take_along_axis(group, order, axis=1).astype(float)
+    idx = np.broadcast_to(np.arange(n), (r, n))
+
+    # 同じ時点の塊の最初と最後の位置
+    new_block = np.ones((r, n), dtype=bool)
+    new_block[:, 1:] = t[:, 1:] != t[:, :-1]
+    first = np.maximum.accumulate(np.where(new_block, idx, 0), axis=1)
+    last_in_block = np.ones((r, n), dtype=bool)
+    last_in_block[:, :-1] = new_block[:, 1:]
+
+    # リスク集合: 塊の最初の位置から後ろの人数 (試験群は後ろからの累積和)
+    at_risk = (n - first).astype(float)
+    treat_from = np.cumsum(g[:, ::-1], axis=1)[:, ::-1]
+    at_risk_treat = np.take_along_axis(treat_from, first, axis=1)
+
+    # 塊の中のイベント数 (累積和の差, 塊の最後の位置だけ使う)
+    cum_d = np.cumsum(d, axis=1)
+    cum_dt = np.cumsum(d * g, axis=1)
+    before = np.where(first > 0, first - 1, 0)
+    d_block = cum_d - np.where(first > 0, np.take_along_axis(cum_d, before, axis=1), 0.)
+    dt_block = cum_dt - np.where(first > 0, np.take_along_axis(cum_dt, before, axis=1), 0.)
+
+    use = last_in_block & (d_block > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.where(use, at_risk_treat * d_block / at_risk, 0.)
+        var = np.where(use & (at_risk > 1),
+                       at_risk_treat * (at_risk - at_risk_treat) * d_block * (at_risk - d_block)
+                       / (at_risk ** 2 * (at_risk - 1)), 0.)
+    o_minus_e = np.where(use, dt_block, 0.).sum(axis=1) - expected.sum(axis=1)
+    v = var.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(v > 0, o_minus_e / np.sqrt(v), 0.)
+    return z, d.sum(axis=1)
+
+
+#-----------------------------------
+# 検出力
+def _run_chunk(models, n, replicates, design, alpha, seed):
+    durations, events, group = simulate_trials(models, n, replicates, rng=np.random.default_rng(seed), **design)
+    z, n_events = logrank_statistics(durations, events, group)
+    return (z ** 2 > stats.chi2.ppf(1 - alpha, 1)).sum(), n_events.sum(), (z < 0).sum()
+
+
+def simulate_power(models, sample_sizes, replicates=1000, accrual=12., follow_up=12., allocation=0.5,
+                   dropout=0.0, alpha=0.05, seed=0, max_workers=None):
+    '''
+    症例数ごとの検出力 (logrank検定, 両側)
+    症例数と試験のまとまり(CHUNK_REPLICATES個)ごとにスレッドで並列に計算する
+    乱数はseedから症例数・まとまりごとに分けたSeedSequenceで作るので、並列の数によらず同じ結果になる
+    Args:
+        models: (対照群の生成モデル, 試験群の生成モデル) km_model / parametric_model の結果
+        sample_sizes: 症例数(2群の合計)のリスト
+    Returns:
+        DataFrame (症例数, 検出力, 検出力の95%CI, 平均イベント数, 試験群が良い方向の割合)
+    '''
+    design = dict(accrual=accrual, follow_up=follow_up, allocation=allocation, dropout=dropout)
+    chunks = [min(CHUNK_REPLICATES, replicates - start) for start in range(0, replicates, CHUNK_REPLICATES)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sample_sizes))
+    jobs = [(n, size, chunk_seed) for n, seq in zip(sample_sizes, seeds)
+            for size, chunk_seed in zip(chunks, seq.spawn(len(chunks)))]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda job: _run_chunk(models, job[0], job[1], design, alpha, job[2]), jobs))
+
+    rows = []
+    for i, n in enumerate(sample_sizes):
+        parts = np.array(results[i * len(chunks):(i + 1) * len(chunks)], dtype=float)
+        rejected, total_events, favourable = parts.sum(axis=0)
+        power = rejected / replicates
+        se = np.sqrt(power * (1 - power) / replicates)
+        rows.append({'症例数': n, '検出力': power, '95% CI(lower)': max(power - 1.96 * se, 0.),
+                     '95% CI(upper)': min(power + 1.96 * se, 1.), '平均イベント数': total_events / replicates,
+                     '試験群が良い割合': favourable / replicates})
+    return pd.DataFrame(rows)
+
+
+def required_sample_size(power_df, target=0.8):
+    '''
+    検出力がtargetに達する症例数 (隣の症例数との線形補間, 届かなければNaN)
+    '''
+    n = power_df['症例数'].values.astype(float)
+    power = power_df['検出力'].values
+    reached = np.flatnonzero(power >= target)
+    if len(reached) == 0:
+        return np.nan
+    i = reached[0]
+    if i == 0 or power[i] == power[i - 1]:
+        return n[i]
+    return n[i - 1] + (target - power[i - 1]) * (n[i] - n[i - 1]) / (power[i] - power[i - 1])
@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from survival_engine import event_table, binned_event_table, merge_event_tables
+from validation import clean_survival
+
+
+# 1チャンクあたりの行数
+CHUNK_SIZE = 1_000_000
+
+
+#-----------------------------------
+# チャンク読み込み
+def _source_kind(source, kind=None):
+    if kind is not None:
+        return kind
+    name = source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', '')
+    ext = os.path.splitext(str(name))[1].lower()
+    return {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.npy': 'npy'}.get(ext, 'csv')
+
+
+def iter_chunks(source, kind=None, chunksize=CHUNK_SIZE):
+    '''
+    CSV, Parquet, NumPy(.npy, 構造化配列)をチャンクごとのDataFrameとして読み込む
+    チャンクに分けて抑えられるのは変換したDataFrameの分だけで、st.file_uploaderのファイルは全体がメモリ上にある
+    (扱える大きさはStreamlitのアップロードの上限 server.maxUploadSize まで)
+    Args:
+        source: ファイルパスまたはファイルオブジェクト
+        kind: 'csv', 'parquet', 'npy' (Noneなら拡張子から判定)
+    '''
+    kind = _source_kind(source, kind)
+    if kind == 'csv':
+        yield from pd.read_csv(source, chunksize=chunksize)
+    elif kind == 'parquet':
+        # pyarrowは任意の依存 (Parquetを読むときだけ必要)
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif kind == 'npy':
+        array = np.load(source, allow_pickle=False)
+        if array.dtype.names is None:
+            raise ValueError('.npyはduration, event(, subgroup)のフィールドを持つ構造化配列にしてください。')
+        for start in range(0, array.shape[0], chunksize):
+            chunk = array[start:start + chunksize]
+            yield pd.DataFrame({name: np.asarray(chunk[name]) for name in array.dtype.names})
+    else:
+        raise ValueError(f'対応していない形式です: {kind}')
+
+
+#-----------------------------------
+# ストリーミング集計
+def reduce_chunk(chunk, event_flag=1, width=None):
+    '''
+    1チャンクを群ごとのevent_table (時点ごとの離脱数, イベント数, 打ち切り数) に縮約する
+    widthを指定すると時間グリッド上の近似の表にする
+    '''
+    # Excelと同じ検査で型をそろえ、使えない行を除く (行ごとの報告はExcelの読み込みでだけ出す)
+    chunk, _ = clean_survival(chunk)
+    subgroup = chunk['subgroup'].values
+    event = chunk['event'].values
+    if event_flag == 0:
+        event = 1 - event
+    duration = chunk['duration'].values
+    entry = chunk['entry'].values if 'entry' in chunk.columns else None
+    weight = chunk['weight'].values if 'weight' in chunk.columns else None
+
+    codes, labels = pd.factorize(subgroup)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+    tables = {}
+    for i, label in enumerate(labels):
+        ix = order[bounds[i]:bounds[i + 1]]
+        kwargs = dict(entry=None if entry is None else entry[ix],
+                      weights=None if weight is None else weight[ix])
+        if width is None:
+            tables[label] = event_table(duration[ix], event[ix], **kwargs)
+        else:
+            tables[label] = binned_event_table(duration[ix], event[ix], width, **kwargs)
+    return tables
+
+
+def merge_group_tables(accumulated, tables):
+    # 群ごとにevent_tableを足し合わせる (メモリは行数ではなく時点の種類数に比例)
+    for label, table in tables.items():
+        if label in accumulated:
+            accumulated[label] = merge_event_tables([accumulated[label], table])
+        else:
+            accumulated[label] = table
+    return accumulated
+
+
+def stream_event_tables(source, kind=None, event_flag=1, chunksize=CHUNK_SIZE, width=None):
+    '''
+    大規模データをチャンクごとに読み込み、群ごとの正確なevent_tableを作る
+    (widthを指定すると時間グリッド上の近似の表)
+    結果の {群名: event_table} はdraw_km, median_duration, logrank_p_tableにそのまま渡せる
+    '''
+    accumulated = {}
+    for chunk in iter_chunks(source, kind=kind, chunksize=chunksize):
+        merge_group_tables(accumulated, reduce_chunk(chunk, event_flag=event_flag, width=width))
+    return accumulated
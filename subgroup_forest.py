@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.ticker import ScalarFormatter
+from scipy import stats
+
+from cox_engine import EfronCoxFitter
+
+
+#-----------------------------------
+# サブグループ解析 (forest plot)
+def _level_labels(series, max_levels=5):
+    # 連続変数で水準が多いときは中央値で2分割する
+    if pd.api.types.is_numeric_dtype(series) and series.nunique() > max_levels:
+        median = series.median()
+        return np.where(series < median, f'<{median:.4g}', f'≥{median:.4g}')
+    return series.astype(str).values
+
+
+def _fit(data, mask, columns):
+    # 共有しているduration順の配列からmaskの行だけを取り出してsolverに直接渡す
+    # (maskで取り出しても並び順は保たれるので、solverでの並べ替えは省く)
+    covariates = pd.DataFrame({name: data[name][mask] for name in columns
+                               if name not in ('duration', 'event', 'entry', 'weight')})
+    cph = EfronCoxFitter()
+    return cph.fit_arrays(covariates, data['duration'][mask], data['event'][mask],
+                          entry=data['entry'][mask] if 'entry' in data else None,
+                          weights=data['weight'][mask] if 'weight' in data else None,
+                          robust='weight' in data, presorted=True)
+
+
+def _hr_task(data, mask):
+    base = ['duration', 'event', 'treatment', 'entry', 'weight']
+    n = int(mask.sum())
+    events = int(data['event'][mask].sum())
+    try:
+        cph = _fit(data, mask, base)
+        hr = cph.hazard_ratios_['treatment']
+        ci = np.exp(cph.confidence_intervals_.loc['treatment'].values)
+    except (np.linalg.LinAlgError, ValueError, ZeroDivisionError):
+        hr, ci = np.nan, (np.nan, np.nan)
+    return n, events, hr, ci[0], ci[1]
+
+
+def _interaction_task(data, levels):
+    # treatment × 水準 の交互作用項をまとめてWald検定する
+    dummies = pd.get_dummies(levels, drop_first=True, dtype=float)
+    if dummies.shape[1] == 0:
+        return np.nan
+    data = dict(data)
+    names = []
+    for i, col in enumerate(dummies.columns):
+        data[f'level_{i}'] = dummies[col].values
+        data[f'treatment:level_{i}'] = dummies[col].values * data['treatment']
+        names.append(f'treatment:level_{i}')
+    try:
+        cph = _fit(data, np.ones(len(levels), dtype=bool), list(data.keys()))
+        b = cph.params_[names].values
+        V = cph.variance_matrix_.loc[names, names].values
+        return stats.chi2.sf(b @ np.linalg.solve(V, b), len(names))
+    except (np.linalg.LinAlgError, ValueError, ZeroDivisionError):
+        return np.nan
+
+
+def subgroup_hazard_ratios(df, reference, target, columns, event_flag=1, max_workers=None):
+    '''
+    treatment(subgroup列のtarget vs reference)のハザード比を、各層別変数の水準ごとに求める
+    Coxのfitと交互作用検定はスレッドプールで並列に実行する
+    データは1回だけduration順に並べた配列にして全タスクで共有し、各タスクはその部分集合を並べ替えずにsolverへ渡す
+    Args:
+        reference, target: 比較するsubgroupの水準 (HR = target/reference)
+        columns: 層別に使う列名のリスト
+    Returns:
+        variable, level, n, events, HR, 95% CI, 交互作用のp値 の表
+    '''
+    df = df[df['subgroup'].isin([reference, target])].sort_values('duration', kind='mergesort')
+    event = df['event'].values if event_flag == 1 else 1 - df['event'].values
+    data = {
+        'duration': df['duration'].values.astype(float),
+        'event': event.astype(int),
+        'treatment': (df['subgroup'] == target).values.astype(float),
+    }
+    if 'entry' in df.columns:
+        data['entry'] = df['entry'].values.astype(float)
+    if 'weight' in df.columns:
+        data['weight'] = df['weight'].values.astype(float)
+
+    labels = {col: _level_labels(df[col]) for col in columns}
+    rows = [('全体', '', np.ones(len(df), dtype=bool))]
+    for col in columns:
+        valid = df[col].notna().values
+        for level in sorted(pd.unique(labels[col][valid])):
+            rows.append((col, level, valid & (labels[col] == level)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        hr_futures = [pool.submit(_hr_task, data, mask) for _, _, mask in rows]
+        interaction_futures = {}
+        for col in columns:
+            valid = df[col].notna().values
+            subset = {name: values[valid] for name, values in data.items()}
+            interaction_futures[col] = pool.submit(_interaction_task, subset, labels[col][valid])
+        results = [f.result() for f in hr_futures]
+        p_interaction = {col: f.result() for col, f in interaction_futures.items()}
+
+    table = pd.DataFrame(results, columns=['n', 'events', 'HR', '95% CI(lower)', '95% CI(upper)'])
+    table.insert(0, 'level', [level for _, level, _ in rows])
+    table.insert(0, 'variable', [variable for variable, _, _ in rows])
+    # 交互作用のp値は各変数の先頭の行にだけ入れる
+    first = ~table['variable'].duplicated()
+    table['p(interaction)'] = np.where(first, table['variable'].map(p_interaction), np.nan)
+    return table
+
+
+def draw_forest(table, reference, target, color='black', size=(8, 6), title='', xlabel='ハザード比'):
+    '''
+    subgroup_hazard_ratiosの結果からforest plotを描く
+    '''
+    n_rows = len(table)
+    fig, ax = plt.subplots(figsize=size, dpi=300)
+    plt.suptitle(title)
+
+    y = np.arange(n_rows)[::-1]
+    labels = [variable if level == '' else
+              (f'{variable}  {level}' if i == 0 or table['variable'].iloc[i - 1] != variable else f'    {level}')
+              for i, (variable, level) in enumerate(zip(table['variable'], table['level']))]
+    ok = table['HR'].notna().values & np.isfinite(table['95% CI(upper)'].values)
+    hr = table['HR'].values
+    lower, upper = table['95% CI(lower)'].values, table['95% CI(upper)'].values
+
+    ax.hlines(y[ok], lower[ok], upper[ok], color=color, lw=1)
+    # マーカーの大きさは症例数に比例
+    sizes = 20 + 80 * table['n'].values / max(table['n'].max(), 1)
+    ax.scatter(hr[ok], y[ok], s=sizes[ok], marker='s', color=color, zorder=3)
+    ax.axvline(1, color='gray', lw=0.8, linestyle='dashed')
+    ax.set_xscale('log')
+    ax.xaxis.set_major_formatter(ScalarFormatter())
+    ax.set_yticks(y)
+    ax.set_yticklabels(labels)
+    ax.set_ylim(-0.7, n_rows - 0.3)
+    ax.set_xlabel(f'{xlabel} ({target}/{reference})')
+    for side in ['top', 'right', 'left']:
+        ax.spines[side].set_visible(False)
+    ax.tick_params(axis='y', length=0)
+
+    # 右側にHR(95% CI)と交互作用のp値を表示
+    text = ax.get_yaxis_transform()
+    ax.text(1.02, n_rows - 0.3, 'HR (95% CI)', transform=text, fontsize=9, va='bottom')
+    ax.text(1.32, n_rows - 0.3, 'p(int.)', transform=text, fontsize=9, va='bottom')
+    for i in range(n_rows):
+        hr_text = f'{hr[i]:.2f} ({lower[i]:.2f}-{upper[i]:.2f})' if ok[i] else 'NA'
+        ax.text(1.02, y[i], hr_text, transform=text, fontsize=9, va='center')
+        p = table['p(interaction)'].iloc[i]
+        if not np.isnan(p):
+            ax.text(1.32, y[i], f'{p:.3f}', transform=text, fontsize=9, va='center')
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,530 @@
+import functools
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import custom_lifelines_plotting
+
+
+# lifelinesのevent_tableと同じ列構成
+EVENT_TABLE_COLUMNS = ['removed', 'observed', 'censored', 'entrance', 'at_risk']
+# 足し合わせ(マージ)できる列。at_risk系の列はこれらの累積和から求める
+ADDITIVE_COLUMNS = ['removed', 'observed', 'censored', 'entrance',
+                    'removed_raw', 'entrance_raw', 'removed_w2', 'entrance_w2', 'entrance_within']
+DERIVED_COLUMNS = ['at_risk', 'at_risk_raw', 'at_risk_eff', 'removed_eff']
+
+
+#-----------------------------------
+# event table
+def _cumsum0(x):
+    # 先頭に0を付けた累積和 (searchsortedの結果でそのまま引ける)
+    return np.concatenate([[0.], np.cumsum(x, dtype=float)])
+
+
+def _prepare(durations, event_observed, entry=None, weights=None):
+    durations = np.asarray(durations, dtype=float)
+    event_observed = np.asarray(event_observed).astype(bool)
+    if entry is None:
+        # lifelinesと同様、全員が min(0, 最短期間) で観察開始
+        entry = np.full(durations.shape[0], min(0., durations.min()))
+    else:
+        entry = np.asarray(entry, dtype=float)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+    return durations, event_observed, entry, weights
+
+
+def _at_risk(entrance, removed):
+    # at_risk(t_i) = Σ_{j<=i} entrance_j - Σ_{j<i} removed_j  (lifelinesと同じ定義)
+    return np.cumsum(entrance) - np.concatenate([[0], np.cumsum(removed)[:-1]])
+
+
+def _with_at_risk(table):
+    '''
+    足し合わせ可能な列から at_risk (重み付きなら実人数と有効サンプルサイズも) を求める
+    時点順に並んだ表の累積和だけで済むので、行データがなくても(マージ後でも)計算できる
+    '''
+    table = table.drop(columns=[c for c in DERIVED_COLUMNS if c in table.columns])
+    at_risk = _at_risk(table['entrance'].values, table['removed'].values)
+    table.insert(len(EVENT_TABLE_COLUMNS) - 1, 'at_risk', at_risk)
+    if 'removed_raw' in table.columns:
+        table['at_risk_raw'] = _at_risk(table['entrance_raw'].values, table['removed_raw'].values)
+        # Kishの有効サンプルサイズ (Σw)^2 / Σw^2 を期間の開始時点と終了時点で求める
+        sum_w = table['at_risk'].values
+        sum_w2 = _at_risk(table['entrance_w2'].values, table['removed_w2'].values)
+        end_w = sum_w - table['removed'].values
+        end_w2 = sum_w2 - table['removed_w2'].values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            start = np.where(sum_w2 > 1e-12, sum_w ** 2 / sum_w2, 0.)
+            end = np.where(end_w2 > 1e-12, end_w ** 2 / end_w2, 0.)
+        table['at_risk_eff'] = start
+        table['removed_eff'] = start - end
+    return table
+
+
+def event_table(durations, event_observed, entry=None, weights=None):
+    '''
+    lifelines互換のevent_tableを作成する (index: event_at)
+    ソート済みの離脱(exit)配列と登録(entry)配列をそれぞれ時点ごとに集計してマージし、
+    リスク集合はその累積和で求める (時点ごとのマスクは作らない)
+    Args:
+        durations: 観察期間
+        event_observed: イベントの有無(1 or 0)
+        entry: 遅延登録(左切断)の時点。Noneなら0
+        weights: 個体ごとの重み(IPTWなど)。指定すると各列は重み付きの人数になり、
+            実人数(*_raw)と有効サンプルサイズ(*_eff)の列が追加される
+    '''
+    durations, event_observed, entry, weights = _prepare(durations, event_observed, entry, weights)
+
+    order = np.argsort(durations, kind='mergesort')
+    exit_times, first, removed = np.unique(durations[order], return_index=True, return_counts=True)
+    observed_sorted = event_observed[order].astype(np.int64)
+
+    entry_order = np.argsort(entry, kind='mergesort')
+    entry_times, entry_first, entrance = np.unique(entry[entry_order], return_index=True, return_counts=True)
+
+    index = np.union1d(exit_times, entry_times)
+    exit_pos = np.searchsorted(index, exit_times)
+    entry_pos = np.searchsorted(index, entry_times)
+    table = pd.DataFrame(0, index=pd.Index(index, name='event_at'),
+                         columns=EVENT_TABLE_COLUMNS[:-1], dtype=np.int64 if weights is None else float)
+
+    def reduce(values, starts):
+        return np.add.reduceat(values, starts) if len(starts) else values[:0]
+
+    if weights is None:
+        table.iloc[exit_pos, 0] = removed
+        table.iloc[exit_pos, 1] = reduce(observed_sorted, first)
+        table.iloc[entry_pos, 3] = entrance
+    else:
+        # 重み付き: 時点ごとの重みの合計と、有効サンプルサイズ用の重みの2乗和
+        w_exit, w_entry = weights[order], weights[entry_order]
+        table.iloc[exit_pos, 0] = reduce(w_exit, first)
+        table.iloc[exit_pos, 1] = reduce(w_exit * observed_sorted, first)
+        table.iloc[entry_pos, 3] = reduce(w_entry, entry_first)
+        for name, pos, values in [('removed_raw', exit_pos, removed),
+                                  ('entrance_raw', entry_pos, entrance),
+                                  ('removed_w2', exit_pos, reduce(w_exit ** 2, first)),
+                                  ('entrance_w2', entry_pos, reduce(w_entry ** 2, entry_first))]:
+            column = np.zeros(len(index), dtype=values.dtype)
+            column[pos] = values
+            table[name] = column
+    table['censored'] = table['removed'] - table['observed']
+    return _with_at_risk(table)
+
+
+def merge_event_tables(tables):
+    '''
+    複数のevent_tableを時点の和集合上で足し合わせる (群の併合など)
+    各表は時点順に並んでいるので、連結して安定ソート(ソート済みの連のマージ)するだけでよい
+    '''
+    columns = [c for c in ADDITIVE_COLUMNS if all(c in t.columns for t in tables)]
+    times = np.concatenate([t.index.values for t in tables])
+    values = np.concatenate([t[columns].values for t in tables])
+    order = np.argsort(times, kind='stable')
+    times, values = times[order], values[order]
+    first = np.flatnonzero(np.r_[True, times[1:] != times[:-1]]) if len(times) else np.zeros(0, dtype=int)
+    merged = pd.DataFrame(np.add.reduceat(values, first, axis=0) if len(first) else values,
+                          columns=columns, index=pd.Index(times[first], name='event_at'))
+    if 'removed_raw' not in columns:
+        # 重みなしと重み付きの表を混ぜたときは重み付きの列だけ残す
+        merged = merged[[c for c in columns if not c.endswith(('_raw', '_w2'))]]
+    return _with_at_risk(merged)
+
+
+#-----------------------------------
+# ランドマーク (ある時点で生存している人だけの解析)
+def landmark_event_table(table, landmark):
+    '''
+    event_tableを時点landmarkより後だけに切り詰める (行データに戻らず、ソート済みの表を切るだけ)
+    landmarkの時点で生存している人をその時点の登録(entrance)とした1行を先頭に置く
+    '''
+    index = table.index.values
+    k = np.searchsorted(index, landmark, side='right')
+    head = {}
+    for c in ADDITIVE_COLUMNS:
+        if c not in table.columns:
+            continue
+        if c.startswith('entrance') and c != 'entrance_within':
+            # landmarkまでに登録し、landmarkより後に離脱する人数 (=その時点のリスク集合)
+            removed = table['removed' + c[len('entrance'):]].values[:k].sum()
+            head[c] = table[c].values[:k].sum() - removed
+        else:
+            head[c] = 0
+    rows = table[list(head)].iloc[k:]
+    sliced = pd.concat([pd.DataFrame(head, index=pd.Index([float(landmark)], name='event_at')), rows])
+    sliced.index = sliced.index.astype(float).rename('event_at')
+    return _with_at_risk(sliced.astype(table[list(head)].dtypes.to_dict()))
+
+
+#-----------------------------------
+# 時間グリッド上の近似 (探索用)
+def _grid_index(times, width, side='right'):
+    # 離脱は区間 (g - width, g] を g に切り上げ、登録は [g, g + width) を g に切り下げる
+    # (区間の途中で登録した人はその区間のイベントのリスク集合に入れる)
+    scaled = np.asarray(times, dtype=float) / width
+    if side == 'right':
+        return np.ceil(scaled - 1e-9).astype(np.int64)
+    return np.floor(scaled + 1e-9).astype(np.int64)
+
+
+def _grid_table(columns, k, width):
+    keep = np.flatnonzero((columns['removed'] != 0) | (columns['entrance'] != 0))
+    table = pd.DataFrame({c: columns[c][keep] for c in ADDITIVE_COLUMNS if c in columns},
+                         index=pd.Index((keep + k) * width, name='event_at', dtype=float))
+    if 'removed_raw' not in table.columns:
+        table = table.round().astype(np.int64)
+    return _with_at_risk(table)
+
+
+def binned_event_table(durations, event_observed, width, entry=None, weights=None):
+    '''
+    期間を幅widthの時間グリッドにまとめた近似のevent_table
+    ソートせずbincountだけで作るので、行数や時点の種類が多いときにevent_tableより大幅に速い
+    entrance_withinはグリッドの途中で登録した人数 (grid_error_boundで使う)
+    Args:
+        width: グリッドの幅 (durationと同じ単位)
+    '''
+    durations, event_observed, entry, weights = _prepare(durations, event_observed, entry, weights)
+    exit_k = _grid_index(durations, width)
+    entry_k = _grid_index(entry, width, side='left')
+    within = (entry / width - entry_k) > 1e-9
+    origin = min(exit_k.min(), entry_k.min())
+    exit_k, entry_k = exit_k - origin, entry_k - origin
+    size = max(exit_k.max(), entry_k.max()) + 1
+
+    def count(k, values=None):
+        return np.bincount(k, weights=values, minlength=size)
+
+    observed = event_observed.astype(float)
+    w = np.ones(len(durations)) if weights is None else weights
+    columns = {'removed': count(exit_k, w), 'observed': count(exit_k, w * observed),
+               'entrance': count(entry_k, w), 'entrance_within': count(entry_k, w * within)}
+    if weights is not None:
+        columns.update({'removed_raw': count(exit_k), 'entrance_raw': count(entry_k),
+                        'removed_w2': count(exit_k, w ** 2), 'entrance_w2': count(entry_k, w ** 2)})
+    columns['censored'] = columns['removed'] - columns['observed']
+    return _grid_table(columns, origin, width)
+
+
+def bin_event_table(table, width):
+    '''
+    作成済みのevent_table (ストリーミングや多施設の集計結果) を時間グリッド上にまとめ直す
+    '''
+    times = table.index.values
+    exit_k = _grid_index(times, width)
+    entry_k = _grid_index(times, width, side='left')
+    within = ((times / width - entry_k) > 1e-9).astype(float)
+    origin = min(exit_k.min(), entry_k.min()) if len(times) else 0
+    exit_k, entry_k = exit_k - origin, entry_k - origin
+    size = max(exit_k.max(), entry_k.max()) + 1 if len(times) else 0
+
+    columns = {}
+    for c in ADDITIVE_COLUMNS:
+        if c in table.columns and c != 'entrance_within':
+            k = entry_k if c.startswith('entrance') else exit_k
+            columns[c] = np.bincount(k, weights=table[c].values, minlength=size)
+    columns['entrance_within'] = np.bincount(entry_k, weights=table['entrance'].values * within, minlength=size)
+    return _grid_table(columns, origin, width)
+
+
+def grid_error_bound(table, width):
+    '''
+    binned_event_table / bin_event_tableの表から、近似KMと厳密KMの差 sup|S(t) - Ŝ(t)| の上限を求める
+    近似ではグリッド区間内の離脱と途中登録がすべてイベントより後にあるとみなすので、厳密な生存率は
+    近似以下で、区間内の打ち切りと途中登録がすべてイベントより先のとき (リスク集合 n - 打ち切り - 途中登録) が最も低い
+    '''
+    entrance = table['entrance'].values.astype(float)
+    first_entrance = np.zeros(len(entrance))
+    first_entrance[:1] = entrance[:1]
+    n = table['at_risk'].values - entrance + first_entrance
+    d = table['observed'].values.astype(float)
+    c = table['censored'].values.astype(float)
+    # 区間 (g - width, g] の途中登録は1つ前のグリッド g - width の行に入っている
+    k = np.round(table.index.values / width).astype(np.int64)
+    within = pd.Series(table['entrance_within'].values, index=k).reindex(k - 1, fill_value=0.).values
+
+    # 途中登録が多いとリスク集合の下限 n - c - within がイベント数以下になる。そのときは0まで下がりうるとみなす
+    floor = n - c - within
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low = np.where(d > 0, np.where(floor > d, 1 - d / floor, 0.), 1.)
+        approx = np.where(d > 0, 1 - d / n, 1.)
+    S_low = np.cumprod(low)
+    S_prev = np.concatenate([[1.], np.cumprod(np.clip(approx, 0., 1.))[:-1]])
+    return float(np.max(S_prev - S_low, initial=0.))
+
+
+#-----------------------------------
+# カプランマイヤー推定
+def _km_arrays(at_risk, observed):
+    at_risk = np.asarray(at_risk, dtype=float)
+    observed = np.asarray(observed, dtype=float)
+    # 重み付きの累積和では丸め誤差で at_risk - observed がわずかに負になることがある
+    survivors = np.maximum(at_risk - observed, 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_step = np.where(at_risk > 0, np.log(survivors) - np.log(at_risk), 0.)
+        var_step = np.where(survivors > 1e-12, observed / (at_risk * survivors), 0.)
+    return np.exp(np.cumsum(log_step)), np.cumsum(var_step)
+
+
+def _first_time_below(values, timeline, q=0.5):
+    # 生存率がq以下になる最初の時点 (到達しなければinf)
+    below = values <= q
+    if not below.any():
+        return np.inf
+    return timeline[np.argmax(below)]
+
+
+def _exp_greenwood(survival, cumulative_sq, alpha):
+    # exponential Greenwoodの信頼区間 (lifelinesと同じ式)
+    z = stats.norm.ppf(1 - alpha / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.log(survival)
+        lower = np.exp(-np.exp(np.log(-v) - z * np.sqrt(cumulative_sq) / v))
+        upper = np.exp(-np.exp(np.log(-v) + z * np.sqrt(cumulative_sq) / v))
+    return lower, upper
+
+
+#-----------------------------------
+# 同時信頼帯 (Hall-Wellner, equal precision)
+# 臨界値はBrownian bridgeの上限の分布から求める。パスは最初に1回だけシミュレーションして使い回す
+BAND_PATHS = 4000
+BAND_GRID = 1000
+BAND_KINDS = ('hall-wellner', 'equal-precision')
+
+
+@functools.lru_cache(maxsize=1)
+def _brownian_bridges(n_paths=BAND_PATHS, n_grid=BAND_GRID, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.arange(1, n_grid) / n_grid
+    w = np.cumsum(rng.standard_normal((n_paths, n_grid), dtype=np.float32), axis=1) / np.float32(np.sqrt(n_grid))
+    return x, np.abs(w[:, :-1] - x.astype(np.float32) * w[:, -1:])
+
+
+@functools.lru_cache(maxsize=256)
+def _band_critical_value(lo, hi, kind, alpha):
+    x, bridges = _brownian_bridges()
+    paths = bridges[:, lo:hi]
+    if kind == 'equal-precision':
+        paths = paths / np.sqrt(x[lo:hi] * (1 - x[lo:hi])).astype(np.float32)
+    return float(np.quantile(paths.max(axis=1), 1 - alpha))
+
+
+def band_critical_value(a_lower, a_upper, kind='hall-wellner', alpha=0.05):
+    '''
+    同時信頼帯の臨界値 (Klein & Moeschberger 4.4節の表 C.3, C.4 にあたる値)
+    Args:
+        a_lower, a_upper: 帯をつける範囲の両端での n σ² / (1 + n σ²)
+        kind: 'hall-wellner' (sup|W°(x)|) か 'equal-precision' (sup|W°(x)| / sqrt(x(1-x)))
+    '''
+    if kind not in BAND_KINDS:
+        raise ValueError(f'対応していない信頼帯です: {kind}')
+    x, _ = _brownian_bridges()
+    # グリッドの位置に丸めるので、同じ範囲なら2回目からはキャッシュから返す
+    lo = int(np.clip(np.searchsorted(x, a_lower), 0, len(x) - 1))
+    hi = int(np.clip(np.searchsorted(x, a_upper, side='right'), lo + 1, len(x)))
+    return _band_critical_value(lo, hi, kind, alpha)
+
+
+def simultaneous_band(survival, cumulative_sq, observed, n, kind='hall-wellner', alpha=0.05):
+    '''
+    KMの同時信頼帯 (arcsine-square-root変換, 臨界値は最初のイベントから分散が求まる最後のイベントまでの範囲で)
+    log(-log)変換はS=1の近くで帯が極端に広がるので、Klein & Moeschbergerにならってこちらを使う
+    Args:
+        survival, cumulative_sq: KMとGreenwoodの Σ d / (n (n - d))
+        observed: 各時点のイベント数
+        n: 症例数
+    Returns:
+        (下限, 上限) の配列
+    '''
+    events = np.flatnonzero((np.asarray(observed) > 0) & (survival > 0) & np.isfinite(cumulative_sq))
+    if len(events) == 0:
+        return survival.copy(), survival.copy()
+    a = n * cumulative_sq / (1 + n * cumulative_sq)
+    c = band_critical_value(a[events[0]], a[events[-1]], kind, alpha)
+    if kind == 'hall-wellner':
+        half = c * (1 + n * cumulative_sq) / np.sqrt(n)
+    else:
+        half = c * np.sqrt(cumulative_sq)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        center = np.arcsin(np.sqrt(survival))
+        width = 0.5 * half * np.sqrt(survival / (1 - survival))
+        lower = np.sin(np.maximum(0., center - width)) ** 2
+        upper = np.sin(np.minimum(np.pi / 2, center + width)) ** 2
+    # 最初のイベントより前(S=1)は幅0
+    return np.where(survival >= 1, 1., lower), np.where(survival >= 1, 1., upper)
+
+
+class TableKaplanMeierFitter:
+    '''
+    event_tableから直接KMを求めるfitter
+    draw_kmやadd_at_risk_countsで使う属性はlifelinesのKaplanMeierFitterに揃えている
+    '''
+
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+
+    def fit(self, durations, event_observed, entry=None, weights=None, label=None):
+        self.entry = entry
+        self.weights = weights
+        return self.fit_event_table(event_table(durations, event_observed, entry, weights),
+                                    label=label)
+
+    def fit_event_table(self, table, label=None):
+        self._label = 'KM_estimate' if label is None else label
+        self.event_table = table
+        self.weighted = 'at_risk_raw' in table.columns
+        self.timeline = table.index.values.astype(float)
+
+        # 同時点の新規登録者はその時点のリスク集合に含めない (最初の時点を除く, lifelinesと同じ)
+        entrance = table['entrance'].values.copy()
+        entrance[:1] = 0
+        survival, cumulative_sq = _km_arrays(table['at_risk'].values - entrance,
+                                             table['observed'].values)
+
+        return self._set_estimates(survival, cumulative_sq, *_exp_greenwood(survival, cumulative_sq, self.alpha))
+
+    def restore(self, table, survival, cumulative_sq, lower, upper, label=None):
+        '''
+        保存しておいた推定値からfit済みの状態に戻す (fitし直さない)
+        '''
+        self._label = 'KM_estimate' if label is None else label
+        self.event_table = table
+        self.weighted = 'at_risk_raw' in table.columns
+        self.timeline = table.index.values.astype(float)
+        return self._set_estimates(survival, cumulative_sq, lower, upper)
+
+    def condition_on(self, landmark, label=None):
+        '''
+        landmarkの時点で生存していた人の条件付き生存曲線 S(t | T > landmark) = S(t) / S(landmark)
+        fit済みの推定値を切り詰めて割り直すだけで、fitし直さない
+        Returns:
+            landmarkから始まるTableKaplanMeierFitter (landmarkで誰もリスク集合にいなければNone)
+        '''
+        k = np.searchsorted(self.timeline, landmark, side='right')
+        survival = self.survival_function_.values[:, 0]
+        base = survival[k - 1] if k > 0 else 1.
+        base_sq = self._cumulative_sq_[k - 1] if k > 0 else 0.
+        table = landmark_event_table(self.event_table, landmark)
+        if base <= 0 or table['at_risk'].values[0] <= 0:
+            return None
+        conditional = np.r_[1., survival[k:] / base]
+        cumulative_sq = np.r_[0., self._cumulative_sq_[k:] - base_sq]
+        return TableKaplanMeierFitter(alpha=self.alpha).restore(
+            table, conditional, cumulative_sq, *_exp_greenwood(conditional, cumulative_sq, self.alpha),
+            label=self._label if label is None else label)
+
+    def with_band(self, kind='hall-wellner'):
+        '''
+        confidence_interval_を同時信頼帯に置き換えたfitter (生存率は同じで、fitし直さない)
+        種類ごとに1回だけ計算してこのfitterに持っておく
+        '''
+        bands = self.__dict__.setdefault('_bands', {})
+        if kind not in bands:
+            table = self.event_table
+            # 症例数 (遅延登録があれば途中で登録した人も含めた総数)
+            n = table['entrance'].values.sum()
+            survival = self.survival_function_.values[:, 0]
+            lower, upper = simultaneous_band(survival, self._cumulative_sq_, table['observed'].values, n,
+                                             kind=kind, alpha=self.alpha)
+            bands[kind] = TableKaplanMeierFitter(alpha=self.alpha).restore(
+                table, survival, self._cumulative_sq_, lower, upper, label=self._label)
+        return bands[kind]
+
+    def _set_estimates(self, survival, cumulative_sq, lower, upper):
+        self._cumulative_sq_ = cumulative_sq
+        self.survival_function_ = pd.DataFrame({self._label: survival}, index=self.timeline)
+        self.survival_function_.index.name = 'timeline'
+        ci_labels = ['%s_lower_%g' % (self._label, 1 - self.alpha),
+                     '%s_upper_%g' % (self._label, 1 - self.alpha)]
+        self.confidence_interval_ = pd.DataFrame(
+            {ci_labels[0]: lower, ci_labels[1]: upper}, index=self.timeline).fillna(1.0)
+        self.confidence_interval_survival_function_ = self.confidence_interval_
+
+        self.median_survival_time_ = _first_time_below(survival, self.timeline)
+        self.median_confidence_interval_ = (
+            _first_time_below(self.confidence_interval_.values[:, 0], self.timeline),
+            _first_time_below(self.confidence_interval_.values[:, 1], self.timeline),
+        )
+        return self
+
+    def survival_function_at_times(self, times):
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        pos = np.searchsorted(self.timeline, times, side='right') - 1
+        values = np.where(pos >= 0, self.survival_function_.values[np.clip(pos, 0, None), 0], 1.0)
+        return pd.Series(values, index=times, name=self._label)
+
+    def at_risk_view(self, kind='raw'):
+        '''
+        add_at_risk_counts用に、重み付き解析の実人数(raw)または有効サンプルサイズ(effective)を
+        at_risk列に置き換えたオブジェクトを返す
+        '''
+        suffix = '_raw' if kind == 'raw' else '_eff'
+        table = self.event_table.assign(at_risk=self.event_table['at_risk' + suffix],
+                                        removed=self.event_table['removed' + suffix])
+        label = '%s (%s)' % (self._label, 'raw' if kind == 'raw' else 'eff.')
+        return SimpleNamespace(event_table=table, _label=label)
+
+    def predict(self, times):
+        return self.survival_function_at_times(times)
+
+    def plot(self, **kwargs):
+        return custom_lifelines_plotting._plot_estimate(self, estimate='survival_function_', **kwargs)
+
+    plot_survival_function = plot
+
+
+#-----------------------------------
+# Logrank検定
+def _risk_and_events(times, table):
+    # event tableから指定時点のリスク集合 (entry < t <= exit) とイベント数を求める (二分探索のみ)
+    index = table.index.values
+    entrance = table['entrance'].values
+    left = np.searchsorted(index, times, side='left')
+    right = np.searchsorted(index, times, side='right')
+    at_risk = _cumsum0(entrance)[left] - _cumsum0(table['removed'].values)[left]
+    # 最初の時点の登録者はその時点からリスク集合に入る (lifelinesのKMと同じ扱い)
+    at_risk = at_risk + np.where(times == index[0], entrance[0], 0.)
+    events = np.where(right > left, table['observed'].values[right - 1], 0.)
+    return at_risk, events
+
+
+def logrank_test_tables(table_A, table_B, weightings=None):
+    '''
+    2群のevent_tableからlogrank検定 (weightings='wilcoxon'でGehan-Wilcoxon)
+    重み付きの表なら重み付きの人数で検定する (lifelinesのweightsと同じ扱い)
+    Returns:
+        (検定統計量(chi2), p値)
+    '''
+    times = np.union1d(table_A.index.values[table_A['observed'].values > 0],
+                       table_B.index.values[table_B['observed'].values > 0])
+    n_A, o_A = _risk_and_events(times, table_A)
+    n_B, o_B = _risk_and_events(times, table_B)
+    n, o = n_A + n_B, o_A + o_B
+
+    if weightings == 'wilcoxon':
+        w = n
+    else:
+        w = np.ones_like(n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected_A = np.where(n > 0, n_A * o / n, 0.)
+        var = np.where(n > 1, n_A * n_B * o * (n - o) / (n ** 2 * (n - 1)), 0.)
+    z = np.sum(w * (o_A - expected_A))
+    v = np.sum(w ** 2 * var)
+    if v <= 0:
+        return 0., 1.0
+    test_statistic = z ** 2 / v
+    return test_statistic, stats.chi2.sf(test_statistic, 1)
+
+
+def logrank_test(durations_A, durations_B, event_observed_A, event_observed_B,
+                 entry_A=None, entry_B=None, weights_A=None, weights_B=None, weightings=None):
+    '''
+    2群のlogrank検定 (行データから。event_tableを作ってlogrank_test_tablesに渡す)
+    '''
+    return logrank_test_tables(event_table(durations_A, event_observed_A, entry_A, weights_A),
+                               event_table(durations_B, event_observed_B, entry_B, weights_B),
+                               weightings=weightings)
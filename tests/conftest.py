@@ -0,0 +1,5 @@
+import os
+import sys
+
+# アプリのモジュールはリポジトリ直下に平置きなので、テストからimportできるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
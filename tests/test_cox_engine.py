@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lifelines import CoxPHFitter
+from lifelines.statistics import proportional_hazard_test as lifelines_ph_test
+
+from cox_engine import EfronCoxFitter, proportional_hazard_test
+
+
+def _data(seed, n=400, ties=True):
+    rng = np.random.default_rng(seed)
+    x1 = rng.normal(size=n)
+    x2 = rng.integers(0, 2, n)
+    duration = rng.exponential(10 * np.exp(-0.5 * x1 + 0.3 * x2)) + 1
+    if ties:
+        # 同時点のイベント(タイ)が出るように丸める
+        duration = np.round(duration, 0)
+    return pd.DataFrame({
+        'duration': duration,
+        'event': (rng.random(n) < 0.7).astype(int),
+        'x1': x1,
+        'x2': x2,
+        'entry': np.round(duration * rng.uniform(0, 0.5, n), 0),
+        'weight': rng.uniform(0.5, 2.0, n),
+        'site': rng.integers(0, 3, n),
+    })
+
+
+# lifelinesのロバスト分散のスコア残差はタイを扱わない (Efronではない) ので、robustはタイのないデータで比べる
+@pytest.mark.parametrize('options, ties', [
+    ({}, True),
+    ({'entry_col': 'entry'}, True),
+    ({'weights_col': 'weight'}, True),
+    ({'weights_col': 'weight', 'robust': True}, False),
+    ({'strata': ['site']}, True),
+])
+def test_matches_lifelines(options, ties):
+    df = _data(0, ties=ties)
+    columns = ['duration', 'event', 'x1', 'x2'] + [v for k, v in options.items() if k.endswith('_col')] + \
+        list(options.get('strata', []))
+    expected = CoxPHFitter().fit(df[columns], 'duration', 'event', **options)
+    cph = EfronCoxFitter().fit(df[columns], 'duration', 'event', **options)
+
+    # lifelinesの収束判定はこちらより緩いので、重み付きでは6桁目がずれる
+    np.testing.assert_allclose(cph.params_.values, expected.params_.values, rtol=1e-5)
+    np.testing.assert_allclose(cph.standard_errors_.values, expected.standard_errors_.values, rtol=1e-5)
+    assert cph.log_likelihood_ == pytest.approx(expected.log_likelihood_, rel=1e-8)
+
+
+def test_constant_covariate_is_nan():
+    df = _data(1).assign(x3=1.0)[['duration', 'event', 'x1', 'x3']]
+    expected = CoxPHFitter().fit(df.drop(columns='x3'), 'duration', 'event')
+    cph = EfronCoxFitter().fit(df, 'duration', 'event')
+
+    assert cph.dropped_covariates_ == ['x3']
+    assert cph.params_['x1'] == pytest.approx(expected.params_['x1'], rel=1e-6)
+    assert cph.summary.loc['x3'].isna().all()
+
+
+# 'rank'はlifelinesが全行のdurationの順位, こちらはイベント時点の順位(Rのcox.zph)なので比べない
+@pytest.mark.parametrize('time_transform', ['identity', 'log'])
+def test_proportional_hazard_test_matches_lifelines(time_transform):
+    df = _data(2)[['duration', 'event', 'x1', 'x2']]
+    expected = lifelines_ph_test(CoxPHFitter().fit(df, 'duration', 'event'), df, time_transform=time_transform)
+    result = proportional_hazard_test(EfronCoxFitter().fit(df, 'duration', 'event'), time_transform=time_transform)
+
+    np.testing.assert_allclose(result.loc[['x1', 'x2'], 'test_statistic'].values,
+                               expected.summary['test_statistic'].values, rtol=1e-4)
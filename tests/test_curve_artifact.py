@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lifelines import KaplanMeierFitter
+
+from curve_artifact import dump_artifact, load_artifact
+from survival_engine import TableKaplanMeierFitter, event_table
+
+
+def _tables():
+    rng = np.random.default_rng(0)
+    tables, rows = {}, {}
+    for group, scale in [('A', 10.), ('B', 14.)]:
+        durations = np.round(rng.exponential(scale, 150), 1) + 0.1
+        events = rng.random(150) < 0.7
+        tables[group] = event_table(durations, events)
+        rows[group] = (durations, events)
+    return tables, rows
+
+
+@pytest.mark.parametrize('from_file', [False, True])
+def test_round_trip(tmp_path, from_file):
+    tables, rows = _tables()
+    tests = {'logrank': pd.DataFrame({'group1': ['A'], 'group2': ['B'], 'chi2': [3.21], 'p': [0.073]})}
+    data = dump_artifact(tables, style={'title': 'OS'}, tests=tests)
+    if from_file:
+        path = tmp_path / 'curve.kmc'
+        path.write_bytes(data)
+        artifact = load_artifact(str(path))
+    else:
+        artifact = load_artifact(data)
+
+    assert list(artifact.curves) == ['A', 'B']
+    assert artifact.style == {'title': 'OS'}
+    for group, table in tables.items():
+        kmf = artifact.curves[group]
+        fitted = TableKaplanMeierFitter().fit_event_table(table, label=group)
+        pd.testing.assert_frame_equal(kmf.event_table, fitted.event_table, check_dtype=False)
+        np.testing.assert_array_equal(kmf.survival_function_.values, fitted.survival_function_.values)
+        np.testing.assert_array_equal(kmf.confidence_interval_.values, fitted.confidence_interval_.values)
+        # 再計算なしで読み込んだ曲線がlifelinesのKMと一致する
+        expected = KaplanMeierFitter().fit(*rows[group])
+        np.testing.assert_allclose(kmf.survival_function_at_times(expected.timeline).values,
+                                   expected.survival_function_.values[:, 0], atol=1e-10)
+        assert kmf.median_survival_time_ == expected.median_survival_time_
+    pd.testing.assert_frame_equal(artifact.tests['logrank'], tests['logrank'])
+
+    # 「全体集団」の曲線は全行でfitしたKMと同じ
+    durations, events = (np.concatenate(a) for a in zip(*rows.values()))
+    expected = KaplanMeierFitter().fit(durations, events)
+    pooled = artifact.curves_for(by_subgroup=False)['全体']
+    np.testing.assert_allclose(pooled.survival_function_at_times(expected.timeline).values,
+                               expected.survival_function_.values[:, 0], atol=1e-10)
+
+
+def test_not_an_artifact():
+    with pytest.raises(ValueError):
+        load_artifact(b'not a curve artifact file')
@@ -0,0 +1,108 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import disk_cache
+from survival_engine import TableKaplanMeierFitter
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(disk_cache, '_usage', {'bytes': None, 'writes': 0})
+    return tmp_path
+
+
+def _files(cache_dir, suffix):
+    return sorted(p.name for p in cache_dir.rglob('*' + suffix))
+
+
+def test_memoize_hit_and_miss(cache_dir):
+    calls = []
+
+    @disk_cache.memoize
+    def total(df, column):
+        calls.append(column)
+        return df[column].sum()
+
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': [4, 5, 6]})
+    assert total(df, 'a') == 6
+    assert total(df.copy(), 'a') == 6
+    assert total(df, 'b') == 15
+    # 中身が変われば別のキー
+    assert total(df.assign(a=[1, 2, 4]), 'a') == 7
+    assert calls == ['a', 'b', 'a']
+    assert len(_files(cache_dir, '.pkl')) == 3
+
+
+def test_cache_key_is_stable():
+    df = pd.DataFrame({'a': [1., 2.]})
+    assert disk_cache.cache_key('f', df, {'x': 1}) == disk_cache.cache_key('f', df.copy(), {'x': 1})
+    assert disk_cache.cache_key('f', df, {'x': 1}) != disk_cache.cache_key('f', df, {'x': 2})
+    assert disk_cache.cache_key('f', np.arange(3)) != disk_cache.cache_key('f', np.arange(3.))
+
+
+def test_cache_key_dict_order_and_label():
+    # 群の並びが変われば凡例の順も変わるので別のキー
+    assert disk_cache.cache_key({'A': 1, 'B': 2}) != disk_cache.cache_key({'B': 2, 'A': 1})
+    data = {'durations': [1., 2., 3.], 'event_observed': [1, 0, 1]}
+    a = TableKaplanMeierFitter().fit(**data, label='A')
+    assert disk_cache.cache_key(a) == disk_cache.cache_key(TableKaplanMeierFitter().fit(**data, label='A'))
+    assert disk_cache.cache_key(a) != disk_cache.cache_key(TableKaplanMeierFitter().fit(**data, label='B'))
+
+
+def test_store_replaces_atomically(cache_dir):
+    key = disk_cache.cache_key('atomic')
+    disk_cache.store(key, 'old')
+    disk_cache.store(key, 'new')
+    assert disk_cache.load(key) == (True, 'new')
+    # pickleできない値は書きかけのファイルを残さず, 前の値もそのまま
+    with pytest.raises(Exception):
+        disk_cache.store(key, lambda: None)
+    assert disk_cache.load(key) == (True, 'new')
+    assert _files(cache_dir, '.tmp') == []
+
+
+def test_broken_file_is_a_miss(cache_dir):
+    key = disk_cache.cache_key('broken')
+    disk_cache.store(key, [1, 2, 3])
+    with open(disk_cache._path(key), 'wb') as f:
+        f.write(b'not a pickle')
+    assert disk_cache.load(key) == (False, None)
+    assert not os.path.exists(disk_cache._path(key))
+
+
+def test_evict_least_recently_used(cache_dir, monkeypatch):
+    monkeypatch.setattr(disk_cache, 'MAX_BYTES', 10 ** 9)
+    keys = [disk_cache.cache_key('lru', i) for i in range(10)]
+    for i, key in enumerate(keys):
+        disk_cache.store(key, np.zeros(1000))
+        os.utime(disk_cache._path(key), (1000 + i, 1000 + i))
+    size = os.path.getsize(disk_cache._path(keys[0]))
+    # 一番古い2つのうち片方を読むと, 最後に使ったことになって残る
+    assert disk_cache.load(keys[0])[0]
+
+    total = disk_cache.evict(max_bytes=8 * size)
+    # 上限を超えたら EVICT_TARGET の割合まで減らす
+    kept = [disk_cache.load(key)[0] for key in keys]
+    assert total <= 8 * size * disk_cache.EVICT_TARGET
+    assert kept == [True, False, False, False] + [True] * 6
+    # 上限以下なら何も消さない
+    assert disk_cache.evict(max_bytes=8 * size) == total
+
+
+def test_store_scans_only_over_the_limit(cache_dir, monkeypatch):
+    scans = []
+    evict = disk_cache.evict
+    monkeypatch.setattr(disk_cache, 'evict', lambda *args: scans.append(1) or evict(*args))
+    size = len(pickle.dumps(np.zeros(1000), protocol=pickle.HIGHEST_PROTOCOL))
+    monkeypatch.setattr(disk_cache, 'MAX_BYTES', 20 * size)
+
+    for i in range(50):
+        disk_cache.store(disk_cache.cache_key('scan', i), np.zeros(1000))
+    # 最初の1回と, 見積もりが上限を超えたときだけ数え直す (上限の1割まで空けるので数回おき)
+    assert len(scans) <= 1 + (50 - 20) // 2
+    assert sum(size for _, size, _ in disk_cache._entries()) <= 20 * size
@@ -0,0 +1,90 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from endpoints import detect_endpoints, detect_interval, read_endpoints
+
+
+SAMPLE_DIR = Path(__file__).resolve().parents[1] / 'sample_table'
+
+
+def _workbook(tmp_path, sheets):
+    path = tmp_path / 'data.xlsx'
+    with pd.ExcelWriter(path) as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return path
+
+
+def test_detect_endpoints():
+    columns = ['duration', 'event', 'OS_duration', 'OS_event', 'duration PFS', 'event PFS', 'DFS_duration',
+               'subgroup']
+    assert detect_endpoints(columns) == {
+        '': ('duration', 'event'),
+        'OS': ('OS_duration', 'OS_event'),
+        'PFS': ('duration PFS', 'event PFS'),
+    }
+    # durationとeventの組がなければ何も見つからない
+    assert detect_endpoints(['time', 'status']) == {}
+    # 区切り文字のない列名はエンドポイントにしない
+    assert detect_endpoints(['prevent', 'preduration', 'eventful', 'durationful', 'OSduration', 'OSevent']) == {}
+    assert detect_endpoints(['prevent_duration', 'prevent_event']) == {'prevent': ('prevent_duration', 'prevent_event')}
+
+
+def test_read_endpoints(tmp_path):
+    path = _workbook(tmp_path, {
+        'OS': pd.DataFrame({'duration': [1., 2., 3.], 'event': [1, 0, 1], 'subgroup': ['A', 'B', 'A']}),
+        'trial': pd.DataFrame({'OS_duration': [4., 5.], 'OS_event': [1, 1],
+                               'PFS_duration': [2., np.nan], 'PFS_event': [1, 0], 'subgroup': ['A', 'B']}),
+    })
+    endpoints = read_endpoints(path)
+
+    # 名前のない組はシート名, 別のシートと同じ名前ならシート名を付ける
+    assert list(endpoints) == ['OS', 'trial: OS', 'PFS']
+    assert endpoints['trial: OS']['duration'].tolist() == [4., 5.]
+    # 他のエンドポイントの列は含めず, 空欄の行は除く
+    assert set(endpoints['PFS'].columns) == {'duration', 'event', 'subgroup'}
+    assert endpoints['PFS']['duration'].tolist() == [2.]
+
+
+def test_read_interval_endpoint(tmp_path):
+    assert detect_interval(['Lower', 'UPPER', 'subgroup']) == ('Lower', 'UPPER')
+    assert detect_interval(['lower', 'duration']) is None
+    # duration, eventの組がないシートのlower, upperは区間打ち切りデータとして読む
+    path = _workbook(tmp_path, {
+        'OS': pd.DataFrame({'duration': [1., 2.], 'event': [1, 0]}),
+        'visits': pd.DataFrame({'lower': [0., 2., np.nan], 'upper': [3., np.nan, 5.]}),
+    })
+    endpoints = read_endpoints(path)
+
+    assert list(endpoints) == ['OS', 'visits']
+    assert endpoints['visits']['lower'].tolist() == [0., 2., 0.]
+    assert endpoints['visits']['upper'].tolist() == [3., np.inf, 5.]
+
+
+def test_read_endpoints_report(tmp_path):
+    path = _workbook(tmp_path, {
+        'Sheet1': pd.DataFrame({'OS_duration': [1., -2., 3.], 'OS_event': [1, 1, 0],
+                                'PFS_duration': [1., 2., 3.], 'PFS_event': [1, 5, 0]}),
+    })
+    endpoints, report = read_endpoints(path, report=True)
+
+    assert [len(df) for df in endpoints.values()] == [2, 2]
+    assert report[['エンドポイント', 'シート', '行', '列']].values.tolist() == [
+        ['OS', 'Sheet1', 3, 'OS_duration'], ['PFS', 'Sheet1', 3, 'PFS_event']]
+
+
+def test_read_empty_template():
+    # 列名だけのテンプレートは空のエンドポイントになる (Appはそれを警告して表示しない)
+    endpoints = read_endpoints(SAMPLE_DIR / 'テンプレート.xlsx')
+
+    assert list(endpoints) == ['Sheet1']
+    assert len(endpoints['Sheet1']) == 0
+
+
+def test_read_endpoints_without_columns(tmp_path):
+    path = _workbook(tmp_path, {'Sheet1': pd.DataFrame({'time': [1.], 'status': [1]})})
+    with pytest.raises(ValueError):
+        read_endpoints(path)
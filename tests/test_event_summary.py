@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from lifelines import KaplanMeierFitter
+from lifelines.statistics import logrank_test as lifelines_logrank_test
+
+from event_summary import dump_summary, pool_summaries
+from survival_engine import TableKaplanMeierFitter, event_table, logrank_test_tables
+
+
+def _site(seed, n):
+    rng = np.random.default_rng(seed)
+    group = np.where(rng.random(n) < 0.5, 'A', 'B')
+    # 施設をまたいで同じ時点が出るように丸める
+    durations = np.round(rng.exponential(np.where(group == 'A', 10., 14.)), 0) + 1
+    return {'group': group, 'durations': durations, 'events': rng.random(n) < 0.7,
+            'entry': np.round(durations * rng.uniform(0, 0.5, n), 0)}
+
+
+def _summary(site, name):
+    tables = {g: event_table(site['durations'][site['group'] == g], site['events'][site['group'] == g],
+                             site['entry'][site['group'] == g])
+              for g in ['A', 'B']}
+    return dump_summary(tables, site=name)
+
+
+def test_pooled_summaries_match_lifelines_on_all_rows():
+    sites = [_site(seed, n) for seed, n in [(0, 150), (1, 80), (2, 200)]]
+    headers, pooled = pool_summaries([_summary(site, f'site{i}') for i, site in enumerate(sites)])
+    rows = {k: np.concatenate([site[k] for site in sites]) for k in sites[0]}
+
+    assert [h['site'] for h in headers] == ['site0', 'site1', 'site2']
+    for g in ['A', 'B']:
+        mask = rows['group'] == g
+        expected = KaplanMeierFitter().fit(rows['durations'][mask], rows['events'][mask], entry=rows['entry'][mask])
+        kmf = TableKaplanMeierFitter().fit_event_table(pooled[g])
+        np.testing.assert_allclose(kmf.survival_function_at_times(expected.timeline).values,
+                                   expected.survival_function_.values[:, 0], atol=1e-10)
+
+    # 遅延登録のないデータならlogrank検定も行データの結果と一致する
+    sites = [dict(site, entry=np.zeros(len(site['durations']))) for site in sites]
+    _, pooled = pool_summaries([_summary(site, '') for site in sites])
+    rows = {k: np.concatenate([site[k] for site in sites]) for k in sites[0]}
+    a, b = rows['group'] == 'A', rows['group'] == 'B'
+    expected = lifelines_logrank_test(rows['durations'][a], rows['durations'][b], rows['events'][a], rows['events'][b])
+    statistic, _ = logrank_test_tables(pooled['A'], pooled['B'])
+    assert statistic == pytest.approx(expected.test_statistic, rel=1e-8)
+
+
+def test_different_event_flag_is_rejected():
+    site = _site(3, 50)
+    tables = {'A': event_table(site['durations'], site['events'])}
+    with pytest.raises(ValueError):
+        pool_summaries([dump_summary(tables, event_flag=1), dump_summary(tables, event_flag=0)])
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from lifelines.statistics import logrank_test as lifelines_logrank_test
+
+from power_sim import logrank_statistics
+
+
+def test_logrank_statistics_matches_lifelines():
+    rng = np.random.default_rng(0)
+    r, n = 20, 120
+    group = (rng.random((r, n)) < 0.5).astype(int)
+    # 同時点のイベント(タイ)が出るように丸める
+    durations = np.round(rng.exponential(np.where(group == 1, 14., 10.)), 0)
+    events = (rng.random((r, n)) < 0.7).astype(int)
+
+    z, n_events = logrank_statistics(durations, events, group)
+
+    for i in range(r):
+        treat = group[i] == 1
+        expected = lifelines_logrank_test(durations[i, treat], durations[i, ~treat],
+                                          events[i, treat], events[i, ~treat])
+        assert z[i] ** 2 == pytest.approx(expected.test_statistic, rel=1e-8)
+    np.testing.assert_array_equal(n_events, events.sum(axis=1))
+    # 試験群のO-Eなので、試験群のイベントが少なければ負になる
+    assert np.mean(z < 0) > 0.5
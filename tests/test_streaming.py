@@ -0,0 +1,40 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from streaming import stream_event_tables
+from utils import group_event_tables
+
+
+def _df(seed, n=500):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'duration': np.round(rng.exponential(10, n), 1) + 0.1,
+                         'event': (rng.random(n) < 0.7).astype(int),
+                         'subgroup': rng.choice(['A', 'B'], n)})
+
+
+def _upload(df, kind):
+    # st.file_uploaderと同じく、名前の付いたメモリ上のファイルにする
+    buffer = io.BytesIO()
+    if kind == 'csv':
+        buffer.write(df.to_csv(index=False).encode())
+    else:
+        array = np.zeros(len(df), dtype=[('duration', 'f8'), ('event', 'i8'), ('subgroup', 'U1')])
+        for name in array.dtype.names:
+            array[name] = df[name].values
+        np.save(buffer, array)
+    buffer.seek(0)
+    buffer.name = f'data.{kind}'
+    return buffer
+
+
+@pytest.mark.parametrize('kind', ['csv', 'npy'])
+def test_stream_upload_equals_group_event_tables(kind):
+    df = _df(0)
+    tables = stream_event_tables(_upload(df, kind), chunksize=120)
+    expected = group_event_tables(df)
+    assert set(tables) == set(expected)
+    for group, table in expected.items():
+        pd.testing.assert_frame_equal(tables[group], table, check_dtype=False)
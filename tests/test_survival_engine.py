@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lifelines import KaplanMeierFitter
+from lifelines.statistics import logrank_test as lifelines_logrank_test
+from scipy import stats
+
+from survival_engine import TableKaplanMeierFitter, event_table, logrank_test, \
+    binned_event_table, bin_event_table, grid_error_bound, band_critical_value
+
+
+def _data(seed, n=300, entry=False, weights=False):
+    rng = np.random.default_rng(seed)
+    # 同時点のイベント(タイ)が出るように丸める
+    durations = np.round(rng.exponential(10, n), 1) + 0.1
+    events = rng.random(n) < 0.7
+    data = {'durations': durations, 'event_observed': events}
+    if entry:
+        data['entry'] = np.round(durations * rng.uniform(0, 0.5, n), 1)
+    if weights:
+        # lifelinesは分散の計算でat_riskを整数に切り捨てるので、比較できるよう整数の重みにする
+        data['weights'] = rng.integers(1, 4, n).astype(float)
+    return data
+
+
+@pytest.mark.parametrize('entry, weights', [(False, False), (True, False), (False, True), (True, True)])
+def test_km_matches_lifelines(entry, weights):
+    data = _data(0, entry=entry, weights=weights)
+    expected = KaplanMeierFitter().fit(**data)
+    kmf = TableKaplanMeierFitter().fit(**data)
+
+    timeline = expected.timeline
+    np.testing.assert_allclose(kmf.survival_function_at_times(timeline).values,
+                               expected.survival_function_.values[:, 0], atol=1e-10)
+    ci = kmf.confidence_interval_.reindex(timeline, method='ffill').fillna(1.0).values
+    np.testing.assert_allclose(ci, expected.confidence_interval_.values, atol=1e-8)
+    assert kmf.median_survival_time_ == expected.median_survival_time_
+
+
+def test_fit_event_table_equals_fit():
+    data = _data(1, entry=True, weights=True)
+    direct = TableKaplanMeierFitter().fit(**data)
+    table = event_table(data['durations'], data['event_observed'], data['entry'], data['weights'])
+    from_table = TableKaplanMeierFitter().fit_event_table(table)
+    np.testing.assert_allclose(from_table.survival_function_.values, direct.survival_function_.values)
+
+
+@pytest.mark.parametrize('weightings', [None, 'wilcoxon'])
+@pytest.mark.parametrize('weights', [False, True])
+def test_logrank_matches_lifelines(weightings, weights):
+    a, b = _data(2, weights=weights), _data(3, n=250, weights=weights)
+    b['durations'] = b['durations'] * 1.3
+    expected = lifelines_logrank_test(a['durations'], b['durations'], a['event_observed'], b['event_observed'],
+                                      weights_A=a.get('weights'), weights_B=b.get('weights'),
+                                      weightings=weightings)
+    statistic, p = logrank_test(a['durations'], b['durations'], a['event_observed'], b['event_observed'],
+                                weights_A=a.get('weights'), weights_B=b.get('weights'), weightings=weightings)
+    assert statistic == pytest.approx(expected.test_statistic, rel=1e-8)
+    assert p == pytest.approx(expected.p_value, rel=1e-6)
+
+
+@pytest.mark.parametrize('width', [0.5, 2.0])
+@pytest.mark.parametrize('entry', [False, True])
+def test_grid_km_within_error_bound(width, entry):
+    data = _data(4, n=2000, entry=entry)
+    exact = TableKaplanMeierFitter().fit(**data)
+    table = binned_event_table(data['durations'], data['event_observed'], width, entry=data.get('entry'))
+    approx = TableKaplanMeierFitter().fit_event_table(table)
+
+    times = np.union1d(exact.timeline, approx.timeline)
+    error = np.abs(exact.survival_function_at_times(times).values - approx.survival_function_at_times(times).values)
+    assert error.max() <= grid_error_bound(table, width) + 1e-12
+    # 作成済みのevent_tableをまとめ直しても同じ表になる
+    rebinned = bin_event_table(event_table(data['durations'], data['event_observed'], data.get('entry')), width)
+    pd.testing.assert_frame_equal(rebinned, table, check_dtype=False)
+
+
+def test_band_critical_value():
+    # 全範囲のHall-Wellnerの臨界値は sup|Brownian bridge| (Kolmogorov分布) の分位点
+    assert band_critical_value(0., 1.) == pytest.approx(stats.kstwobign.ppf(0.95), abs=0.03)
+    # 範囲を狭めると臨界値は小さくなり, equal precisionはHall-Wellnerより大きい
+    assert band_critical_value(0.1, 0.5) < band_critical_value(0.1, 0.9)
+    assert band_critical_value(0.1, 0.9, 'equal-precision') > band_critical_value(0.1, 0.9)
+    with pytest.raises(ValueError):
+        band_critical_value(0.1, 0.9, 'unknown')
+
+
+@pytest.mark.parametrize('kind', ['hall-wellner', 'equal-precision'])
+def test_band_coverage(kind):
+    # 指数分布のデータで, 真の生存関数が帯の中に全時点で入る割合が約95%
+    rng = np.random.default_rng(5)
+    covered = []
+    for _ in range(200):
+        t, c = rng.exponential(1., 200), rng.uniform(0., 3., 200)
+        kmf = TableKaplanMeierFitter().fit(np.minimum(t, c), t <= c).with_band(kind)
+        survival = kmf.survival_function_.values[:, 0]
+        use = (kmf.event_table['observed'].values > 0) & (survival > 0)
+        lower, upper = kmf.confidence_interval_.values[use].T
+        true = np.exp(-kmf.timeline[use])
+        covered.append(np.all((lower <= true) & (true <= upper)))
+    assert 0.9 <= np.mean(covered) <= 0.99
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from lifelines import KaplanMeierFitter
+from lifelines.fitters.npmle import npmle
+
+from turnbull import innermost_intervals, turnbull_fitter, turnbull_npmle, turnbull_median_table
+
+
+def _interval_data(seed, n=120, visits=15):
+    # 症例ごとに受診時点がばらばらな区間打ち切りデータ (最後の受診でもイベントがなければ右側打ち切り)
+    rng = np.random.default_rng(seed)
+    t = rng.exponential(10, n)
+    times = np.round(np.cumsum(rng.uniform(1, 4, (n, visits)), axis=1), 3)
+    k = (times < t[:, None]).sum(axis=1)
+    rows = np.arange(n)
+    lower = np.where(k > 0, times[rows, np.maximum(k - 1, 0)], 0.)
+    upper = np.where(k < visits, times[rows, np.minimum(k, visits - 1)], np.inf)
+    return lower, upper
+
+
+def test_npmle_matches_lifelines():
+    lower, upper = _interval_data(0)
+    result = turnbull_npmle(lower, upper)
+    p, intervals = npmle(lower, upper, tol=1e-10)
+
+    np.testing.assert_array_equal(result['left'], [i.left for i in intervals])
+    np.testing.assert_array_equal(result['right'], [i.right for i in intervals])
+    # 尤度は平らなので確率そのものではなく対数尤度で比べる
+    expected = np.log([p[(result['left'] >= a) & (result['right'] <= b)].sum() for a, b in zip(lower, upper)]).sum()
+    assert result['converged']
+    assert result['log_likelihood'] == pytest.approx(expected, abs=1e-4)
+
+
+def test_npmle_is_self_consistent():
+    # KKT条件: 各最小区間の勾配 Σ_i A_ij / (A p)_i / n は1以下で、確率が正の区間では1
+    lower, upper = _interval_data(1)
+    result = turnbull_npmle(lower, upper)
+    _, _, start, end = innermost_intervals(lower, upper)
+    j = np.arange(len(result['mass']))
+    contains = (start[:, None] <= j) & (j < end[:, None])
+    gradient = (contains / (contains @ result['mass'])[:, None]).sum(axis=0) / len(lower)
+
+    assert result['mass'].sum() == pytest.approx(1.)
+    assert gradient.max() < 1 + 1e-3
+    np.testing.assert_allclose(gradient[result['mass'] > 1e-4], 1., atol=1e-3)
+
+
+def test_right_censored_equals_kaplan_meier():
+    # イベント時点が正確 (lower == upper) で右側打ち切り (upper = inf) だけならKMと一致する
+    rng = np.random.default_rng(2)
+    durations = np.round(rng.exponential(10, 200), 1) + 0.1
+    events = rng.random(200) < 0.7
+    kmf = turnbull_fitter(durations, np.where(events, durations, np.inf))
+    expected = KaplanMeierFitter().fit(durations, events)
+
+    np.testing.assert_allclose(kmf.survival_function_at_times(expected.timeline).values,
+                               expected.survival_function_.values[:, 0], atol=1e-5)
+
+
+def test_median_table_counts_rows():
+    lower, upper = _interval_data(3)
+    weights = np.random.default_rng(3).uniform(0.5, 3, len(lower))
+    table = turnbull_median_table({'A': turnbull_fitter(lower, upper), 'B': turnbull_fitter(lower, upper, weights)})
+    # 重み付きでも症例数は行数
+    assert table['N'].tolist() == [len(lower), len(lower)]
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from utils import adjust_p_values
+
+
+P_VALUES = np.array([0.01, 0.04, 0.03, 0.005, np.nan, 0.5])
+
+
+@pytest.mark.parametrize('method, expected', [
+    # Rの p.adjust(c(0.01, 0.04, 0.03, 0.005, 0.5), method='holm' / 'BH') と同じ値
+    ('holm', [0.04, 0.09, 0.09, 0.025, np.nan, 0.5]),
+    ('bh', [0.025, 0.05, 0.05, 0.025, np.nan, 0.5]),
+])
+def test_adjust_p_values(method, expected):
+    np.testing.assert_allclose(adjust_p_values(P_VALUES, method), expected)
+
+
+@pytest.mark.parametrize('method, statsmodels_method', [('holm', 'holm'), ('bh', 'fdr_bh')])
+def test_adjust_p_values_matches_statsmodels(method, statsmodels_method):
+    multitest = pytest.importorskip('statsmodels.stats.multitest')
+    p = np.random.default_rng(0).uniform(0, 0.2, 30) ** 2
+    _, expected, _, _ = multitest.multipletests(p, method=statsmodels_method)
+    np.testing.assert_allclose(adjust_p_values(p, method), expected)
+
+
+def test_adjust_p_values_unknown_method():
+    with pytest.raises(ValueError):
+        adjust_p_values(P_VALUES, 'bonferroni')
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from validation import DROP, FIX, FIRST_ROW, clean_interval, clean_survival, summarize_report
+
+
+def _reasons(report, column):
+    return dict(zip(report.loc[report['列'] == column, '行'], report.loc[report['列'] == column, '理由']))
+
+
+def test_clean_survival_drops_and_fixes_rows():
+    df = pd.DataFrame({
+        'duration': [1.0, '2', 'abc', -1, 5, np.nan, 7],
+        'event': [1, 0, 1, 1, 2, 1, '1'],
+        'subgroup': ['A', ' A ', 'B', 'B', 'A', 'B', 'B'],
+    }, dtype=object)
+    clean, report = clean_survival(df, names={'duration': '期間'})
+
+    # 数値でない, 負, eventが0/1以外, 空欄の行だけ除かれる
+    assert clean['duration'].tolist() == [1., 2., 7.]
+    assert clean['event'].tolist() == [1, 0, 1]
+    assert clean['subgroup'].tolist() == ['A', 'A', 'B']
+    assert clean['duration'].dtype == float
+    assert set(report['処理']) == {DROP, FIX}
+    # 報告には元の列名とExcelの行番号を書く
+    assert _reasons(report, '期間') == {1 + FIRST_ROW: '文字列の数字を数値に変換', 2 + FIRST_ROW: '数値ではない',
+                                      3 + FIRST_ROW: '負または無限大', 5 + FIRST_ROW: '空欄'}
+    assert _reasons(report, 'event') == {4 + FIRST_ROW: '0, 1以外', 6 + FIRST_ROW: '文字列の数字を数値に変換'}
+    assert _reasons(report, 'subgroup') == {1 + FIRST_ROW: '前後の空白を削除'}
+
+
+def test_clean_survival_unifies_mixed_labels():
+    # 数値と文字列が混ざったsubgroupは 1, 1.0, '1' を同じ群にする
+    df = pd.DataFrame({'duration': [1, 2, 3, 4, 5], 'event': [1, 1, 0, 1, 0],
+                       'subgroup': [1, 1.0, '1', '2', np.nan]}, dtype=object)
+    clean, report = clean_survival(df)
+
+    assert clean['subgroup'].tolist() == ['1', '1', '1', '2', 'None']
+    fixes = report[report['列'] == 'subgroup']
+    assert set(fixes['処理']) == {FIX}
+    assert set(fixes['理由']) == {'数値のラベルを文字列に統一', '空欄のため None'}
+    assert summarize_report(report.assign(エンドポイント='OS'))['件数'].sum() == len(report)
+
+
+def test_clean_survival_entry_and_weight():
+    df = pd.DataFrame({'duration': [5., 5., 5., 5., 5.], 'event': [1, 0, 1, 1, 1],
+                       'entry': [1., np.nan, 6., -1., 2.], 'weight': [1., 2., 1., 1., -0.5]})
+    clean, report = clean_survival(df)
+
+    # entryの空欄は0, durationより後や負のentry, 負の重みは除外
+    assert clean['entry'].tolist() == [1., 0.]
+    assert clean['weight'].tolist() == [1., 2.]
+    assert _reasons(report, 'entry') == {2 + FIRST_ROW: 'durationより後', 3 + FIRST_ROW: '負または無限大'}
+    assert _reasons(report, 'weight') == {4 + FIRST_ROW: '負または無限大'}
+
+
+def test_clean_interval():
+    df = pd.DataFrame({'lower': [0., 2., np.nan, np.nan, 5., 3.],
+                       'upper': [1., np.nan, 4., np.nan, 4., 3.]})
+    clean, report = clean_interval(df)
+
+    # upperの空欄は右側打ち切り, lowerの空欄は0から, 両方空欄とlower > upperは除外
+    assert clean['lower'].tolist() == [0., 2., 0., 3.]
+    assert clean['upper'].tolist() == [1., np.inf, 4., 3.]
+    assert clean['subgroup'].tolist() == ['None'] * 4
+    assert _reasons(report, 'lower') == {3 + FIRST_ROW: 'lower, upperとも空欄', 4 + FIRST_ROW: 'upperより大きい'}
+
+
+def test_clean_data_has_empty_report():
+    df = pd.DataFrame({'duration': [1., 2.], 'event': [1, 0], 'subgroup': ['A', 'B']})
+    clean, report = clean_survival(df)
+
+    pd.testing.assert_frame_equal(clean, df)
+    assert len(report) == 0
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+from survival_engine import TableKaplanMeierFitter, event_table, _with_at_risk, ADDITIVE_COLUMNS
+
+
+# EMの収束判定 (確率の変化の最大値) と反復回数の上限
+TOLERANCE = 1e-7
+MAX_ITER = 5000
+
+
+#-----------------------------------
+# Turnbullの最小区間 (innermost intervals)
+def _endpoint_keys(lower, upper):
+    '''
+    区間 (lower, upper] の端点を並べたときの順位 (同じ値の端点は 閉じた左端 < 右端 < 開いた左端)
+    lower == upper の区間は観察時点がわかっているイベント [t, t]
+    '''
+    exact = lower == upper
+    values = np.concatenate([lower, upper])
+    rank = np.concatenate([np.where(exact, 0, 2), np.ones(len(upper), dtype=int)])
+    order = np.lexsort((rank, values))
+    # 同じ(値, 順位)の端点には同じkeyを付ける
+    new = np.r_[True, (values[order][1:] != values[order][:-1]) | (rank[order][1:] != rank[order][:-1])]
+    keys = np.empty(len(values), dtype=np.int64)
+    keys[order] = np.cumsum(new) - 1
+    is_right = np.r_[np.zeros(len(lower), dtype=bool), np.ones(len(upper), dtype=bool)]
+    return keys, is_right, order, values
+
+
+def innermost_intervals(lower, upper):
+    '''
+    Turnbullの最小区間と、各症例の区間に含まれる最小区間の範囲
+    最小区間は順に並んで重ならないので、症例ごとの包含関係 (clique行列) は連続した範囲 [start, end) で表せる
+    Returns:
+        (最小区間の左端, 右端, start, end)
+    '''
+    n = len(lower)
+    keys, is_right, order, values = _endpoint_keys(lower, upper)
+    sorted_right = is_right[order]
+    # 左端のすぐ次に右端が来るところが最小区間
+    pos = np.flatnonzero(~sorted_right[:-1] & sorted_right[1:])
+    left_key, right_key = keys[order][pos], keys[order][pos + 1]
+    left, right = values[order][pos], values[order][pos + 1]
+    start = np.searchsorted(left_key, keys[:n], side='left')
+    end = np.searchsorted(right_key, keys[n:], side='right')
+    return left, right, start, end
+
+
+#-----------------------------------
+# NPMLE (EM + SQUAREM)
+def _em_step(p, start, end, weights, total):
+    # 自己無撞着方程式の1ステップ: p_j <- p_j Σ_i w_i A_ij / (A p)_i / Σw
+    # A p と A^T r は clique行列の範囲表現なので累積和だけで求まる
+    cumulative = np.r_[0., np.cumsum(p)]
+    ratio = weights / np.maximum(cumulative[end] - cumulative[start], 1e-300)
+    m = len(p)
+    back = np.cumsum(np.bincount(start, ratio, m + 1) - np.bincount(end, ratio, m + 1))[:m]
+    return p * back / total
+
+
+def _log_likelihood(p, start, end, weights):
+    cumulative = np.r_[0., np.cumsum(p)]
+    return float((weights * np.log(np.maximum(cumulative[end] - cumulative[start], 1e-300))).sum())
+
+
+def turnbull_npmle(lower, upper, weights=None, tol=TOLERANCE, max_iter=MAX_ITER):
+    '''
+    区間打ち切りデータのノンパラメトリック最尤推定 (Turnbull)
+    EMを2回進めた結果から外挿するSQUAREM (Varadhan & Roland 2008) で加速する
+    Args:
+        lower, upper: 区間 (lower, upper]。右側打ち切りは upper = inf、イベント時点が正確なら lower = upper
+    Returns:
+        dict (left, right: 最小区間, mass: 各最小区間の確率, iterations, converged, log_likelihood)
+    '''
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    weights = np.ones(len(lower)) if weights is None else np.asarray(weights, dtype=float)
+    left, right, start, end = innermost_intervals(lower, upper)
+    total = weights.sum()
+    p = np.full(len(left), 1. / len(left))
+
+    def step(q):
+        return _em_step(q, start, end, weights, total)
+
+    converged = False
+    for iteration in range(1, max_iter + 1):
+        p1 = step(p)
+        p2 = step(p1)
+        r = p1 - p
+        v = p2 - p1 - r
+        v_norm = np.sqrt((v ** 2).sum())
+        if v_norm == 0:
+            p_new = p2
+        else:
+            # 外挿の長さ (-1以下なら少なくともEM2回分は進む)
+            alpha = min(-np.sqrt((r ** 2).sum()) / v_norm, -1.)
+            p_new = np.clip(p - 2 * alpha * r + alpha ** 2 * v, 0., None)
+            p_new = step(p_new / p_new.sum())
+            # 尤度が下がったときは外挿せずにEM2回の結果を使う
+            if _log_likelihood(p_new, start, end, weights) < _log_likelihood(p2, start, end, weights):
+                p_new = p2
+        change = np.abs(p_new - p).max()
+        p = p_new
+        if change < tol:
+            converged = True
+            break
+    return {'left': left, 'right': right, 'mass': p, 'iterations': iteration, 'converged': converged,
+            'log_likelihood': _log_likelihood(p, start, end, weights)}
+
+
+#-----------------------------------
+# draw_kmで描けるfitterにする
+def turnbull_fitter(lower, upper, weights=None, label=None):
+    '''
+    Turnbull推定量をTableKaplanMeierFitterの形にする (draw_km, 解析ファイル, パネル表示でそのまま使える)
+    生存率は各最小区間の右端で下がる階段とし、信頼区間は求めない
+    event_tableは「lowerの時点までイベントがないとわかっている人数」をat_riskとし、
+    右側打ち切り(upper = inf)の症例をlowerの時点の打ち切りとして記録する
+    '''
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    result = turnbull_npmle(lower, upper, weights)
+    table = event_table(lower, np.isfinite(upper), weights=weights)
+    steps = result['right'][np.isfinite(result['right'])]
+    index = np.union1d(np.union1d(table.index.values.astype(float), steps), [0.])
+    columns = [c for c in ADDITIVE_COLUMNS if c in table.columns]
+    table = _with_at_risk(table[columns].reindex(pd.Index(index, name='event_at'), fill_value=0))
+
+    mass_at = np.searchsorted(index, result['right'][np.isfinite(result['right'])])
+    drop = np.bincount(mass_at, result['mass'][np.isfinite(result['right'])], minlength=len(index))
+    survival = np.clip(1. - np.cumsum(drop), 0., 1.)
+    kmf = TableKaplanMeierFitter().restore(table, survival, np.zeros(len(index)), survival, survival, label=label)
+    kmf.npmle = result
+    return kmf
+
+
+def turnbull_median_table(fitters):
+    '''
+    群ごとの生存期間中央値, 症例数, 反復回数 (信頼区間はブートストラップが必要なので出さない)
+    '''
+    rows = []
+    for group, kmf in fitters.items():
+        # 重み付きのときも症例数は重みの合計ではなく実人数
+        removed = kmf.event_table['removed_raw' if kmf.weighted else 'removed']
+        rows.append({'subgroup': group, 'median survival time': kmf.median_survival_time_,
+                     'N': removed.sum(), '最小区間の数': len(kmf.npmle['mass']),
+                     '反復回数': kmf.npmle['iterations'], '収束': kmf.npmle['converged']})
+    return pd.DataFrame(rows)
@@ -3,8 +3,6 @@ import pandas as pd
 from lifelines import KaplanMeierFitter, CoxPHFitter
 from lifelines.plotting import add_at_risk_counts
 # custom_lifelinesで数字を中央揃えにしようとすると, 群の名前の表示位置がずれる
-from lifelines.statistics import logrank_test
-from lifelines.utils import median_survival_times
 from itertools import combinations
 import matplotlib.pyplot as plt
 import japanize_matplotlib
@@ -12,6 +10,29 @@ import streamlit as st
 import sys
 from io import BytesIO
 import base64
+import json
+from survival_engine import TableKaplanMeierFitter, event_table, merge_event_tables, logrank_test_tables, \
+    binned_event_table, bin_event_table, grid_error_bound
+from event_summary import dump_summary
+from curve_artifact import dump_artifact
+from disk_cache import memoize
+from streaming import stream_event_tables
+from endpoints import read_endpoints
+from subgroup_forest import subgroup_hazard_ratios
+from km_panels import draw_km_panels
+from interactive_chart import curve_payload, chart_html
+import streamlit.components.v1 as components
+from cox_engine import EfronCoxFitter, proportional_hazard_test
+from custom_lifelines_plotting import loglogs_plot, plot_estimates, plot_lifetimes
+from matplotlib.lines import Line2D
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from landmark import landmark_analysis, parse_landmarks
+from parametric_engine import DISTRIBUTIONS, fit_parametric_models, parametric_ranking, choose_models
+from hazard import hazard_bins, smooth_hazard, select_bandwidth
+from turnbull import turnbull_fitter, turnbull_median_table
+from power_sim import km_model, parametric_model, simulate_power, required_sample_size
 
 
 # スタイル
@@ -32,6 +53,98 @@ def generate_grayscale(x, white_value=0.8): #一番薄い色を変更すると
     result = [str(val) for val in result]  # 四捨五入した後に文字列に変換
     return result
 
+# ----------------------------------------
+# KMのfit
+def _event_observed(df, event_flag=1):
+    event_observed = df.event.values
+    if event_flag == 0:
+        event_observed = 1 - event_observed
+    return event_observed
+
+
+def _entry(df):
+    # entry列(遅延登録)は任意
+    if 'entry' in df.columns:
+        return df.entry.values
+    return None
+
+
+def _weights(df):
+    # weight列(IPTWなど)は任意
+    if 'weight' in df.columns:
+        return df.weight.values
+    return None
+
+
+def group_event_tables(df, event_flag=1, width=None):
+    '''
+    群ごとのevent_tableを返す
+    Args:
+        df: 行データのDataFrame、または {群名: event_table} のdict
+            (ストリーミング集計や施設ごとの集計から作ったもの。event_flagは集計時に反映済み)
+        width: 指定すると幅widthの時間グリッドにまとめた近似の表にする
+    '''
+    if isinstance(df, dict):
+        if width is None:
+            return df
+        return {group: bin_event_table(table, width) for group, table in df.items()}
+    tables = {}
+    for group in df.subgroup.unique():
+        df_ = df[df.subgroup==group]
+        if width is None:
+            tables[group] = event_table(df_.duration.values, _event_observed(df_, event_flag),
+                                        entry=_entry(df_), weights=_weights(df_))
+        else:
+            tables[group] = binned_event_table(df_.duration.values, _event_observed(df_, event_flag), width,
+                                               entry=_entry(df_), weights=_weights(df_))
+    return tables
+
+
+def turnbull_fitters(df, by_subgroup=True):
+    '''
+    区間打ち切りデータ(lower, upper)の群ごとのTurnbull推定量
+    全体集団はevent_tableを併合してKMにできないので、全症例で1つのNPMLEを求める
+    Returns:
+        {群名: TableKaplanMeierFitter} (draw_km, km_panelsにそのまま渡せる)
+    '''
+    if not by_subgroup:
+        return {'全体集団': turnbull_fitter(df.lower.values, df.upper.values, weights=_weights(df), label='全体集団')}
+    fitters = {}
+    for group in df.subgroup.unique():
+        df_ = df[df.subgroup==group]
+        fitters[group] = turnbull_fitter(df_.lower.values, df_.upper.values, weights=_weights(df_), label=group)
+    return fitters
+
+
+def grid_error(tables, width):
+    # 近似KMの誤差の上限 (全群での最大値)
+    return max(grid_error_bound(table, width) for table in tables.values())
+
+
+def fit_km_table(table, label=None):
+    # 保存した解析ファイル(curve_artifact)から読んだ曲線はfit済みなのでそのまま使う
+    if isinstance(table, TableKaplanMeierFitter):
+        return table
+    return TableKaplanMeierFitter().fit_event_table(table, label=label)
+
+
+def fit_pooled_km(tables):
+    # 全体集団のKM (1群だけのときは併合しない)
+    if len(tables) == 1:
+        return fit_km_table(next(iter(tables.values())))
+    return fit_km_table(merge_event_tables([getattr(t, 'event_table', t) for t in tables.values()]))
+
+
+def _at_risk_fitters(kmfs):
+    # 重み付きのときはN at riskを実人数(raw)と有効サンプルサイズ(eff.)の2行で表示
+    if not kmfs[0].weighted:
+        return kmfs
+    views = []
+    for kmf in kmfs:
+        views.extend([kmf.at_risk_view('raw'), kmf.at_risk_view('effective')])
+    return views
+
+
 # ----------------------------------------
 # カプランマイヤー曲線表示関数
 
@@ -40,132 +153,81 @@ def draw_km(df:pd.DataFrame, color:str or list='gray',
             linestyle_choice=False, style_choice_list=None, size=(8, 4), by_subgroup:bool=True, 
             title:str='Kaplan Meier Curve', xlabel:str='生存日数', ylabel='生存率', 
             censor:bool=True, ci:bool=False, at_risk:bool=True, event_flag=1,
-            fontsize=10, fontname='Arial'):
+            fontsize=10, fontname='Arial', parametric=None, extrapolate=1.0, ci_band=None):
     
     '''
     カプランマイヤー曲線描画関数
+    全群の曲線, 打ち切り, 信頼区間はそれぞれ1つのCollectionにまとめて描く (群が増えてもartistの数は同じ)
     Args:
         df: データ元のデータフレーム
+        parametric: {群名: ParametricFit} 重ねて描くパラメトリックモデル (全体集団のときは1つだけ)
+        extrapolate: パラメトリックモデルを描く範囲 (最長の追跡期間の何倍まで外挿するか)
+        ci_band: 'hall-wellner' か 'equal-precision' を指定すると、信頼区間を同時信頼帯にする
     '''
     
-    subgroup = df.subgroup.unique()
+    tables = group_event_tables(df, event_flag=event_flag)
+    subgroup = list(tables)
     
     fig, ax = plt.subplots(figsize=size, dpi=300)
     plt.suptitle(title)
     ylim = (0, 1.05)
     
-    kmfs = [] # at_riskを正しく表示するため、fitしたインスタンスをリストに格納する
-    if linestyle_choice:
-        if (len(subgroup) > 1) and by_subgroup: 
-            for i, group in enumerate(subgroup):
-                df_ = df[df.subgroup==group]
-                kmf = KaplanMeierFitter()
-                event_observed = df_.event.values
-                if event_flag == 0:
-                    event_observed = 1 - event_observed
-                kmf.fit(durations=df_.duration, event_observed=event_observed, label=group)
-                kmf.plot(show_censors=censor, ci_show=ci, 
-                        color=color[i], linestyle=style_choice_list[i],
-                        censor_styles={"marker": "|", "ms": 6, "mew": 0.75})
-                kmfs.append(kmf)
-            
-            plt.xlabel(xlabel)
-            plt.ylabel(ylabel)
-            plt.ylim(ylim)
-            if at_risk:
-                add_at_risk_counts(*kmfs, rows_to_show=['At risk'], fontsize=fontsize, fontname=fontname)  # * でリストの中身を展開
-
-            fig.tight_layout()            
-            return fig
-                    
-        
+    # at_riskを正しく表示するため、fitしたインスタンスをリストに格納する
+    if (len(subgroup) > 1) and by_subgroup: 
+        kmfs = [fit_km_table(tables[group], label=group) for group in subgroup]
+        labels = subgroup
+        if linestyle_choice:
+            colors = [color[i % len(color)] for i in range(len(kmfs))]
+            linestyles = [style_choice_list[i % len(style_choice_list)] for i in range(len(kmfs))]
+        elif color == 'gray':
+            colors = ['gray'] * len(kmfs)
+            linestyles = [style_list[i % len(style_list)] for i in range(len(kmfs))]
         else:
-            kmf = KaplanMeierFitter()
-            event_observed = df.event.values
-            if event_flag == 0:
-                event_observed = 1 - event_observed
-            kmf.fit(durations=df.duration, event_observed=event_observed)
-            kmf.plot(show_censors=censor, ci_show=ci, color=color[0], linestyle=style_choice_list[0],
-                    label='_nolegend_', censor_styles={"marker": "|", "ms": 6, "mew": 0.75})
-        
-            plt.gca.legend_ = None
-            plt.xlabel(xlabel)
-            plt.ylabel(ylabel)  
-            plt.ylim(ylim)
-            if at_risk:
-                add_at_risk_counts(kmf, rows_to_show=['At risk'], fontsize=fontsize, fontname=fontname)
-    
-            fig.tight_layout()
-            return fig
-        
-    
+            colors, linestyles = [color[i % len(color)] for i in range(len(kmfs))], None
     else:
-        if (len(subgroup) > 1) and by_subgroup: 
-            for i, group in enumerate(subgroup):
-                df_ = df[df.subgroup==group]
-                kmf = KaplanMeierFitter()
-                event_observed = df_.event.values
-                if event_flag == 0:
-                    event_observed = 1 - event_observed
-                kmf.fit(durations=df_.duration, event_observed=event_observed, label=group)
-                if color == 'gray':  
-                    kmf.plot(show_censors=censor, ci_show=ci, color=color, 
-                            linestyle=style_list[i], censor_styles={"marker": "|", "ms": 6, "mew": 0.75}) # matplotlibのマーカーと同じ。ms:長さ、mew:太さ
-                else:
-                    kmf.plot(show_censors=censor, ci_show=ci, 
-                            color=color[i], censor_styles={"marker": "|", "ms": 6, "mew": 0.75})
-                kmfs.append(kmf)
-            
-            plt.xlabel(xlabel)
-            plt.ylabel(ylabel)
-            plt.ylim(ylim)
-            if at_risk:
-                add_at_risk_counts(*kmfs, rows_to_show=['At risk'], fontsize=fontsize, fontname=fontname)  # * でリストの中身を展開
-
-            fig.tight_layout()            
-            return fig
-                    
-        
-        else:
-            kmf = KaplanMeierFitter()
-            event_observed = df.event.values
-            if event_flag == 0:
-                event_observed = 1 - event_observed
-            kmf.fit(durations=df.duration, event_observed=event_observed)
-            if color == 'gray': 
-                kmf.plot(show_censors=censor, ci_show=ci, color=color, 
-                        label='_nolegend_', censor_styles={"marker": "|", "ms": 6, "mew": 0.75})
-            else:
-                kmf.plot(show_censors=censor, ci_show=ci, color=color[0], 
-                        label='_nolegend_', censor_styles={"marker": "|", "ms": 6, "mew": 0.75})
-            
-            plt.gca.legend_ = None
-            plt.xlabel(xlabel)
-            plt.ylabel(ylabel)  
-            plt.ylim(ylim)
-            if at_risk:
-                add_at_risk_counts(kmf, rows_to_show=['At risk'], fontsize=fontsize, fontname=fontname)
-    
-            fig.tight_layout()
-            return fig
+        kmfs = [fit_pooled_km(tables)]
+        labels = ['_nolegend_']
+        colors = ['gray'] if color == 'gray' else [color[0]]
+        linestyles = [style_choice_list[0]] if linestyle_choice else None
+
+    if ci and ci_band:
+        kmfs = [kmf.with_band(ci_band) for kmf in kmfs]
+    handles = plot_estimates(kmfs, colors=colors, linestyles=linestyles, labels=labels, ax=ax,
+                             show_censors=censor, ci_show=ci,
+                             censor_styles={"marker": "|", "ms": 6, "mew": 0.75}) # matplotlibのマーカーと同じ。ms:長さ、mew:太さ
+    if parametric:
+        # パラメトリックモデルは同じ色の点線で、追跡期間の外まで外挿して描く
+        fits = [parametric[g] for g in labels] if labels[0] != '_nolegend_' else [next(iter(parametric.values()))]
+        horizon = max(kmf.timeline[-1] for kmf in kmfs) * extrapolate
+        t = np.linspace(0, horizon, 200)
+        ax.add_collection(LineCollection([np.column_stack([t, fit.survival(t)]) for fit in fits],
+                                         colors=[('black' if c == 'gray' else c) for c in colors],
+                                         linestyles='dotted', linewidths=1.2))
+        ax.set_xlim(0, horizon * 1.02)
+        handles.append(Line2D([], [], color='black', linestyle='dotted',
+                              label='、'.join(sorted({fit.label for fit in fits})) + 'モデル'))
+    if handles:
+        ax.legend(handles=handles, loc='best')
+
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.ylim(ylim)
+    if at_risk:
+        add_at_risk_counts(*_at_risk_fitters(kmfs), rows_to_show=['At risk'], fontsize=fontsize, fontname=fontname)  # * でリストの中身を展開
+
+    fig.tight_layout()            
+    return fig
 
 
 #-----------------------------------
 # 生存期間中央値、ci
 def median_duration(df, event_flag=1):
-    subgroup = list(set(df.subgroup))
+    tables = group_event_tables(df, event_flag=event_flag)
     names, medians, cis_low, cis_high = [], [], [], []
-    for group in subgroup:
-        df_ = df[df.subgroup == group]
-        event_observed = df_.event.values
-        if event_flag == 0:
-            event_observed = 1 - event_observed
-        kmf = KaplanMeierFitter()
-        kmf.fit(durations=df_.duration, event_observed=event_observed)
+    for group in tables:
+        kmf = fit_km_table(tables[group])
         mst = kmf.median_survival_time_
-        median_ci = median_survival_times(kmf.confidence_interval_)
-        ci_low = median_ci.iloc[0, 0]
-        ci_high = median_ci.iloc[0, 1]
+        ci_low, ci_high = kmf.median_confidence_interval_
         
         names.append(group)
         medians.append(mst)
@@ -180,33 +242,102 @@ def median_duration(df, event_flag=1):
     })
     return df_survival
 
+#-----------------------------------
+# 群の組み合わせと多重比較
+# 組み合わせが多いときに1ページに表示する行数
+PAGE_SIZE = 20
+
+
+def subgroup_pairs(subgroup, reference=None):
+    '''
+    比較する群の組み合わせ [(参照群, 対象群), ...]
+    referenceを指定すると参照群と他の群の比較だけにする (全組み合わせより少ない)
+    '''
+    subgroup = list(subgroup)
+    if reference is None:
+        return list(combinations(subgroup, 2))
+    return [(reference, group) for group in subgroup if group != reference]
+
+
+def adjust_p_values(p, method='holm'):
+    '''
+    多重比較の補正 (Holm, Benjamini-Hochberg)。NaNは補正の対象から除く
+    '''
+    p = np.asarray(p, dtype=float)
+    adjusted = np.full(p.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p))
+    m = len(valid)
+    if m == 0:
+        return adjusted
+    order = valid[np.argsort(p[valid], kind='mergesort')]
+    rank = np.arange(1, m + 1)
+    if method == 'holm':
+        values = np.maximum.accumulate((m - rank + 1) * p[order])
+    elif method == 'bh':
+        values = np.minimum.accumulate((m / rank * p[order])[::-1])[::-1]
+    else:
+        raise ValueError(f'対応していない補正方法です: {method}')
+    adjusted[order] = np.minimum(values, 1.)
+    return adjusted
+
+
+def pairwise_options(subgroup, key='pairwise'):
+    '''
+    組み合わせ, 多重比較の補正, 並べ順の入力欄
+    Returns:
+        pairs, adjust ('holm', 'bh', None), sort_by_p
+    '''
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        compare = st.selectbox('比較', ('全ての組み合わせ', '参照群との比較'), key=f'{key}_compare')
+    with col2:
+        reference = st.selectbox('参照群', subgroup, key=f'{key}_reference',
+                                 disabled=compare == '全ての組み合わせ')
+    with col3:
+        adjust_ = st.selectbox('多重比較の補正', ('なし', 'Holm', 'BH'), key=f'{key}_adjust')
+    pairs = subgroup_pairs(subgroup, reference if compare == '参照群との比較' else None)
+    sort_by_p = st.checkbox('p値の小さい順に表示', key=f'{key}_sort') if len(pairs) > 1 else False
+    adjust = {'なし': None, 'Holm': 'holm', 'BH': 'bh'}[adjust_]
+    return pairs, adjust, sort_by_p
+
+
+def page_slice(n_rows, key='pairwise'):
+    # PAGE_SIZE行を超えるときだけページ送りを表示する
+    if n_rows <= PAGE_SIZE:
+        return slice(0, n_rows)
+    n_pages = -(-n_rows // PAGE_SIZE)
+    page = st.number_input(f'ページ (全{n_pages}ページ, {n_rows}組)', min_value=1, max_value=n_pages,
+                           value=1, key=f'{key}_page')
+    return slice((page - 1) * PAGE_SIZE, page * PAGE_SIZE)
+
+
 #-----------------------------------
 # Logrank検定
-def logrank_p_table(df, event_flag=1):
-    subgroup = list(set(df.subgroup))
-    subgroup_combi = list(combinations(subgroup, 2))
+def logrank_p_table(df, event_flag=1, pairs=None, adjust=None):
+    '''
+    Args:
+        pairs: 比較する組み合わせ (Noneなら全ての組み合わせ)
+        adjust: 'holm' か 'bh' を指定すると補正したp値の列を追加する
+    '''
+    # 群ごとのevent_tableは1回だけ作り、全ての組み合わせで使い回す
+    tables = group_event_tables(df, event_flag=event_flag)
+    subgroup_combi = list(combinations(tables, 2)) if pairs is None else pairs
 
     logrank_ps = []
     wilcoxon_ps = []
     names = []
     for combi in subgroup_combi:
-        c1 = df[df['subgroup']==combi[0]]
-        c2 = df[df['subgroup']==combi[1]]
-        
-        event_observed_c1 = c1.event.values
-        event_observed_c2 = c2.event.values
-        if event_flag == 0:
-            event_observed_c1 = 1 - event_observed_c1
-            event_observed_c2 = 1 - event_observed_c2
-        logrank = logrank_test(c1.duration, c2.duration, event_observed_c1, event_observed_c2)
-        wilcoxon = logrank_test(c1.duration, c2.duration, event_observed_c1, event_observed_c2, 
-                                weightings='wilcoxon')
-        logrank_p = logrank.p_value
-        wilcoxon_p = wilcoxon.p_value
+        c1 = tables[combi[0]]
+        c2 = tables[combi[1]]
+        _, logrank_p = logrank_test_tables(c1, c2)
+        _, wilcoxon_p = logrank_test_tables(c1, c2, weightings='wilcoxon')
         logrank_ps.append(logrank_p)
         wilcoxon_ps.append(wilcoxon_p)
         names.append(combi[0]+'/'+combi[1])
     p_df = pd.DataFrame({'subgroup':names, 'logrank-p':logrank_ps, 'wilcoxon-p':wilcoxon_ps})
+    if adjust is not None:
+        p_df[f'logrank-p({adjust})'] = adjust_p_values(p_df['logrank-p'].values, adjust)
+        p_df[f'wilcoxon-p({adjust})'] = adjust_p_values(p_df['wilcoxon-p'].values, adjust)
     return p_df
 
 # p<0.05のとき色付け
@@ -216,38 +347,108 @@ def heighlight_value(val):
     else:
         return ''
 
+
+def endpoint_summary(df, event_flag=1, width=None):
+    '''
+    1つのエンドポイントのevent_table, 生存期間, Logrank検定 (複数のエンドポイントを並列に計算する単位)
+    区間打ち切りデータのエンドポイントはTurnbull推定量と生存期間だけ (検定は行わない)
+    '''
+    if 'lower' in df.columns:
+        tables = turnbull_fitters(df)
+        return {'tables': tables, 'median': turnbull_median_table(tables)}
+    tables = group_event_tables(df, event_flag=event_flag, width=width)
+    result = {'tables': tables, 'median': median_duration(tables)}
+    if len(tables) >= 2:
+        result['logrank'] = logrank_p_table(tables)
+    return result
+
+def show_p_table(area, p_df, rows=None):
+    '''
+    p値の表を表示する。組み合わせが多いときは表示するページの行だけを色付けして、スクロールできる表にする
+    Args:
+        area: st.empty()などの表示先
+        rows: 表示する行のslice (page_slice)
+    '''
+    p_columns = [c for c in p_df.columns if c.startswith(('logrank-p', 'wilcoxon-p'))]
+    page = p_df if rows is None else p_df.iloc[rows]
+    styled = page.style.applymap(heighlight_value, subset=p_columns)
+    if len(p_df) > PAGE_SIZE:
+        area.dataframe(styled, use_container_width=True)
+    else:
+        area.table(styled)
+
 #-----------------------------------
 # ハザード比
 
-def hazard_table(df, inverse=False, event_flag=1):
+# 解析用に予約している列 (これ以外が共変量の候補)
+RESERVED_COLUMNS = ['duration', 'event', 'subgroup', 'entry', 'weight', 'lower', 'upper']
+
+
+def covariate_design(df, covariates):
+    '''
+    共変量列をCox用の数値行列にする (文字列の列はダミー変数化、先頭カテゴリが参照)
+    '''
+    if not covariates:
+        return pd.DataFrame(index=df.index)
+    design = pd.get_dummies(df[list(covariates)], drop_first=True, dtype=float)
+    return design.astype(float)
+
+
+def hazard_table(df, inverse=False, event_flag=1, covariates=None, strata=None, return_models=False, pairs=None):
+    '''
+    群間のハザード比
+    Args:
+        pairs: fitする組み合わせ [(参照群, 対象群), ...] (Noneなら全ての組み合わせ)
+        covariates: 調整に使う列名のリスト (調整HR)
+        strata: 層別化に使う列名
+        return_models: Trueなら (表, [(組み合わせ名, fit済みモデル)]) を返す (比例ハザード性の検定で再利用)
+    '''
     subgroup = list(set(df.subgroup))
-    subgroup_combi = list(combinations(subgroup, 2))
+    subgroup_combi = list(combinations(subgroup, 2)) if pairs is None else pairs
+    covariates = list(covariates or [])
+    # 共変量・層が欠測の行は除く (complete case)
+    df = df.dropna(subset=covariates + ([strata] if strata else []))
     
     names = []
     hrs = []
     cis_low = []
     cis_high = []
+    models = []
     
     for combi in subgroup_combi:
-        df_forcox = df[df['subgroup'].apply(lambda x: x in combi)]
-        df_forcox['sub_label'] = df_forcox['subgroup'].apply(lambda x: combi.index(x) if x in combi else -1)
-        df_forcox['event_0'] = df_forcox['event'].apply(lambda x: 1-x)
-    
+        df_ = df[df['subgroup'].isin(combi)]
+        # Coxに渡す列は明示的に選ぶ (他の列が共変量として紛れ込まないように)
+        df_forcox = pd.DataFrame({
+            'duration': df_['duration'].values,
+            'event': _event_observed(df_, event_flag),
+            'sub_label': (df_['subgroup'] == combi[1]).astype(int).values,
+        })
+        design = covariate_design(df_, covariates)
+        for col in design.columns:
+            df_forcox[col] = design[col].values
+        entry = _entry(df_)
+        if entry is not None:
+            df_forcox['entry'] = entry
+        weights = _weights(df_)
+        if weights is not None:
+            df_forcox['weight'] = weights
+        if strata:
+            df_forcox['strata'] = df_[strata].astype(str).values
         
-        cph = CoxPHFitter()
-        df_forcox = df_forcox.drop('subgroup', axis=1)
-        if event_flag == 1:
-            df_forcox = df_forcox.drop('event_0', axis=1)
-            cph = cph.fit(df_forcox, 'duration', 'event')
-            
-        elif event_flag == 0:
-            df_forcox = df_forcox.drop('event', axis=1)
-            cph = cph.fit(df_forcox, 'duration', 'event_0')
-    
-        hr = cph.hazard_ratios_.item()
-        
-        ci_low = np.exp(cph.confidence_intervals_.iloc[0,0])
-        ci_high = np.exp(cph.confidence_intervals_.iloc[0,1])
+        # 重み付きのときはrobust(sandwich)分散を使う
+        # fitできない組み合わせ (イベントがない, 情報行列が特異など) はその行だけNaNにする
+        cph = EfronCoxFitter()
+        try:
+            cph = cph.fit(df_forcox, 'duration', 'event',
+                          entry_col='entry' if entry is not None else None,
+                          weights_col='weight' if weights is not None else None,
+                          strata=['strata'] if strata else None,
+                          robust=weights is not None)
+            hr = cph.hazard_ratios_['sub_label']
+            ci_low = np.exp(cph.confidence_intervals_.loc['sub_label'].iloc[0])
+            ci_high = np.exp(cph.confidence_intervals_.loc['sub_label'].iloc[1])
+        except (np.linalg.LinAlgError, ValueError, ZeroDivisionError):
+            cph, hr, ci_low, ci_high = None, np.nan, np.nan, np.nan
         name = combi[1]+'/'+combi[0]
         
         if inverse:
@@ -262,80 +463,586 @@ def hazard_table(df, inverse=False, event_flag=1):
         hrs.append(hr)
         cis_low.append(ci_low)
         cis_high.append(ci_high)
+        if cph is not None:
+            models.append((name, cph))
     df_cox = pd.DataFrame({'subgroup':names, 
                            'HR':hrs, 
                             '95% CI(lower)':cis_low,
                             '95% CI(upper)':cis_high})
+    if return_models:
+        return df_cox, models
     return df_cox
 
+#-----------------------------------
+# 比例ハザード性の確認
+
+def ph_test_table(models):
+    '''
+    hazard_tableでfitしたモデルを使ったscaled Schoenfeld残差の検定表
+    Args:
+        models: hazard_table(..., return_models=True) の2つ目の戻り値
+    '''
+    tables = []
+    for name, cph in models:
+        table = proportional_hazard_test(cph)
+        table = table.rename(index={'sub_label': 'subgroup'})
+        table.insert(0, 'term', table.index)
+        table.insert(0, 'subgroup', name)
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=['subgroup', 'term', 'chi2', 'df', 'p'])
+    ph_df = pd.concat(tables, ignore_index=True)
+    return ph_df.rename(columns={'test_statistic': 'chi2'})
+
+
+def hazard_ph_tables(df, **kwargs):
+    '''
+    ハザード比の表と比例ハザード性の検定表 (同じfitを使うので、ワーカーでまとめて計算する)
+    Returns:
+        (hazard_tableの表, ph_test_tableの表)
+    '''
+    cox_df, models = hazard_table(df, return_models=True, **kwargs)
+    return cox_df, ph_test_table(models)
+
+
+def draw_loglogs(df, color='gray', size=(8, 4), event_flag=1, xlabel='log(期間)', ylabel='log(-log(生存率))'):
+    '''
+    全群の log(-log S(t)) vs log(t) プロット (線が平行なら比例ハザード性が成り立つ目安)
+    pyplotを使わずにFigureを作るので、ワーカーのスレッドから呼べる
+    '''
+    tables = group_event_tables(df, event_flag=event_flag)
+    fig = Figure(figsize=size, dpi=300)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    for i, group in enumerate(tables):
+        kmf = fit_km_table(tables[group], label=group)
+        # log(0)とS=1, S=0の点は描けないので、0 < S < 1 の範囲だけ描く
+        survival = kmf.survival_function_.iloc[:, 0]
+        valid = survival.index[(survival.index > 0) & (survival > 0) & (survival < 1)]
+        if len(valid) == 0:
+            continue
+        if color == 'gray':
+            style = {'color': color, 'linestyle': style_list[i % len(style_list)]}
+        else:
+            style = {'color': color[i % len(color)]}
+        loglogs_plot(kmf, loc=slice(valid.min(), valid.max()), ax=ax, label=group, **style)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    return fig
+
+#-----------------------------------
+# パラメトリックモデル
+
+def parametric_tables(tables, by_subgroup=True):
+    # KM曲線と同じ単位でfitする (全体集団のときは併合したevent_table)
+    if by_subgroup and len(tables) > 1:
+        return tables
+    return {'全体': fit_pooled_km(tables).event_table}
+
+
+def draw_parametric_diagnostics(tables, models, color='gray', size=(8, 4)):
+    '''
+    パラメトリックモデルの当てはまりの確認 (左: QQプロット, 右: 累積分布)
+    custom_lifelines_plotting.qq_plot, cdf_plotと同じ図を、行データではなくevent_tableのKMから描く
+    Args:
+        tables: {群名: event_table}
+        models: {群名: ParametricFit}
+    '''
+    fig, (ax_qq, ax_cdf) = plt.subplots(1, 2, figsize=size, dpi=300)
+    lim = 0
+    for i, group in enumerate(models):
+        kmf = fit_km_table(tables[group], label=group)
+        fit = models[group]
+        c = 'black' if color == 'gray' else color[i % len(color)]
+        timeline = kmf.timeline
+        survival = kmf.survival_function_.values[:, 0]
+        # KMの各段の時点を経験分位点とし、同じ累積確率でのモデルの分位点と並べる
+        step = (np.diff(np.r_[1., survival]) < 0) & (survival > 0)
+        empirical = timeline[step]
+        theoretical = fit.ppf(1 - survival[step])
+        ax_qq.scatter(theoretical, empirical, s=6, color=c, label=f'{group} ({fit.label})')
+        lim = max(lim, np.nanmax(np.r_[empirical, theoretical, 0]))
+        t = np.linspace(0, timeline[-1], 200)
+        ax_cdf.step(timeline, 1 - survival, where='post', color=c, linewidth=1, label=f'{group} (KM)')
+        ax_cdf.plot(t, fit.cdf(t), color=c, linestyle='dotted', linewidth=1.2, label=f'{group} ({fit.label})')
+    ax_qq.plot([0, lim], [0, lim], color='0.6', linewidth=0.8, linestyle='--')
+    ax_qq.set_xlabel('モデルの分位点')
+    ax_qq.set_ylabel('KMの分位点')
+    ax_qq.set_title('QQプロット', fontsize=10)
+    ax_cdf.set_xlabel('期間')
+    ax_cdf.set_ylabel('累積イベント率')
+    ax_cdf.set_title('累積分布', fontsize=10)
+    ax_qq.legend(fontsize=7)
+    ax_cdf.legend(fontsize=7)
+    fig.tight_layout()
+    return fig
+
+#-----------------------------------
+# ハザード関数(カーネル平滑化)
+
+def draw_hazard(bins, bandwidth=None, color='gray', size=(8, 4), ci=False, title='', xlabel='期間',
+                ylabel='ハザード'):
+    '''
+    群ごとのNelson-Aalen推定量の増分をEpanechnikovカーネルで平滑化したハザード関数
+    Args:
+        bins: hazard_binsの結果 {群名: ビニングした増分}
+        bandwidth: バンド幅 (Noneなら群ごとにクロスバリデーションで選ぶ)
+    Returns:
+        Figureと群ごとに使ったバンド幅
+    '''
+    fig, ax = plt.subplots(figsize=size, dpi=300)
+    used = {}
+    for i, (group, binned) in enumerate(bins.items()):
+        if binned['n_events'] == 0:
+            continue
+        used[group] = select_bandwidth(binned) if bandwidth is None else bandwidth
+        t, hazard, lower, upper = smooth_hazard(binned, used[group])
+        if color == 'gray':
+            style = {'color': 'black', 'linestyle': style_list[i % len(style_list)]}
+        else:
+            style = {'color': color[i % len(color)]}
+        ax.plot(t, hazard, label=group, linewidth=1.2, **style)
+        if ci:
+            ax.fill_between(t, lower, upper, color=style['color'], alpha=0.15, linewidth=0)
+    ax.set_xlim(left=0)
+    ax.set_ylim(bottom=0)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if len(used) > 1:
+        ax.legend(loc='best')
+    fig.tight_layout()
+    return fig, used
+
+#-----------------------------------
+# 検出力のシミュレーション
+
+def draw_power_curve(power_df, target=0.8, size=(6, 4)):
+    '''
+    症例数ごとの検出力 (帯はシミュレーションの95%CI)
+    '''
+    fig, ax = plt.subplots(figsize=size, dpi=300)
+    n = power_df['症例数'].values
+    ax.fill_between(n, power_df['95% CI(lower)'], power_df['95% CI(upper)'], color='0.85', linewidth=0)
+    ax.plot(n, power_df['検出力'], color='black', marker='o', markersize=3, linewidth=1)
+    ax.axhline(target, color='0.5', linestyle='--', linewidth=0.8)
+    ax.set_ylim(0, 1.02)
+    ax.set_xlabel('症例数(2群の合計)')
+    ax.set_ylabel('検出力')
+    fig.tight_layout()
+    return fig
+
+#-----------------------------------
+# スイマープロット(各症例の観察期間)
+
+# これより多い症例は間引いて描く
+MAX_LIFETIME_ROWS = 2000
+
+
+def lifetime_rows(df, event_flag=1, max_rows=MAX_LIFETIME_ROWS):
+    '''
+    群ごとにdurationの順に並べた症例の表
+    max_rowsを超えるときは、各群で順位が等間隔になるように間引く (durationの分位点はそのまま残る)
+    Returns:
+        並べた表 (duration, event, entry, subgroup) と間引きの間隔
+    '''
+    rows = pd.DataFrame({'duration': df.duration.values.astype(float),
+                         'event': _event_observed(df, event_flag).astype(bool),
+                         'entry': np.zeros(len(df)) if _entry(df) is None else _entry(df).astype(float),
+                         'subgroup': df.subgroup.values})
+    step = max(1, -(-len(rows) // max_rows))
+    parts = []
+    for group in df.subgroup.unique():
+        part = rows[rows.subgroup == group].sort_values('duration', kind='mergesort')
+        if step > 1:
+            # 最長の症例は必ず残す
+            keep = np.unique(np.r_[np.arange(0, len(part), step), len(part) - 1])
+            part = part.iloc[keep]
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True), step
+
+
+def draw_lifetimes(df, color='gray', size=(8, 6), event_flag=1, max_rows=MAX_LIFETIME_ROWS,
+                   title='', xlabel='期間'):
+    '''
+    スイマープロット: 1症例を観察開始(entry)からdurationまでの1本の線で描く
+    線の色は群, ●はイベント。全症例を1つのCollectionで描き、症例が多いときはラスタライズする
+    '''
+    rows, step = lifetime_rows(df, event_flag=event_flag, max_rows=max_rows)
+    groups = list(df.subgroup.unique())
+    if color == 'gray':
+        palette = generate_grayscale(len(groups), white_value=0.6) if len(groups) > 1 else ['0.']
+    else:
+        palette = [color[i % len(color)] for i in range(len(groups))]
+    group_color = dict(zip(groups, palette))
+
+    fig, ax = plt.subplots(figsize=size, dpi=300)
+    n_rows = len(rows)
+    # 行が多いほど線を細くする (1行あたりの高さに収める)
+    linewidth = float(np.clip(size[1] * 72 * 0.7 / max(n_rows, 1), 0.1, 1.5))
+    plot_lifetimes(rows.duration.values, event_observed=rows.event.values, entry=rows.entry.values,
+                   sort_by_duration=False, colors=[group_color[g] for g in rows.subgroup],
+                   linewidth=linewidth, marker_size=float(np.clip(linewidth * 8, 1, 13)), ax=ax)
+
+    # 縦軸は群の名前 (群の区切りに線を引く)
+    counts = rows.subgroup.value_counts().reindex(groups).values
+    bounds = np.r_[0, np.cumsum(counts)]
+    ax.set_yticks((bounds[:-1] + bounds[1:] - 1) / 2)
+    ax.set_yticklabels(groups)
+    for b in bounds[1:-1]:
+        ax.axhline(b - 0.5, color='0.7', linewidth=0.5)
+    ax.invert_yaxis()
+    ax.set_xlabel(xlabel)
+    if step > 1:
+        title = f'{title}\n' if title else ''
+        title += f'{len(df)}例中{n_rows}例を表示 (各群で{step}例ごと)'
+    ax.set_title(title, fontsize=10)
+    handles = [Line2D([], [], color=group_color[g], label=g) for g in groups]
+    handles.append(Line2D([], [], color='black', marker='o', linestyle='None', markersize=4, label='イベント'))
+    ax.legend(handles=handles, loc='lower right', fontsize=8)
+    fig.tight_layout()
+    return fig
+
+
 #-----------------------------------
 #　画像ダウンロード
 
-def download_button(fig, filename):
+def figure_png(fig):
     buf = BytesIO()
     fig.savefig(buf, format='png', dpi=300)
-    buf.seek(0)
-    b64 = base64.b64encode(buf.read()).decode()
+    return buf.getvalue()
+
+
+def download_button(fig, filename):
+    # figは描画済みのFigureかPNGのbytes (キャッシュから取り出したもの)
+    png = fig if isinstance(fig, bytes) else figure_png(fig)
+    b64 = base64.b64encode(png).decode()
     href = f'<a href="data:file/png;base64,{b64}" download="{filename}.png">Download link: {filename} PNG(300 dpi)</a>'
     return href
 
 
+def summary_download_button(tables, filename, event_flag=1):
+    # 群ごとのevent_tableを多施設統合用の集計ファイル(JSON)としてダウンロード
+    b64 = base64.b64encode(dump_summary(tables, event_flag=event_flag).encode('utf-8')).decode()
+    href = f'<a href="data:application/json;base64,{b64}" download="{filename}.json">Download link: {filename} 集計ファイル(JSON)</a>'
+    return href
+
+
+def report_download_button(report, filename):
+    # 読み込み時に除外・修正した行の報告をCSVでダウンロード (Excelで開けるようにBOM付きUTF-8)
+    b64 = base64.b64encode(report.to_csv(index=False).encode('utf-8-sig')).decode()
+    href = f'<a href="data:text/csv;base64,{b64}" download="{filename}.csv">Download link: {filename} 報告(CSV)</a>'
+    return href
+
+
+def artifact_download_button(tables, filename, **kwargs):
+    # fit済みのKM, 検定結果, 図の体裁を解析ファイル(.kmc)としてダウンロード (行データは含まない)
+    b64 = base64.b64encode(dump_artifact(tables, **kwargs)).decode()
+    href = f'<a href="data:application/octet-stream;base64,{b64}" download="{filename}.kmc">Download link: {filename} 解析ファイル(kmc)</a>'
+    return href
+
+
+#-----------------------------------
+# ディスクキャッシュ (サーバーの再起動後も同じデータ・同じ条件なら再計算しない)
+@memoize
+def km_figure_png(tables, **kwargs):
+    fig = draw_km(tables, **kwargs)
+    png = figure_png(fig)
+    plt.close(fig)
+    return png
+
+
+@memoize
+def lifetimes_png(df, **kwargs):
+    fig = draw_lifetimes(df, **kwargs)
+    png = figure_png(fig)
+    plt.close(fig)
+    return png
+
+
+km_panels_png = memoize(draw_km_panels)
+cached_curve_payload = memoize(curve_payload)
+cached_group_event_tables = memoize(group_event_tables)
+cached_median_duration = memoize(median_duration)
+# 読み込みと行の検査はアップロードしたファイルの中身ごとに1回だけ
+cached_read_endpoints = memoize(read_endpoints)
+cached_endpoint_summary = memoize(endpoint_summary)
+cached_logrank_p_table = memoize(logrank_p_table)
+cached_stream_event_tables = memoize(stream_event_tables)
+cached_subgroup_hazard_ratios = memoize(subgroup_hazard_ratios)
+cached_landmark_analysis = memoize(landmark_analysis)
+cached_turnbull_fitters = memoize(turnbull_fitters)
+# ビニングまでをキャッシュし、バンド幅を変えたときは平滑化(FFT)だけやり直す
+cached_hazard_bins = memoize(hazard_bins)
+# 同じ条件・同じseedなら結果は同じなので、シミュレーションもキャッシュする
+cached_simulate_power = memoize(simulate_power)
+# 全モデルのfitはデータごとに1回だけ (表示するモデルを切り替えてもfitし直さない)
+cached_parametric_fits = memoize(fit_parametric_models)
+
+
+def show_interactive_km(area, download_area, tables, km_options, cache=True, export_tables=None):
+    '''
+    KM曲線をブラウザ側で描くインタラクティブ表示にする
+    論文用のPNG(Matplotlib)はボタンを押したときだけ作る
+    Args:
+        cache: Falseならディスクキャッシュを使わない (解析ファイルから読んだfit済みの曲線など)
+        export_tables: PNGを描く表 (近似モードのときの厳密なevent_table。Noneならtables)
+    '''
+    export_tables = tables if export_tables is None else export_tables
+    make_payload = cached_curve_payload if cache else curve_payload
+    curves = tables
+    if not km_options['by_subgroup'] and len(tables) > 1:
+        # 全体集団のときはPNG(draw_km)と同じく併合した1本の曲線にする
+        curves = {'全体': fit_pooled_km(tables)}
+    payload = make_payload(curves, color=km_options['color'],
+                           linestyles=km_options['style_choice_list'] if km_options['linestyle_choice'] else None,
+                           ci_band=km_options.get('ci_band') if km_options['ci'] else None)
+    html = chart_html(payload, title=km_options['title'], xlabel=km_options['xlabel'], ylabel=km_options['ylabel'],
+                      ci=km_options['ci'], censor=km_options['censor'])
+    with area.container():
+        components.html(html, height=540)
+    with download_area.container():
+        if st.button('論文用のPNG(300 dpi)を作成'):
+            km_png = km_figure_png(export_tables, **km_options) if cache else draw_km(export_tables, **km_options)
+            st.markdown(download_button(km_png, "km_curve"), unsafe_allow_html=True)
+
+
+def show_parametric_models(fit_tables, fits, models, color='gray', size=(8, 4)):
+    '''
+    パラメトリックモデルのAIC, BICの比較表と当てはまりの確認の図
+    Args:
+        fit_tables: fitに使った {群名: event_table}
+        fits: cached_parametric_fitsの結果 (全群 × 全モデル)
+        models: KM曲線に重ねた {群名: ParametricFit}
+    '''
+    st.text('●パラメトリックモデルの比較(AICの小さい順)')
+    st.table(parametric_ranking(fits))
+    not_converged = [f'{group}: {fit.label}' for group, m in fits.items() for fit in m.values() if not fit.converged]
+    if not_converged:
+        st.text('収束しなかったモデル: ' + ', '.join(not_converged))
+    with st.expander('パラメトリックモデルの当てはまり(QQプロット, 累積分布)'):
+        st.pyplot(draw_parametric_diagnostics(fit_tables, models, color=color, size=size))
+
+
+def show_landmark_analysis(tables, pairs=None, color='gray', size=(8, 6), title='', xlabel='期間', ylabel='生存率',
+                           censor=True, ci=False, ci_band=None, at_risk=True, fontname='Arial'):
+    '''
+    ランドマーク時点ごとの条件付き生存曲線(1時点1パネル), 中央値, Logrank検定
+    群ごとのKMは1回だけfitし、各時点の曲線はその推定値を切り詰めて割り直す
+    '''
+    st.text('●ランドマーク解析(条件付き生存)')
+    with st.expander('ある時点で生存していた症例の生存曲線と検定'):
+        text = st.text_input('ランドマーク時点(カンマ区切り, durationの単位)', value='')
+        if not text:
+            return
+        try:
+            landmarks = parse_landmarks(text)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        result = cached_landmark_analysis(tables, landmarks, pairs=pairs)
+        panel_curves = {(f'{landmark:g}', group): kmf for landmark, curves in result['curves'].items()
+                        for group, kmf in curves.items()}
+        if panel_curves:
+            png = draw_km_panels(panel_curves, color=color, facet='ランドマーク', ncols=min(3, len(landmarks)),
+                                 panel_size=(size[0] / 2, size[1] / 2), title=title, xlabel=xlabel, ylabel=ylabel,
+                                 censor=censor, ci=ci, ci_band=ci_band, at_risk=at_risk, fontname=fontname)
+            st.image(png)
+            st.markdown(download_button(png, "landmark_km_curve"), unsafe_allow_html=True)
+        st.table(result['median'])
+        if 'logrank' in result:
+            show_p_table(st.empty(), result['logrank'])
+
+
+def show_hazard(tables, color='gray', size=(8, 4), ci=False, title='', xlabel='期間'):
+    '''
+    平滑化したハザード関数の図 (バンド幅は自動選択か手動)
+    '''
+    st.text('●ハザード関数(カーネル平滑化)')
+    with st.expander('群ごとのハザード関数の形'):
+        bins = cached_hazard_bins(tables)
+        auto = st.checkbox('バンド幅を自動で選ぶ(クロスバリデーション)', value=True)
+        bandwidth = None
+        if not auto:
+            span = max(binned['grid'][-1] for binned in bins.values())
+            bandwidth = st.slider(f'バンド幅({xlabel})', min_value=float(span / 200), max_value=float(span / 2),
+                                  value=float(span / 10))
+        fig, used = draw_hazard(bins, bandwidth=bandwidth, color=color, size=size, ci=ci, title=title, xlabel=xlabel)
+        st.pyplot(fig)
+        st.markdown(download_button(fig, "hazard"), unsafe_allow_html=True)
+        st.text('バンド幅: ' + ', '.join(f'{group} {b:.3g}' for group, b in used.items()))
+
+
+def show_power_simulation(tables, xlabel='期間'):
+    '''
+    アップロードした曲線を生成モデルにした、次の試験の検出力・症例数のシミュレーション
+    Args:
+        tables: {群名: event_table} (KMまたはパラメトリックモデルをfitして生成モデルにする)
+    '''
+    st.text('●検出力・症例数のシミュレーション(logrank検定)')
+    groups = list(tables)
+    with st.expander('この曲線を想定した試験の検出力と必要な症例数'):
+        if len(groups) < 2:
+            st.text('2群以上のデータが必要です。')
+            return
+        horizon = float(max(fit_km_table(table).timeline[-1] for table in tables.values()))
+        with st.form('power_simulation'):
+            col1, col2, col3 = st.columns(3)
+            control = col1.selectbox('対照群', groups)
+            treatment = col2.selectbox('試験群', groups, index=1)
+            source = col3.selectbox('生成モデル', ['KM曲線'] + list(DISTRIBUTIONS.values()))
+            col1, col2, col3 = st.columns(3)
+            accrual = col1.number_input(f'登録期間({xlabel})', min_value=0.0, value=round(horizon / 2, 2))
+            follow_up = col2.number_input(f'登録終了後の追跡期間({xlabel})', min_value=0.0, value=round(horizon / 2, 2))
+            dropout = col3.number_input('脱落率(単位期間あたりのハザード)', min_value=0.0, value=0.0, format='%.4f')
+            col1, col2, col3 = st.columns(3)
+            n_min = col1.number_input('症例数(最小)', min_value=4, value=100, step=10)
+            n_max = col2.number_input('症例数(最大)', min_value=4, value=1000, step=10)
+            n_step = col3.number_input('症例数(刻み)', min_value=1, value=100, step=10)
+            col1, col2, col3, col4 = st.columns(4)
+            allocation = col1.number_input('試験群の割合', min_value=0.05, max_value=0.95, value=0.5)
+            alpha = col2.number_input('有意水準(両側)', min_value=0.001, max_value=0.5, value=0.05, format='%.3f')
+            replicates = col3.selectbox('試験の数', (500, 1000, 2000, 5000), index=1)
+            seed = col4.number_input('乱数のseed', min_value=0, value=0, step=1)
+            submitted = st.form_submit_button('シミュレーション')
+        if not submitted:
+            return
+        if control == treatment:
+            st.error('対照群と試験群には別の群を選んでください。')
+            return
+        if n_max < n_min:
+            # フォームの中では入力の最小値を連動させられないので、実行時に確かめる
+            st.error('症例数(最大)は症例数(最小)以上にしてください。')
+            return
+        if source == 'KM曲線':
+            # KMの追跡期間より先ではイベントが起きないとみなす (外挿するときはパラメトリックモデルを選ぶ)
+            models = (km_model(fit_km_table(tables[control])), km_model(fit_km_table(tables[treatment])))
+        else:
+            name = {label: name for name, label in DISTRIBUTIONS.items()}[source]
+            fits = cached_parametric_fits({g: tables[g] for g in (control, treatment)}, [name])
+            models = (parametric_model(fits[control][name]), parametric_model(fits[treatment][name]))
+        sizes = list(range(int(n_min), int(n_max) + 1, int(n_step)))
+        result = cached_simulate_power(models, sizes, replicates=replicates, accrual=accrual, follow_up=follow_up,
+                                       allocation=allocation, dropout=dropout, alpha=alpha, seed=int(seed))
+        st.pyplot(draw_power_curve(result))
+        required = required_sample_size(result)
+        st.text('検出力80%に必要な症例数(補間): ' + ('範囲内で届きません' if np.isnan(required) else f'約{np.ceil(required):.0f}例'))
+        st.table(result)
+
+
 def color_sample(color):
     return f'<span style="display:inline-block; width:12px; height:12px; margin-right:4px; border:1px solid #ccc; background-color:{color};"></span>'
         
 
+# スタイルのプリセット(JSON)
+STYLE_PRESET_FORMAT = 'km-style-preset'
+CUSTOM_COLORS = {
+    "Gray": "#808080",
+    "Navy Blue": "#000080",
+    "Forest Green": "#228B22",
+    "Crimson Red": "#DC143C",
+    "Goldenrod Yellow": "#DAA520",
+    "Royal Purple": "#7851A9",
+    "Teal": "#008080",
+    "Salmon Pink": "#FA8072",
+    "Slate Gray": "#708090",
+    "Orchid Purple": "#DA70D6",
+    "Olive Green": "#808000"
+}
+CUSTOM_STYLES = {
+    # '&#8209;&#8209;&#8209;' # ラジオボタンではこちら
+    '---': 'solid', 
+    # '&#8209; &#8209;' # ラジオボタンではこちら
+    '- -': 'dashed', 
+    '-•-': 'dashdot', 
+    '•••': 'dotted'
+}
+
+
+def dump_style_preset(choices):
+    '''
+    群ごとの色と線種の選択をプリセット(JSON)の文字列にする
+    Args:
+        choices: {群名: (色の名前, 線種のキー)}
+    '''
+    return json.dumps({'format': STYLE_PRESET_FORMAT, 'version': 1,
+                       'groups': {str(g): {'color': c, 'style': s} for g, (c, s) in choices.items()}},
+                      ensure_ascii=False)
+
+
+def load_style_preset(text):
+    '''
+    Returns:
+        {群名: (色の名前, 線種のキー)} (このAppにない色, 線種は読み飛ばす)
+    '''
+    preset = json.loads(text)
+    if preset.get('format') != STYLE_PRESET_FORMAT:
+        raise ValueError('スタイルのプリセットの形式ではありません。')
+    return {group: (choice.get('color'), choice.get('style')) for group, choice in preset['groups'].items()}
+
+
+def _apply_style_preset(preset_file, subgroup):
+    # 同じファイルを何度も当てるとフォームで変えた選択が戻ってしまうので、新しいファイルのときだけ反映する
+    file_id = getattr(preset_file, 'file_id', preset_file.name)
+    if st.session_state.get('_style_preset_id') == file_id:
+        return
+    st.session_state['_style_preset_id'] = file_id
+    try:
+        preset = load_style_preset(preset_file.getvalue().decode('utf-8'))
+    except ValueError as e:
+        st.error(str(e))
+        return
+    for group in subgroup:
+        color_name, style_name = preset.get(str(group), (None, None))
+        if color_name in CUSTOM_COLORS:
+            st.session_state[f'color:{group}'] = color_name
+        if style_name in CUSTOM_STYLES:
+            st.session_state[f'style:{group}'] = style_name
+
+
 def custom_color_and_style(subgroup: list):
-    colors = {
-        "Gray": "#808080",
-        "Navy Blue": "#000080",
-        "Forest Green": "#228B22",
-        "Crimson Red": "#DC143C",
-        "Goldenrod Yellow": "#DAA520",
-        "Royal Purple": "#7851A9",
-        "Teal": "#008080",
-        "Salmon Pink": "#FA8072",
-        "Slate Gray": "#708090",
-        "Orchid Purple": "#DA70D6",
-        "Olive Green": "#808000"
-    }
-    
+    '''
+    群ごとの色と線種を選ぶ
+    選択はフォームにまとめ、「適用」を押したときだけ再実行する (群ごとの選択のたびに再計算しない)
+    '''
     # カラーサンプルをHTMLで生成する関数
     def color_sample(color):
         return f'<span style="display:inline-block; width:12px; height:12px; margin-right:4px; border:1px solid #ccc; background-color:{color};"></span>'
 
-    styles = {
-        # '&#8209;&#8209;&#8209;' # ラジオボタンではこちら
-        '---': 'solid', 
-        # '&#8209; &#8209;' # ラジオボタンではこちら
-        '- -': 'dashed', 
-        '-•-': 'dashdot', 
-        '•••': 'dotted'
-    }
-    style_key = list(styles.keys())
-    
-    output_color = []
-    output_style = []
-    
+    style_key = list(CUSTOM_STYLES.keys())
+    color_names = list(CUSTOM_COLORS.keys())
     
     with st.expander('色とスタイルの選択'):
         # カラーサンプルを2行6列のグリッドで表示
-        color_names = list(colors.keys())
         for i in range(0, len(color_names), 6):
             cols = st.columns(6)
             for col, color_name in zip(cols, color_names[i:i+6]):
-                col.markdown(f"<span style='display:inline-block; width:12px; height:12px; margin-right:4px; border:1px solid #ccc; background-color:{colors[color_name]};'></span> {color_name}", 
+                col.markdown(f"{color_sample(CUSTOM_COLORS[color_name])} {color_name}", 
                              unsafe_allow_html=True)
-        for group in subgroup:
-            st.write('---')
-            st.write(group)
-
-            col1, col2 = st.columns(2)
-            with col1:
-                color_choice = st.selectbox(f'color:{group}', list(colors.keys()))
-            with col2:
-                style_choice = st.selectbox(f'style:{group}', style_key)
-
-            output_color.append(colors[color_choice])
-            output_style.append(styles[style_choice])
-    
+        preset_file = st.file_uploader('プリセットの読み込み(JSON)', type=['json'], key='style_preset_file')
+        if preset_file is not None:
+            _apply_style_preset(preset_file, subgroup)
+
+        # フォームの中の選択は「適用」を押したときにまとめて反映される
+        choices = {}
+        with st.form('custom_color_and_style'):
+            for group in subgroup:
+                st.write('---')
+                st.write(group)
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    color_choice = st.selectbox(f'color:{group}', color_names, key=f'color:{group}')
+                with col2:
+                    style_choice = st.selectbox(f'style:{group}', style_key, key=f'style:{group}')
+                choices[group] = (color_choice, style_choice)
+            st.form_submit_button('適用')
+
+        b64 = base64.b64encode(dump_style_preset(choices).encode('utf-8')).decode()
+        st.markdown(f'<a href="data:application/json;base64,{b64}" download="km_style.json">Download link: 現在のスタイルをプリセット(JSON)として保存</a>',
+                    unsafe_allow_html=True)
+
+    output_color = [CUSTOM_COLORS[color_name] for color_name, _ in choices.values()]
+    output_style = [CUSTOM_STYLES[style_name] for _, style_name in choices.values()]
     return output_color, output_style
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+
+# 報告の「処理」列
+DROP = '除外'
+FIX = '修正'
+REPORT_COLUMNS = ['エンドポイント', 'シート', '行', '列', '値', '処理', '理由']
+# Excelの行番号 = DataFrameの位置 + 2 (1行目は列名)
+FIRST_ROW = 2
+
+
+#-----------------------------------
+# 列ごとのチェック (すべて列単位の演算で、行ごとのループはしない)
+def _numeric(df, column, name, issues, blank_action=DROP, blank_reason='空欄'):
+    '''
+    列を数値にそろえる。数値にできない値は除外、数字の文字列は数値に直して報告する
+    Returns:
+        (数値の列 (空欄はNaN), 空欄か)
+    '''
+    values = df[column]
+    numeric = pd.to_numeric(values, errors='coerce').astype(float)
+    blank = values.isna()
+    if blank_action is not None:
+        issues.append((blank, name, blank_action, blank_reason))
+    issues.append((numeric.isna() & ~blank, name, DROP, '数値ではない'))
+    if values.dtype == object:
+        # 数値のセルは元の値と等しく、文字列の数字 ('7' != 7.0) だけが等しくない
+        text_number = numeric.notna().values & (values.values != numeric.values)
+        issues.append((text_number, name, FIX, '文字列の数字を数値に変換'))
+    return numeric, blank
+
+
+def _labels(df, issues):
+    # subgroupを文字列にそろえる (数値と文字列が混ざっていても 1, 1.0, '1' は同じ群)
+    # 群の種類は行数よりずっと少ないので、factorizeした種類ごとに判定して行に戻す
+    if 'subgroup' not in df.columns:
+        return pd.Series('None', index=df.index)
+    codes, uniques = pd.factorize(df['subgroup'])
+    uniques = pd.Series(uniques, dtype=object)
+    text = uniques.map(lambda v: isinstance(v, str)).values.astype(bool)
+    numeric = pd.to_numeric(uniques.where(~text), errors='coerce')
+    whole = (numeric.notna() & np.isfinite(numeric) & (numeric == np.round(numeric))).values
+    labels = uniques.astype(str)
+    labels[whole] = numeric[whole].astype('int64').astype(str)
+    stripped = labels.str.strip()
+    blank = np.r_[text & (stripped == '').values, True]
+    stripped = np.append(stripped.where(~blank[:-1], 'None').values, 'None')
+    # codes == -1 (空欄) は末尾の 'None' を指す
+    codes = np.where(codes < 0, len(uniques), codes)
+    changed = np.r_[text & (stripped[:-1] != labels.values), False]
+    issues.append((changed[codes] & ~blank[codes], 'subgroup', FIX, '前後の空白を削除'))
+    if text[~blank[:-1]].any() and (~text & ~blank[:-1]).any():
+        issues.append((np.r_[~text, False][codes], 'subgroup', FIX, '数値のラベルを文字列に統一'))
+    issues.append((blank[codes], 'subgroup', FIX, '空欄のため None'))
+    return pd.Series(stripped[codes], index=df.index)
+
+
+def _weights(df, issues):
+    weight, _ = _numeric(df, 'weight', 'weight', issues)
+    issues.append(((weight < 0) | np.isinf(weight), 'weight', DROP, '負または無限大'))
+    return weight
+
+
+#-----------------------------------
+# 報告
+def _report(raw, issues, names):
+    parts = []
+    for mask, column, action, reason in issues:
+        rows = np.flatnonzero(np.asarray(mask, dtype=bool))
+        if len(rows) == 0:
+            continue
+        source = names.get(column, column)
+        parts.append(pd.DataFrame({'行': raw.index.values[rows] + FIRST_ROW, '列': source,
+                                   '値': raw[column].iloc[rows].astype(str).values,
+                                   '処理': action, '理由': reason}))
+    if not parts:
+        return pd.DataFrame(columns=REPORT_COLUMNS[2:])
+    return pd.concat(parts, ignore_index=True).sort_values('行', kind='stable').reset_index(drop=True)
+
+
+def _apply(df, raw, issues, names):
+    drop = np.zeros(len(df), dtype=bool)
+    for mask, _, action, _ in issues:
+        if action == DROP:
+            drop |= np.asarray(mask, dtype=bool)
+    return df[~drop].reset_index(drop=True), _report(raw, issues, names)
+
+
+def clean_survival(df, names=None):
+    '''
+    duration, eventのデータを1回で検査して型をそろえ、使えない行を除く
+    Args:
+        df: 列名をduration, event(, subgroup, entry, weight)にそろえたDataFrame (indexはシートの行の位置)
+        names: {解析用の列名: 元の列名} 報告に元の列名を書くため
+    Returns:
+        (解析用のDataFrame, 除外・修正した行の報告 DataFrame(行, 列, 値, 処理, 理由))
+    '''
+    issues = []
+    duration, _ = _numeric(df, 'duration', 'duration', issues)
+    issues.append(((duration < 0) | np.isinf(duration), 'duration', DROP, '負または無限大'))
+    event, _ = _numeric(df, 'event', 'event', issues)
+    issues.append((event.notna() & ~event.isin([0, 1]), 'event', DROP, '0, 1以外'))
+    clean = df.assign(duration=duration, event=event.fillna(0).astype(int), subgroup=_labels(df, issues))
+    if 'entry' in df.columns:
+        entry, _ = _numeric(df, 'entry', 'entry', issues, blank_action=None)
+        issues.append(((entry < 0) | np.isinf(entry), 'entry', DROP, '負または無限大'))
+        issues.append(((entry > duration) & (duration >= 0), 'entry', DROP, 'durationより後'))
+        clean['entry'] = entry.fillna(0)
+    if 'weight' in df.columns:
+        clean['weight'] = _weights(df, issues)
+    return _apply(clean, df, issues, names or {})
+
+
+def clean_interval(df, names=None):
+    '''
+    区間打ち切りデータ(lower, upper)を1回で検査して型をそろえ、使えない行を除く
+    upperが空欄なら右側打ち切り(inf), lowerが空欄なら0から (どちらも空欄の行は除外)
+    Returns:
+        (解析用のDataFrame, 除外・修正した行の報告)
+    '''
+    issues = []
+    lower, lower_blank = _numeric(df, 'lower', 'lower', issues, blank_action=None)
+    upper, upper_blank = _numeric(df, 'upper', 'upper', issues, blank_action=None)
+    issues.append((lower_blank & upper_blank, 'lower', DROP, 'lower, upperとも空欄'))
+    lower, upper = lower.fillna(0.), upper.fillna(np.inf)
+    issues.append(((lower < 0) | np.isinf(lower), 'lower', DROP, '負または無限大'))
+    issues.append((upper < 0, 'upper', DROP, '負の値'))
+    issues.append((lower > upper, 'lower', DROP, 'upperより大きい'))
+    clean = df.assign(lower=lower, upper=upper, subgroup=_labels(df, issues))
+    if 'weight' in df.columns:
+        clean['weight'] = _weights(df, issues)
+    return _apply(clean, df, issues, names or {})
+
+
+def summarize_report(report):
+    '''
+    報告を理由ごとの件数にまとめる (画面に出す用)
+    '''
+    if len(report) == 0:
+        return pd.DataFrame(columns=['エンドポイント', '列', '処理', '理由', '件数'])
+    return report.groupby(['エンドポイント', '列', '処理', '理由'], sort=False).size().rename('件数').reset_index()